@@ -0,0 +1,224 @@
+"""File: analysis_cache.py
+- Persistent local cache of audio analyses, so a file we have already
+  analyzed is not decoded, uploaded and analyzed again on every run.
+
+- Entries are keyed by the SHA-1 of the file's content, plus
+  ANALYZER_VERSION.  Renamed or copied files still hit; bump
+  ANALYZER_VERSION to invalidate every entry when the analysis changes.
+- Each entry is one .npz file holding the bars, beats and segments: timing,
+  pitches and loudness, which beats belong to which bar, and the
+  tempo/time_signature dicts.  Bars and beats keep their mean_pitches() and
+  mean_loudness() as the analyzer computed them, so matching gives exactly
+  the same results from the cache.
+
+- load_audio_file() returns a CachedAudioFile on a hit.  It has the same
+  .analysis interface JamTune uses.  The audio itself is only decoded (with
+  audio.AudioData, locally) if something asks for samples, eg getpieces()
+  when rendering.
+
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+
+import echonest.remix.audio as audio
+
+# Part of every cache key.  Bump to invalidate all entries.
+ANALYZER_VERSION = 'echonest-remix-1'
+
+
+def file_content_hash(filename, block_size=1 << 20):
+    """SHA-1 hex digest of a file's content."""
+    sha1 = hashlib.sha1()
+    in_file = open(filename, 'rb')
+    block = in_file.read(block_size)
+    while block:
+        sha1.update(block)
+        block = in_file.read(block_size)
+    in_file.close()
+    return sha1.hexdigest()
+
+
+def quantum_arrays(quanta, prefix):
+    """Timing, mean pitches and mean loudness of beats or bars, as arrays."""
+    return {prefix + '_start': np.array([quantum.start for quantum in quanta], dtype=float),
+            prefix + '_duration': np.array([quantum.duration for quantum in quanta],
+                                           dtype=float),
+            prefix + '_pitches': np.array([quantum.mean_pitches() for quantum in quanta],
+                                          dtype=float).reshape(len(quanta), 12),
+            prefix + '_loudness': np.array([quantum.mean_loudness() for quantum in quanta],
+                                           dtype=float)}
+
+
+def segment_arrays(segments):
+    """Timing, pitches and loudness of segments, as arrays."""
+    return {'segment_start': np.array([segment.start for segment in segments], dtype=float),
+            'segment_duration': np.array([segment.duration for segment in segments],
+                                         dtype=float),
+            'segment_pitches': np.array([segment.pitches for segment in segments],
+                                        dtype=float).reshape(len(segments), 12),
+            'segment_loudness_max': np.array([segment.loudness_max for segment in segments],
+                                             dtype=float)}
+
+
+class CachedQuantum(audio.AudioQuantum):
+    """A beat, bar or segment rebuilt from the cache.
+    - Only what matching and getpieces() use: start, duration,
+      mean_pitches(), mean_loudness() and children().
+    """
+    def __init__(self, start, duration, pitches, loudness, children=None):
+        self.start = start
+        self.duration = duration
+        self.pitches = pitches
+        self.loudness_max = loudness
+        self._children = children or []
+
+    def mean_pitches(self):
+        return list(self.pitches)
+
+    def mean_loudness(self):
+        return self.loudness_max
+
+    def children(self):
+        return self._children
+
+
+class CachedAnalysis(object):
+    """bars, beats, segments, tempo and time_signature, as on an analysis."""
+    def __init__(self, arrays):
+        self.tempo, self.time_signature = json.loads(str(arrays['metadata']))
+        self.beats = self.quanta(arrays, 'beat')
+        self.bars = self.quanta(arrays, 'bar',
+                                [self.beats[first:first + count]
+                                 for first, count in zip(arrays['bar_first_beat'].tolist(),
+                                                         arrays['bar_num_beats'].tolist())])
+        self.segments = [CachedQuantum(start, duration, list(pitches), loudness)
+                         for start, duration, pitches, loudness
+                         in zip(arrays['segment_start'].tolist(),
+                                arrays['segment_duration'].tolist(),
+                                arrays['segment_pitches'].tolist(),
+                                arrays['segment_loudness_max'].tolist())]
+
+    def quanta(self, arrays, prefix, children=None):
+        starts = arrays[prefix + '_start'].tolist()
+        if children == None:
+            children = [None] * len(starts)
+        return [CachedQuantum(start, duration, pitches, loudness, kids)
+                for start, duration, pitches, loudness, kids
+                in zip(starts,
+                       arrays[prefix + '_duration'].tolist(),
+                       arrays[prefix + '_pitches'].tolist(),
+                       arrays[prefix + '_loudness'].tolist(),
+                       children)]
+
+
+class CachedAudioFile(object):
+    """Stands in for audio.LocalAudioFile when the analysis is cached.
+    - analysis: CachedAnalysis
+    - Anything else (sampleRate, slicing by quantum, encode ...) decodes the
+      file with audio.AudioData on first use, and goes to that.
+    """
+    def __init__(self, filename, analysis):
+        self.filename = filename
+        self.analysis = analysis
+        self._audio_data = None
+
+    @property
+    def audio_data(self):
+        if self._audio_data == None:
+            self._audio_data = audio.AudioData(self.filename)
+        return self._audio_data
+
+    def release_audio(self):
+        """Drop the decoded audio, eg once it is rendered.  It is decoded
+        again if anything asks for it.
+        """
+        self._audio_data = None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.audio_data, name)
+
+    def __getitem__(self, index):
+        return self.audio_data[index]
+
+
+class AnalysisCache(object):
+    """Directory of cached analyses.
+    - refresh: ignore existing entries (and overwrite them) - to invalidate.
+    """
+    def __init__(self, cache_dir, refresh=False):
+        self.cache_dir = cache_dir
+        self.refresh = refresh
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def cache_filename(self, filename):
+        key = hashlib.sha1(file_content_hash(filename) + ANALYZER_VERSION).hexdigest()
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def load(self, filename):
+        """Return a CachedAudioFile for filename, or None if not cached."""
+        cache_filename = self.cache_filename(filename)
+        if self.refresh or not os.path.exists(cache_filename):
+            return None
+        arrays = np.load(cache_filename)
+        analysis = CachedAnalysis(arrays)
+        arrays.close()
+        return CachedAudioFile(filename, analysis)
+
+    def save(self, filename, audio_file):
+        """Write the analysis of audio_file (eg a LocalAudioFile) for filename."""
+        arrays = analysis_arrays(audio_file)
+        # Write then rename, so a crash never leaves a partial entry.
+        cache_filename = self.cache_filename(filename)
+        out_fd, temp_filename = tempfile.mkstemp(suffix='.npz', dir=self.cache_dir)
+        out_file = os.fdopen(out_fd, 'wb')
+        np.savez(out_file, **arrays)
+        out_file.close()
+        os.rename(temp_filename, cache_filename)
+        return cache_filename
+
+
+def analysis_arrays(audio_file):
+    """The analysis of audio_file as a dict of arrays - what the cache stores.
+    - Small and picklable.  CachedAnalysis(arrays) rebuilds the analysis.
+    """
+    analysis = audio_file.analysis
+    beat_indexes = dict((id(beat), index) for index, beat in enumerate(analysis.beats))
+    bar_first_beat = []
+    bar_num_beats = []
+    for bar in analysis.bars:
+        bar_beats = [beat_indexes[id(beat)] for beat in bar.children()]
+        # Beats of a bar are consecutive, so only the first and how many are kept.
+        first_beat = (bar_beats or [0])[0]
+        assert(bar_beats == range(first_beat, first_beat + len(bar_beats)))
+        bar_first_beat.append(first_beat)
+        bar_num_beats.append(len(bar_beats))
+    arrays = {'metadata': np.array(json.dumps([analysis.tempo,
+                                               analysis.time_signature])),
+              'bar_first_beat': np.array(bar_first_beat, dtype=int),
+              'bar_num_beats': np.array(bar_num_beats, dtype=int)}
+    arrays.update(quantum_arrays(analysis.beats, 'beat'))
+    arrays.update(quantum_arrays(analysis.bars, 'bar'))
+    arrays.update(segment_arrays(getattr(analysis, 'segments', None) or []))
+    return arrays
+
+
+def load_audio_file(filename, analysis_cache=None):
+    """Return the analyzed audio file - from analysis_cache if it's there,
+    else analyzed by audio.LocalAudioFile (and then cached).
+    """
+    if analysis_cache != None:
+        audio_file = analysis_cache.load(filename)
+        if audio_file != None:
+            return audio_file
+    audio_file = audio.LocalAudioFile(filename)
+    if analysis_cache != None:
+        analysis_cache.save(filename, audio_file)
+    return audio_file
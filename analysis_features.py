@@ -0,0 +1,134 @@
+"""File: analysis_features.py
+- AnalysisFeatures: arrays pulled out of an audio analysis once, so matching
+  code can work on whole arrays instead of calling mean_pitches() etc on each
+  beat and bar every time.
+
+- Nothing in here depends on the changes (TuneInfo) - only on the audio.
+
+- Loudness and chroma peakiness per beat and bar are kept too, for finding
+  drum solos and breaks (see drum_bars).  Peakiness is how far the loudest
+  pitch class stands out from the mean: (max - mean) / max.  Near 0 for
+  flat, drum-like chroma; near 1 for a few clear notes.
+
+"""
+
+import numpy as np
+
+from chord import as_tone_matrix
+from chord import rank_tone_vectors
+from chord import match_tone_features
+
+# A bar is drums-only if its chroma is this flat (peakiness at most this) ...
+# - Not fit to labelled recordings yet.  Chosen between reference chroma
+#   normalized to a max of 1: a triad or seventh chord at 1 over a 0.3 floor
+#   has peakiness 0.525 or 0.467, and broadband chroma, every pitch class
+#   between 0.5 and 1 (drums, cymbals), about 0.22.
+DRUMS_MAX_PEAKINESS = 0.35
+# ... and it is loud: at least this many dB relative to the average bar.
+# - Also a starting value: drum solos are rarely much quieter than the band,
+#   while breaks (the other flat-chroma bars) are.  -3 dB is half the
+#   average bar's power.
+DRUMS_MIN_LOUDNESS = -3.0
+
+
+def chroma_peakiness(tones):
+    """(max - mean) / max of each row of tones - 0 where a row is all 0."""
+    tones = np.asarray(tones, dtype=float)
+    if len(tones) == 0:
+        return np.zeros(0)
+    maxes = tones.max(axis=1)
+    return np.where(maxes > 0, (maxes - tones.mean(axis=1)) / np.maximum(maxes, 1e-12), 0.0)
+
+
+def drum_bars(bar_peakiness, bar_loudness, average_loudness,
+              max_peakiness=DRUMS_MAX_PEAKINESS, min_loudness=DRUMS_MIN_LOUDNESS):
+    """Bool array, True for each bar that looks drums-only: flat chroma,
+    but not quiet.
+    """
+    return ((bar_peakiness <= max_peakiness) &
+            (bar_loudness - average_loudness >= min_loudness))
+
+
+class AnalysisFeatures(object):
+    """Per-beat and per-bar arrays for one audio analysis.
+    - beat_tones: num_beats x 12 array of beat mean_pitches()
+    - bar_tones: num_bars x 12 array of bar mean_pitches()
+    - bar_beats: num_bars x max_beats_per_bar array of indexes into beats,
+      for each bar's children(), in order.  Padded with 0 - see bar_beat_mask.
+    - bar_beat_mask: True where bar_beats holds a real beat index.
+    - beat_ranks, bar_ranks: (max_ranks, min_ranks) of the tone vectors, from
+      chord.rank_tone_vectors.  Sorted on first use, then shared by every scorer.
+    - quality_features(): match_tone_vector sub-scores for a chord quality,
+      cached for linear scorers (see scorers.LinearScorer).
+    - beat_loudness, bar_loudness: mean_loudness() of each beat and bar.
+    - beat_peakiness, bar_peakiness: chroma_peakiness() of the tone vectors.
+    """
+    def __init__(self, beats, bars):
+        self.beat_tones = as_tone_matrix([beat.mean_pitches() for beat in beats])
+        self.bar_tones = as_tone_matrix([bar.mean_pitches() for bar in bars])
+        self.beat_loudness = np.array([beat.mean_loudness() for beat in beats], dtype=float)
+        self.bar_loudness = np.array([bar.mean_loudness() for bar in bars], dtype=float)
+        self.beat_peakiness = chroma_peakiness(self.beat_tones)
+        self.bar_peakiness = chroma_peakiness(self.bar_tones)
+        self.bar_beats, self.bar_beat_mask = self.calc_bar_beats(beats, bars)
+        self._beat_ranks = None
+        self._bar_ranks = None
+        # quality -> (beat_features, bar_features)
+        self._quality_features = {}
+
+    def __getstate__(self):
+        """Pickle only the arrays - ranks and quality features are rebuilt on use."""
+        state = self.__dict__.copy()
+        state['_beat_ranks'] = None
+        state['_bar_ranks'] = None
+        state['_quality_features'] = {}
+        return state
+
+    @property
+    def num_beats(self):
+        return len(self.beat_tones)
+
+    @property
+    def num_bars(self):
+        return len(self.bar_tones)
+
+    @property
+    def beat_ranks(self):
+        if self._beat_ranks == None:
+            self._beat_ranks = rank_tone_vectors(self.beat_tones)
+        return self._beat_ranks
+
+    @property
+    def bar_ranks(self):
+        if self._bar_ranks == None:
+            self._bar_ranks = rank_tone_vectors(self.bar_tones)
+        return self._bar_ranks
+
+    def quality_features(self, template):
+        """match_tone_vector sub-scores of every beat and bar, against a chord
+        quality at all 12 roots.
+        - template: chord.ChordTemplate
+        - return: (beat_features, bar_features) - 12 x num_beats x F and
+          12 x num_bars x F arrays (see chord.match_tone_features)
+        """
+        if template.quality not in self._quality_features:
+            self._quality_features[template.quality] = (
+                match_tone_features(self.beat_tones, template.root_masks,
+                                    template.anti_note_count, ranks=self.beat_ranks),
+                match_tone_features(self.bar_tones, template.root_masks,
+                                    template.anti_note_count, ranks=self.bar_ranks))
+        return self._quality_features[template.quality]
+
+    def calc_bar_beats(self, beats, bars):
+        """Map each bar's children() to indexes into beats."""
+        # children() returns the same beat objects that are in beats.
+        beat_to_index = dict((id(beat), index) for index, beat in enumerate(beats))
+        bar_beat_lists = [[beat_to_index[id(beat)] for beat in bar.children()]
+                          for bar in bars]
+        max_beats = max([len(bar_beat_list) for bar_beat_list in bar_beat_lists] + [0])
+        bar_beats = np.zeros((len(bars), max_beats), dtype=int)
+        bar_beat_mask = np.zeros((len(bars), max_beats), dtype=bool)
+        for bar_index, bar_beat_list in enumerate(bar_beat_lists):
+            bar_beats[bar_index, :len(bar_beat_list)] = bar_beat_list
+            bar_beat_mask[bar_index, :len(bar_beat_list)] = True
+        return bar_beats, bar_beat_mask
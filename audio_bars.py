@@ -6,16 +6,107 @@
 - Maybe we can actually get up to the audio_analysis from a bar, but I didn't see
   how.
 
+- BeatBar is a bar made of beats, for bars whose bar lines are moved off
+  the analyzer's (see JamTune.aligned_bars).  It has a start and duration
+  like an analysis bar, so it renders the same way.
+
+- render_audio_bars() renders a whole jam in one copy: the length of every
+  bar is worked out from the bar timings first (as getpieces() does it), then
+  the output is allocated once and each bar's samples are copied straight
+  into place.  Peak memory is the output plus one bar (and the decoded
+  sources, which are dropped after their last bar where they can be), and
+  time is linear in the output length.
+
 """
 
 import echonest.remix.audio as audio
 
+class BeatBar(object):
+    """A bar of consecutive analysis beats, from its first beat's start to
+    its last beat's end.
+    """
+    def __init__(self, beats):
+        assert(len(beats) > 0)
+        self.beats = beats
+        self.start = beats[0].start
+        self.duration = beats[-1].start + beats[-1].duration - self.start
+
+    def children(self):
+        return self.beats
+
+
 class AudioBars(object):
+    """Bars of one audio file, to render in order.
+    - bars can repeat a bar, where the bar map (see bar_map.py) put two chart
+      positions on one long analyzer bar.  It is only rendered once - see
+      distinct_bars().
+    """
     def __init__(self, audio_analysis, bars):
         self.audio_analysis = audio_analysis
         self.bars = bars
         
+    def distinct_bars(self):
+        """bars, less any bar that repeats the one before it."""
+        return [bar for index, bar in enumerate(self.bars)
+                if index == 0 or bar.start != self.bars[index - 1].start]
 
     def get_pieces(self):
-        return(audio.getpieces(self.audio_analysis, self.bars))
+        return(audio.getpieces(self.audio_analysis, self.distinct_bars()))
+
+    def sample_ranges(self):
+        """(start, end) sample indexes of each distinct bar in the audio file
+        - as many samples as getpieces() allows for each bar,
+        int(duration * sampleRate), from the bar's first sample.
+        """
+        sample_rate = self.audio_analysis.sampleRate
+        ranges = []
+        for bar in self.distinct_bars():
+            start = int(bar.start * sample_rate)
+            ranges.append((start, start + int(bar.duration * sample_rate)))
+        return ranges
+
 
+def render_audio_bars(all_audio_bars):
+    """Return one AudioData of all_audio_bars, one after another.
+    - Every audio file must have the same sample rate and channels.
+    - The output is allocated once, from the bar timings.  Then each bar is
+      sliced from its audio file (audio_file[bar]) and copied into place, so
+      only one bar's samples are held besides the output.  Audio files that
+      can decode again on demand (analysis_cache.CachedAudioFile) drop their
+      decoded audio after their last bar.
+    """
+    all_sample_ranges = [audio_bars.sample_ranges() for audio_bars in all_audio_bars]
+    num_samples = sum(end - start
+                      for sample_ranges in all_sample_ranges
+                      for start, end in sample_ranges)
+    # Index in all_audio_bars of the last use of each audio file.
+    last_uses = dict((id(audio_bars.audio_analysis), index)
+                     for index, audio_bars in enumerate(all_audio_bars))
+    output = None
+    index = 0
+    for audio_index, audio_bars in enumerate(all_audio_bars):
+        audio_file = audio_bars.audio_analysis
+        for bar, (start, end) in zip(audio_bars.distinct_bars(),
+                                     all_sample_ranges[audio_index]):
+            # Slices can run a sample past end, or stop short at the end of
+            # the file.
+            piece = audio_file[bar].data[:end - start]
+            if output == None:
+                output = audio.AudioData(shape=(num_samples,) + piece.shape[1:],
+                                         sampleRate=audio_file.sampleRate,
+                                         numChannels=audio_file.numChannels,
+                                         defer=False, verbose=False)
+            assert(audio_file.sampleRate == output.sampleRate)
+            assert(piece.shape[1:] == output.data.shape[1:])
+            output.data[index:index + len(piece)] = piece
+            index += len(piece)
+        if last_uses[id(audio_file)] == audio_index and hasattr(audio_file, 'release_audio'):
+            audio_file.release_audio()
+    if output == None:
+        # No bars at all.
+        first_audio = all_audio_bars[0].audio_analysis
+        output = audio.AudioData(shape=(0,), sampleRate=first_audio.sampleRate,
+                                 numChannels=first_audio.numChannels,
+                                 defer=False, verbose=False)
+    output.endindex = index
+    return output
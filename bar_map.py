@@ -0,0 +1,122 @@
+"""File: bar_map.py
+- Local re-alignment of the chart to the analyzer's bars, by banded dynamic
+  time warping (DTW).
+
+- best_global_offset assumes the bar grid is perfectly periodic.  One
+  spurious or missing bar from the analyzer shifts every later chorus.  So,
+  starting from the global offset, find the best bar for every chart position
+  (measure of every chorus), where each step from one position to the next
+  moves on:
+  - 1 bar: the normal case.
+  - 2 bars: skips a spurious extra bar.
+  - 0 bars: a missing bar - two measures share one analyzer bar.
+  Steps other than 1 cost step_penalty.  Each bar is only searched within
+  band bars of the bar after the previous position's best bar, so time and
+  memory are O(positions x band), and the map can still drift as far from
+  the global offset as the recording needs.
+- Scores are read from one row per unique measure of the chart (see
+  ChordLikelihood.unique_changes_scores), only where a band needs them - a
+  bar x chart measure matrix is never built.
+- A 0 bar step maps two chart positions to one bar.  That bar is as long as
+  both measures, so it is rendered once (see AudioBars.distinct_bars).
+
+- The result is a bar map: for each chart position, the index of its bar.
+
+"""
+
+import numpy as np
+
+# Bars either side of the expected bar to search.
+DTW_BAND = 2
+# Cost of a 0 or 2 bar step, in standard deviations of the measure scores.
+DTW_STEP_PENALTY = 3.0
+
+
+def changes_scores_std(measure_scores, measure_indexes):
+    """Standard deviation of ChordLikelihood.changes_scores, from the unique
+    measure rows: each row counts once per chart measure it is.
+    """
+    counts = np.bincount(measure_indexes, minlength=len(measure_scores))
+    num_scores = float(counts.sum() * measure_scores.shape[1])
+    if num_scores == 0:
+        return 0.0
+    mean = np.dot(counts, measure_scores.sum(axis=1)) / num_scores
+    mean_square = np.dot(counts, (measure_scores ** 2).sum(axis=1)) / num_scores
+    return np.sqrt(max(mean_square - mean ** 2, 0.0))
+
+
+def banded_bar_map(measure_scores, measure_indexes, offset, num_positions,
+                   band=DTW_BAND, step_penalty=None):
+    """Best bar for each chart position, from offset.
+    - measure_scores: num_unique_measures x num_bars array - each unique
+      measure of the changes scored against every bar.
+    - measure_indexes: row of measure_scores for each measure of the changes
+      (see ChordLikelihood.unique_changes_scores).
+    - offset: bar of chart position 0 (best_global_offset).
+    - num_positions: number of chart positions to map - whole choruses.
+    - step_penalty: cost of a 0 or 2 bar step.  Default is DTW_STEP_PENALTY
+      standard deviations of the changes scores (changes_scores_std).
+    - The band moves with the path: position n searches band bars either side
+      of the bar after position n - 1's best bar.  So the map can drift any
+      number of bars from the periodic grid, a step at a time.
+    - return: int array of num_positions bar indexes, never decreasing.  Same
+      as offset + position when no other path scores better.
+    """
+    num_bars = measure_scores.shape[1]
+    chorus_len = len(measure_indexes)
+    if step_penalty == None:
+        step_penalty = DTW_STEP_PENALTY * max(
+            changes_scores_std(measure_scores, measure_indexes), 1e-9)
+    width = 2 * band + 1
+    windows = np.arange(width) - band
+    # Ties go to the middle of the band.
+    order = np.argsort(np.abs(windows), kind='mergesort')
+    # Bar at the middle of each position's band, the total score of the best
+    # path to each bar in the band, and the bar before it on that path.
+    centers = np.zeros(num_positions, dtype=int)
+    previous_bars = np.zeros((num_positions, width), dtype=int)
+    totals = np.empty(width)
+    for position in xrange(num_positions):
+        if position == 0:
+            center = offset
+        else:
+            center = centers[position - 1] + windows[order[np.argmax(totals[order])]] + 1
+        centers[position] = center
+        bars = center + windows
+        valid = (bars >= 0) & (bars < num_bars)
+        scores = np.where(valid,
+                          measure_scores[measure_indexes[position % chorus_len],
+                                         np.clip(bars, 0, num_bars - 1)],
+                          -np.inf)
+        if position == 0:
+            totals = scores
+            continue
+        # Bar b follows b - 1 (a 1 bar step), b (0 bars) or b - 2 (2 bars),
+        # where those are in the last position's band.
+        best = np.empty(width)
+        best.fill(-np.inf)
+        best_previous = bars - 1
+        for step, penalty in ((1, 0.0), (0, step_penalty), (2, step_penalty)):
+            last_windows = bars - step - centers[position - 1] + band
+            in_band = (last_windows >= 0) & (last_windows < width)
+            candidate = np.where(in_band, totals[np.clip(last_windows, 0, width - 1)],
+                                 -np.inf) - penalty
+            better = candidate > best
+            best[better] = candidate[better]
+            best_previous[better] = bars[better] - step
+        previous_bars[position] = best_previous
+        totals = best + scores
+    # Trace back from the best final bar.
+    bar_map = np.zeros(num_positions, dtype=int)
+    if num_positions == 0:
+        return bar_map
+    bar = centers[-1] + windows[order[np.argmax(totals[order])]]
+    for position in xrange(num_positions - 1, -1, -1):
+        bar_map[position] = bar
+        bar = previous_bars[position, bar - centers[position] + band]
+    return bar_map
+
+
+def chorus_bar_map(bar_map, chorus_len):
+    """Split a bar map into one row of bar indexes per chorus."""
+    return bar_map[:len(bar_map) // chorus_len * chorus_len].reshape(-1, chorus_len)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# encoding: utf=8
+
+'''bench_chord.py
+Description: Time chord scoring - single tone_vector versions against the
+ batch (N x 12 array) versions, on random tone vectors.  Also checks that
+ both give the same scores.
+
+Usage:
+    python bench_chord.py [-n NUM_VECTORS] [-c CHORD]
+
+Example:
+    python bench_chord.py -n 20000 -c Dm7b5
+
+'''
+
+import sys
+import time
+import random
+from optparse import OptionParser
+
+import numpy as np
+
+from chord import get_chord_info
+from chord import match_delta_average
+
+
+def random_tone_vectors(num_vectors, seed=1234):
+    rand = random.Random(seed)
+    return [[rand.random() for _ in xrange(12)] for _ in xrange(num_vectors)]
+
+
+def time_fn(fn):
+    """Return (seconds, result) for one call of fn."""
+    start = time.time()
+    result = fn()
+    return time.time() - start, result
+
+
+def bench(name, scalar_fn, batch_fn):
+    scalar_secs, scalar_result = time_fn(scalar_fn)
+    batch_secs, batch_result = time_fn(batch_fn)
+    same = list(scalar_result) == list(batch_result)
+    print '%-18s scalar: %8.4fs  batch: %8.4fs  speedup: %7.1fx  same: %s' % (
+        name, scalar_secs, batch_secs, scalar_secs / max(batch_secs, 1e-9), same)
+    return same
+
+
+def main(num_vectors, chord):
+    chord_info = get_chord_info(chord)
+    tone_vectors = random_tone_vectors(num_vectors)
+    tone_matrix = np.array(tone_vectors)
+    print 'chord: %s  tone vectors: %d' % (chord, num_vectors)
+    all_same = bench(
+        'delta_average',
+        lambda: [chord_info.match_tone_vector_delta_average(tone_vector)[1]
+                 for tone_vector in tone_vectors],
+        lambda: match_delta_average(tone_matrix, chord_info.chord_mask)[1])
+    all_same &= bench(
+        'match_tone_vector',
+        lambda: [chord_info.match_tone_vector(tone_vector)
+                 for tone_vector in tone_vectors],
+        lambda: chord_info.match_tone_vectors(tone_matrix))
+    return all_same
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-n", "--num_vectors", dest="num_vectors",
+                      type="int", default=10000,
+                      help="Number of random tone vectors")
+    parser.add_option("-c", "--chord", dest="chord",
+                      default="Cm7",
+                      help="Chord symbol to score against")
+    (options, args) = parser.parse_args()
+    if not main(options.num_vectors, options.chord):
+        sys.exit(1)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# encoding: utf=8
+
+'''File: chart_library.py
+- Identify the tune of a recording by matching it against a whole library of
+  chord charts (see chord_chart.py) at once.
+
+- Every unique measure of the library is scored against every bar once, from
+  the recording's one ChordLikelihood (so each chord is scored once, however
+  many charts use it).  Then the chorus scores of every chart at every start
+  bar are the same diagonal sums as JamTune.calc_chorus_scores, done for all
+  charts together: one row per chart, charts padded to the longest with a
+  measure that scores 0.
+- Global offsets are folded per chart length, then each chart's best global
+  offset is picked as in JamTune.match_all_changes.  So a chart gets exactly
+  the best_global_offset a JamTune for it would.
+- Charts are ranked by their best global offset's score per chart measure
+  matched, so long and short charts compare fairly.
+
+Usage:
+    python chart_library.py [-n TOP] [-s SCORER] [-C DIR] chart_file song_filename [song_filename ...]
+
+Example:
+    python chart_library.py -n 5 charts.txt BlueBossa.mp3
+
+'''
+
+import sys
+from optparse import OptionParser
+
+import numpy as np
+
+from chord_chart import ChordChartParser
+from scorers import scorer_names
+from scorers import DEFAULT_SCORER
+
+
+class ChartLibrary(object):
+    """Charts to identify recordings against.
+    - charts: list of chord_chart.ParsedChart.
+    - Measures are laid out once, and reused for every recording.
+    """
+    def __init__(self, charts):
+        self.charts = charts
+        self.chart_lens = np.array([chart.num_measures for chart in charts], dtype=int)
+        # Unique measures (tuples of chord symbols) of every chart.
+        self.measures = []
+        measure_numbers = {}
+        max_len = max([0] + self.chart_lens.tolist())
+        # Index into measures of each chart's measures.  Padded with
+        # len(measures) - a measure that scores 0 everywhere.
+        measure_indexes = []
+        for chart in charts:
+            chart_measure_indexes = []
+            for measure in chart.changes:
+                measure = tuple(measure)
+                if measure not in measure_numbers:
+                    measure_numbers[measure] = len(self.measures)
+                    self.measures.append(measure)
+                chart_measure_indexes.append(measure_numbers[measure])
+            measure_indexes.append(chart_measure_indexes)
+        self.measure_indexes = np.empty((len(charts), max_len), dtype=int)
+        self.measure_indexes.fill(len(self.measures))
+        for chart_index, chart_measure_indexes in enumerate(measure_indexes):
+            self.measure_indexes[chart_index, :len(chart_measure_indexes)] = \
+                chart_measure_indexes
+
+    @classmethod
+    def from_files(cls, filenames, parser=None):
+        """ChartLibrary of every chart in the chart files."""
+        parser = parser or ChordChartParser()
+        charts = []
+        for filename in filenames:
+            charts.extend(parser.parse_file(filename))
+        return cls(charts)
+
+    def chorus_scores(self, chord_likelihood):
+        """Score of a full chorus of every chart, at every start bar.
+        - chord_likelihood: ChordLikelihood of the recording.  Any chords it
+          hasn't scored yet are added.
+        - return: num_charts x num_bars array.  Row n is
+          JamTune.calc_chorus_scores for chart n, padded with 0.
+        """
+        num_bars = chord_likelihood.features.num_bars
+        max_len = self.measure_indexes.shape[1]
+        # One row per unique measure, plus the zero measure.  Extra columns
+        # of 0 past the last bar, for starts too late for a chart.
+        measure_scores = np.zeros((len(self.measures) + 1, num_bars + max_len))
+        for index, measure in enumerate(self.measures):
+            measure_scores[index, :num_bars] = chord_likelihood.measure_scores(measure)
+        chorus_scores = np.zeros((len(self.charts), num_bars))
+        # Add a measure at a time, in chart order, like calc_chorus_scores.
+        for index in xrange(max_len):
+            chorus_scores += measure_scores[self.measure_indexes[:, index],
+                                            index:index + num_bars]
+        # Only start bars that leave room for a whole chorus (num_cycles).
+        num_cycles = num_bars - self.chart_lens
+        chorus_scores[np.arange(num_bars) >= num_cycles[:, np.newaxis]] = 0.0
+        return chorus_scores
+
+    def rank(self, chord_likelihood):
+        """Rank every chart against one recording.
+        - return: [(chart, best_global_offset, score), ...], best first.
+          score is the best global offset's score per chart measure matched.
+          Charts too long for the recording are left out.
+        """
+        chorus_scores = self.chorus_scores(chord_likelihood)
+        num_bars = chorus_scores.shape[1]
+        num_cycles = num_bars - self.chart_lens
+        best_offsets = np.zeros(len(self.charts), dtype=int)
+        scores = np.empty(len(self.charts))
+        scores.fill(-np.inf)
+        for chart_len in np.unique(self.chart_lens):
+            charts = np.flatnonzero((self.chart_lens == chart_len) & (num_cycles > 0))
+            if chart_len == 0 or len(charts) == 0:
+                continue
+            # fold_global_offset_scores, for all charts of this length at once.
+            num_rows = -(-num_bars // chart_len)
+            padded = np.zeros((len(charts), num_rows * chart_len))
+            padded[:, :num_bars] = chorus_scores[charts]
+            global_offset_scores = np.zeros((len(charts), chart_len))
+            for row in xrange(num_rows):
+                global_offset_scores += padded[:, row * chart_len:(row + 1) * chart_len]
+            offsets = global_offset_scores.argmax(axis=1)
+            # Choruses counted at each chart's best offset.
+            num_choruses = (num_cycles[charts] - offsets + chart_len - 1) // chart_len
+            best_offsets[charts] = offsets
+            scores[charts] = (global_offset_scores[np.arange(len(charts)), offsets] /
+                              (num_choruses * chart_len))
+        order = np.argsort(-scores, kind='mergesort')
+        return [(self.charts[index], int(best_offsets[index]), scores[index])
+                for index in order if scores[index] > -np.inf]
+
+
+def main(chart_filename, input_filenames, top, scorer, cache_dir):
+    # Imported here, so the library can be used without echonest.
+    from analysis_cache import load_audio_file
+    from analysis_cache import AnalysisCache
+    from analysis_features import AnalysisFeatures
+    from chord_likelihood import ChordLikelihood
+    chart_library = ChartLibrary.from_files([chart_filename])
+    analysis_cache = None
+    if cache_dir:
+        analysis_cache = AnalysisCache(cache_dir)
+    for input_filename in input_filenames:
+        analysis = load_audio_file(input_filename, analysis_cache).analysis
+        features = AnalysisFeatures(analysis.beats, analysis.bars)
+        ranked = chart_library.rank(ChordLikelihood(features, scorer=scorer))
+        print input_filename
+        for chart, offset, score in ranked[:top]:
+            print '  %8.4f  offset: %3d  %s' % (score, offset, chart.title)
+
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options] chart_file song_filename [song_filename ...]"
+    parser = OptionParser(usage=usage)
+    parser.add_option("-n", "--top", dest="top",
+                      type="int", default=10,
+                      help="Show the best N charts", metavar="N")
+    parser.add_option("-s", "--scorer", dest="scorer",
+                      type="choice", choices=scorer_names(), default=None,
+                      help="Match chords with SCORER, one of: %s (default: %s)" %
+                      (', '.join(scorer_names()), DEFAULT_SCORER),
+                      metavar="SCORER")
+    parser.add_option("-C", "--cache_dir", dest="cache_dir",
+                      default=None,
+                      help="Cache audio analyses in DIR", metavar="DIR")
+    (options, args) = parser.parse_args()
+    if len(args) < 2:
+        parser.print_help()
+        sys.exit(-1)
+    main(args[0], args[1:], options.top, options.scorer, options.cache_dir)
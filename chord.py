@@ -18,6 +18,10 @@ note.py at this point.
 import re
 from string import strip
 
+import numpy as np
+
+import score_trace
+
 
 class ChordParseException(Exception):
     pass
@@ -59,11 +63,34 @@ NOTE_TO_INT = { 'C': NOTE_C,
 INT_TO_NOTE = dict([(NOTE_TO_INT[note], note) for note in NOTE_TO_INT.keys()])
 print "INT_TO_NOTE: %s" % INT_TO_NOTE
 
+# Other spellings of the same notes, as seen in lead sheets.
+NOTE_ALIASES = {'C#': 'Db',
+                'D#': 'Eb',
+                'Gb': 'F#',
+                'G#': 'Ab',
+                'A#': 'Bb',
+                'Cb': 'B',
+                'Fb': 'E',
+                'E#': 'F',
+                'B#': 'C',
+                }
+
 def note_to_int(note):
-    return(NOTE_TO_INT[note])
+    """Note name (eg 'Eb', 'C#', 'bb') to 0-11."""
+    note = note[0].upper() + note[1:]
+    return(NOTE_TO_INT[NOTE_ALIASES.get(note, note)])
 
 def note_int_to_note(note_int):
-    return(INT_TO_NOTE(note_int))
+    return(INT_TO_NOTE[note_int])
+
+def quality_chord(quality, root_int):
+    """Chord symbol for a quality (see ChordInfo.quality) at root_int.
+    - Transposes a slash chord's bass too: ('7/G', 9) is 'A7/E'.
+    """
+    if '/' in quality:
+        quality, bass = quality.split('/')
+        quality += '/' + note_int_to_note((note_to_int(bass) + root_int) % 12)
+    return note_int_to_note(root_int) + quality
 
 # Map already seen chords to their full representation.
 CHORD_TO_CHORD_INFO = {}
@@ -80,16 +107,59 @@ def get_chord_info(chord):
     existing = CHORD_TO_CHORD_INFO.get(chord, None)
     return existing or ChordInfo(chord)
 
+# Map already seen chord qualities (eg 'm7') to their ChordTemplate.
+QUALITY_TO_CHORD_TEMPLATE = {}
+
+def get_chord_template(quality):
+    """If we have already built this chord quality's template, return it.
+    """
+    existing = QUALITY_TO_CHORD_TEMPLATE.get(quality, None)
+    return existing or ChordTemplate(quality)
+
+# Common chord qualities.  With every root, these make up the default
+# ChordTable - see get_chord_table().  chord_chart.ChordChartParser adds
+# any other qualities it finds to its own table.
+CHORD_QUALITIES = ('', '7', '7b5',
+                   'm', 'm7', 'mb5', 'm7b5',
+                   'M', 'M7', 'Mb5', 'M7b5')
+
+# Built on first use.
+CHORD_TABLE = None
+
+def get_chord_table():
+    """Return the ChordTable of every root with every CHORD_QUALITIES.
+    """
+    global CHORD_TABLE
+    if CHORD_TABLE == None:
+        CHORD_TABLE = ChordTable(CHORD_QUALITIES)
+    return CHORD_TABLE
+
+# - seventh: '7', '6' (instead of a 7th), or '9' (7th plus 9th).
+# - sus: 'sus' or 'sus4' (4th instead of the 3rd), or 'sus2'.
+# - bass: slash chord bass note, eg 'Cm7/Bb'.
+# Must match the whole symbol, so 'Cb5' is C flat five, not C flat.
 chord_regex = re.compile(r"""
-   (?P<root>[a-gA-G](b)?)
-   (?P<mode_char>[mM])?
-   (?P<seventh>[7])?
-   ((?P<alt_fifth>[b])5)?""",
+   (?P<root>[a-gA-G][b\#]?)
+   (?P<mode_char>[mMo])?
+   (?P<seventh>[679])?
+   (?P<sus>sus[24]?)?
+   ((?P<alt_fifth>[b\#])5)?
+   (/(?P<bass>[a-gA-G][b\#]?))?
+   $""",
  re.VERBOSE)
 
 CHORD_TONE_CONST = 2
 OTHER_TONE_CONST = 0.5
 
+# The sub-scores that match_tone_vector adds up, in order.
+MATCH_TONE_FEATURES = ('max_in_chord',          # 2 strongest tones in chord
+                       'min_not_in_chord',      # 2 weakest tones not in chord
+                       'max_anti_out',          # strongest tones, in_is_good=False
+                       'max_anti_in',           # strongest tones, in_is_good=True
+                       'delta_average')         # match_tone_vector_delta_average
+# match_tone_vector weights for each of MATCH_TONE_FEATURES.
+MATCH_TONE_WEIGHTS = (1, 1, 1, 1, 2)
+
 def mod_twelve(notes_raw):
     """Convert an array of raw notes to an array of note_ints.
     - ie each one mod 12.
@@ -97,7 +167,190 @@ def mod_twelve(notes_raw):
     return [note % 12 for note in notes_raw]
 
 
+def note_bits(note_ints):
+    """Return note_ints as a 12-bit mask - bit n is set if note n is present."""
+    bits = 0
+    for note_int in note_ints:
+        bits |= 1 << note_int
+    return bits
+
+
+def read_only(array):
+    """Mark a numpy array read-only, and return it."""
+    array.setflags(write=False)
+    return array
+
+
+def as_tone_matrix(tone_vectors):
+    """Return tone_vectors as an N x 12 float array.
+    - tone_vectors: a list of tone vectors (eg mean_pitches() of beats or bars),
+      or an N x 12 array.
+    """
+    if len(tone_vectors) == 0:
+        return np.zeros((0, 12))
+    tone_matrix = np.asarray(tone_vectors, dtype=float)
+    assert(tone_matrix.ndim == 2 and tone_matrix.shape[1] == 12)
+    return tone_matrix
+
+
+def note_mask(note_ints):
+    """Return a 12 element boolean array, True for each note in note_ints."""
+    mask = np.zeros(12, dtype=bool)
+    mask[list(note_ints)] = True
+    return mask
+
+
+def rank_tone_vectors(tone_vectors):
+    """Sort every tone vector once, for all of the min/max sub-scores.
+    - tone_vectors: list of tone vectors, or N x 12 array.
+    - return: (max_ranks, min_ranks), N x 12 arrays of indexes.
+      - max_ranks: strongest tone first.  min_ranks: weakest tone first.
+      - Ties go to the lowest index first, like list.index(max(...)).
+    """
+    tone_matrix = as_tone_matrix(tone_vectors)
+    num_rows = len(tone_matrix)
+    # One stable sort over both directions at once.
+    ranks = np.argsort(np.vstack([-tone_matrix, tone_matrix]), axis=1,
+                       kind='mergesort')
+    return ranks[:num_rows], ranks[num_rows:]
+
+
+def ranked_raw_scores(matched):
+    """Weight an (..., count) array of matches by rank - 1, 0.5, 0.25 ...
+    - return: (raw_scores, potential_score)
+    """
+    increments = 0.5 ** np.arange(matched.shape[-1])
+    return (matched * increments).sum(axis=-1), increments.sum()
+
+
+def delta_average_raw_scores(tone_matrix, chord_masks):
+    """Raw delta average scores for every row of tone_matrix, against K chords.
+    - chord_masks: K x 12 boolean array, the notes of each chord.
+    - return: K x N array.  See ChordInfo.match_tone_vector_delta_average.
+    """
+    # Add up columns in order, like sum() does, so averages match exactly.
+    tone_vector_sums = np.zeros(len(tone_matrix))
+    for index in xrange(12):
+        tone_vector_sums += tone_matrix[:, index]
+    tone_vector_avgs = (tone_vector_sums / 12)[:, np.newaxis]
+    above_average = (tone_matrix > tone_vector_avgs).astype(float)
+    below_average = (tone_matrix < tone_vector_avgs).astype(float)
+    # Count chord tones above average, and non-chord tones below average, for
+    # all K chords with two (N x 12) x (12 x K) products.  Counts are small
+    # ints, so they are exact.
+    chord_scores = np.dot(above_average, chord_masks.T.astype(float))
+    non_chord_scores = np.dot(below_average, (~chord_masks).T.astype(float))
+    return (chord_scores + non_chord_scores).T
+
+
+def match_tone_features(tone_matrix, chord_masks, anti_count, ranks=None):
+    """The match_tone_vector sub-scores of every row of tone_matrix, against K chords.
+    - chord_masks: K x 12 boolean array, the notes of each chord.
+    - anti_count: number of anti-notes, the same for all K chords.  Chords
+      with none (eg triads, most slash chords) score 0 on both anti-note
+      sub-scores.
+    - ranks: (max_ranks, min_ranks) from rank_tone_vectors, if already known.
+    - The tone vectors are ranked once, and shared by all K chords.
+    - return: K x N x len(MATCH_TONE_FEATURES) array.
+    """
+    assert(anti_count >= 0)
+    # Sort once, then read every min/max sub-score off the same ranking.
+    if ranks == None:
+        ranks = rank_tone_vectors(tone_matrix)
+    max_ranks, min_ranks = ranks
+    max_in_chord = chord_masks[:, max_ranks]
+    min_in_chord = chord_masks[:, min_ranks]
+
+    features = np.zeros((len(chord_masks), len(tone_matrix), len(MATCH_TONE_FEATURES)))
+    # Max tones in chord is good.
+    raw_scores, potential_score = ranked_raw_scores(max_in_chord[..., :2])
+    features[..., 0] = raw_scores / potential_score
+    # Min tones in chord is bad.
+    raw_scores, potential_score = ranked_raw_scores(~min_in_chord[..., :2])
+    features[..., 1] = raw_scores / potential_score
+    # Anti-notes: the same max ranking, scored once with in_is_good=False,
+    # and once with in_is_good=True.  Raw scores are sums of powers of
+    # two, so the in and out raw scores add up to potential exactly.
+    if anti_count > 0:
+        raw_scores, potential_score = ranked_raw_scores(max_in_chord[..., :anti_count])
+        features[..., 2] = (potential_score - raw_scores) / potential_score
+        features[..., 3] = raw_scores / potential_score
+
+    scores, raw_scores = match_delta_average(tone_matrix, chord_masks)
+    features[..., 4] = scores
+    return features
+
+
+def weighted_feature_sum(features, weights):
+    """Score from features: the product of a (..., F) feature array with F weights.
+    - Features are added one at a time, in order, so MATCH_TONE_WEIGHTS give
+      exactly the same score as match_tone_vector.
+    """
+    assert(features.shape[-1] == len(weights))
+    total_scores = np.zeros(features.shape[:-1])
+    for index, weight in enumerate(weights):
+        total_scores += weight * features[..., index]
+    return total_scores
+
+
+def match_tone_matrix(tone_matrix, chord_masks, anti_count, ranks=None):
+    """Score every row of tone_matrix against K chords - see ChordInfo.match_tone_vector.
+    - Same arguments as match_tone_features.
+    - return: K x N array of scores.
+    """
+    features = match_tone_features(tone_matrix, chord_masks, anti_count, ranks=ranks)
+    return weighted_feature_sum(features, MATCH_TONE_WEIGHTS)
+
+
+def match_delta_average(tone_vectors, chord_masks):
+    """Delta average sub-score of every tone vector, against K chords at once.
+    - tone_vectors: list of tone vectors, or N x 12 array.
+    - chord_masks: K x 12 boolean array (eg ChordInfo.chord_mask[np.newaxis]),
+      or one 12 element mask.
+    - Standalone version of ChordInfo.match_tone_vector_delta_average - see
+      bench_chord.py.
+    - return: (scores, raw_scores), K x N arrays (N arrays for one mask).
+      - raw_scores: 0-12
+      - scores: raw_scores normalized like the single tone_vector version.
+        That divides ints, so it truncates - use raw_scores / 12.0 for a
+        0-1 fraction.
+    """
+    tone_matrix = as_tone_matrix(tone_vectors)
+    chord_masks = np.asarray(chord_masks, dtype=bool)
+    if chord_masks.ndim == 1:
+        scores, raw_scores = match_delta_average(tone_matrix, chord_masks[np.newaxis])
+        return scores[0], raw_scores[0]
+    raw_scores = delta_average_raw_scores(tone_matrix, chord_masks)
+    potential_score = 12
+    scores = raw_scores // potential_score
+    return scores, raw_scores
+
+
+def match_tone_vectors_by_chord(chord_infos, tone_vectors):
+    """Score each tone vector against its own chord, batched by chord.
+    - chord_infos: one ChordInfo per tone vector.
+    - tone_vectors: list of tone vectors, or N x 12 array.
+    - Rows that share a chord are scored with one match_tone_vectors() call.
+    - return: array of N scores, same as calling match_tone_vector() per row.
+    """
+    tone_matrix = as_tone_matrix(tone_vectors)
+    assert(len(chord_infos) == len(tone_matrix))
+    rows_by_chord = {}
+    for row, chord_info in enumerate(chord_infos):
+        rows_by_chord.setdefault(chord_info, []).append(row)
+    scores = np.zeros(len(tone_matrix))
+    for chord_info, rows in rows_by_chord.items():
+        scores[rows] = chord_info.match_tone_vectors(tone_matrix[rows])
+    return scores
+
+
 class ChordInfo(object):
+    # Hot matching code reads these directly.  The full parse result dict is
+    # only built again if someone asks for chord_info.
+    __slots__ = ('chord', 'root', 'root_int', 'note_ints', 'anti_note_ints',
+                 'note_bits', 'anti_note_bits', 'note_indexes', 'anti_note_indexes',
+                 'chord_mask', '_chord_info')
+
     def __init__(self, chord):
         """Parse a chord symbol into a dict of 'root', 'mode', 'seventh', store in self.
         - root_letter: 'C', 'C-sharp', 'B-flat'
@@ -107,13 +360,34 @@ class ChordInfo(object):
         - third: 'major', 'minor'
         - fifth: 'normal', 'flat', 'sharp'
         - seventh: 'major', 'minor', 'diminished' (ie 6th)
+        - Compact versions of the notes, for matching:
+          - note_ints, anti_note_ints: tuples of 0-11
+          - note_bits, anti_note_bits: 12-bit masks, bit n set for note n
+          - note_indexes, anti_note_indexes: read-only numpy index arrays
+          - chord_mask: read-only 12 element boolean array of the notes
         """
         self.chord = strip(chord)
-        
-        # Hope this does not get confusing.  Other modules use chord_info to
-        # hold a ChordInfo object.  Then to get the dict results, you can
-        # use chord_info.chord_info.
-        self.chord_info = self.parse_chord(self.chord)
+        chord_info = self.parse_chord(self.chord)
+        self.root = chord_info['root']
+        self.root_int = chord_info['root_int']
+        self.note_ints = chord_info['note_ints']
+        self.anti_note_ints = chord_info['anti_note_ints']
+        self.note_bits = note_bits(self.note_ints)
+        self.anti_note_bits = note_bits(self.anti_note_ints)
+        self.note_indexes = read_only(np.array(self.note_ints, dtype=int))
+        self.anti_note_indexes = read_only(np.array(self.anti_note_ints, dtype=int))
+        self.chord_mask = read_only(note_mask(self.note_ints))
+        self._chord_info = None
+
+    # Hope this does not get confusing.  Other modules use chord_info to
+    # hold a ChordInfo object.  Then to get the dict results, you can
+    # use chord_info.chord_info.
+    @property
+    def chord_info(self):
+        """The full parse result dict - built on first use."""
+        if self._chord_info == None:
+            self._chord_info = self.parse_chord(self.chord)
+        return self._chord_info
 
     @property
     def changes(self):
@@ -124,8 +398,20 @@ class ChordInfo(object):
         return(self.chord_info.unique_chords)
 
     @property
-    def note_ints(self):
-        return(self.chord_info['note_ints'])
+    def quality(self):
+        """Chord symbol without the root, eg 'm7b5' for 'Dm7b5'.
+        - A slash chord's bass is given relative to root C, so all roots
+          share one quality: 'A7/E' and 'D7/A' are both '7/G'.
+        """
+        quality = self.chord[len(self.root):]
+        if '/' in quality:
+            quality, bass = quality.split('/')
+            quality += '/' + note_int_to_note((note_to_int(bass) - self.root_int) % 12)
+        return(quality)
+
+    @property
+    def template(self):
+        return get_chord_template(self.quality)
 
 
     def parse_chord(self, chord):
@@ -189,9 +475,10 @@ class ChordInfo(object):
                 raise ChordParseException(
                     "Invalid mode_char - expected 'M', 'm' or 'o' ")
             
-            # Is the '7' present?
+            # Is the '7' present?  '9' is a 7th chord, plus the 9th.
             seventh = match.group('seventh')
-            if seventh == '7':
+            ninth = (seventh == '9')
+            if seventh in ['7', '9']:
                 if mode == 'major':
                     seventh = 'major'
                     seventh_offset = 11
@@ -206,22 +493,45 @@ class ChordInfo(object):
                     seventh_offset = 9
                 else:
                     raise ChordParseException("Invalid mode - expected 'major', 'minor' or 'diminished' ")
+            elif seventh == '6':
+                # 6th instead of a 7th.  Plain 'C6' is a major sixth chord.
+                if mode == 'dominant':
+                    mode = 'major'
+                seventh = 'sixth'
+                seventh_offset = 9
+
+            # Suspended - the 4th (or 2nd) instead of the 3rd.
+            sus = match.group('sus')
+            if sus != None:
+                if third != 'major':
+                    raise ChordParseException("Invalid sus - expected a major or dominant chord, got: %s" % chord)
+                third = 'suspended'
+                if sus == 'sus2':
+                    third_offset = 2
+                else:
+                    third_offset = 5
 
-            # Is b5 present (we don't support #5 yet)
+            # Is b5 or #5 present
             alt_fifth = match.group('alt_fifth')
             if alt_fifth == 'b':
                 # Flat 5
                 mode = 'diminished'
                 fifth = 'flat'
                 fifth_offset = 6
+            elif alt_fifth == '#':
+                # Sharp 5 (augmented)
+                fifth = 'sharp'
+                fifth_offset = 8
             elif alt_fifth == None:
                 pass
             else:
-                raise ChordParseException("Invalid alt_fifth - expected 'b' (flat) or None, got: %s" % alt_fifth)
+                raise ChordParseException("Invalid alt_fifth - expected 'b' (flat), '#' (sharp) or None, got: %s" % alt_fifth)
 
             note_base_offsets = [root_offset, third_offset, fifth_offset]
             if seventh_offset:
                 note_base_offsets.append(seventh_offset)
+            if ninth:
+                note_base_offsets.append(14)
 
             # Preserve intervals, so can identify chord - go beyond 0-11.
             third_int_raw = root_int + third_offset
@@ -239,6 +549,17 @@ class ChordInfo(object):
             note_ints_raw = [root_int, third_int_raw, fifth_int_raw]
             if seventh_int_raw != None:
                 note_ints_raw.append(seventh_int_raw)
+            if ninth:
+                note_ints_raw.append(root_int + 14)
+
+            # Slash chord - the bass note is a chord note too, if it isn't already.
+            bass = match.group('bass')
+            if bass != None:
+                bass_int = note_to_int(bass)
+                bass_offset = (bass_int - root_int) % 12
+                if bass_int not in mod_twelve(note_ints_raw):
+                    note_base_offsets.append(bass_offset)
+                    note_ints_raw.append(root_int + bass_offset)
 
             note_ints = mod_twelve(note_ints_raw)
             OUT = """
@@ -265,6 +586,18 @@ class ChordInfo(object):
             # If major 7, flat 7 is anti_tone.
             if seventh == 'major' or (mode == 'major' and seventh == None):
                 anti_note_offsets.append(10)
+            # Sixth chords have no 7th, so flat 7 is anti_tone.
+            if seventh == 'sixth':
+                anti_note_offsets.append(10)
+            # Suspended chords have no 3rd, so the major 3rd is anti_tone.
+            if third == 'suspended':
+                anti_note_offsets.append(4)
+            # If sharp 5, the natural 5th is anti_tone.
+            if fifth == 'sharp':
+                anti_note_offsets.append(7)
+            # A chord note (eg a slash chord's bass) is never an anti_tone.
+            anti_note_offsets = [anti_offset for anti_offset in anti_note_offsets
+                                 if (root_int + anti_offset) % 12 not in note_ints]
 
             anti_note_ints_raw = [anti_offset + root_int for anti_offset in anti_note_offsets]
             anti_note_ints = mod_twelve(anti_note_ints_raw)
@@ -286,7 +619,15 @@ class ChordInfo(object):
             result['seventh_int_raw'] = seventh_int_raw
             # result['seventh_int'] = seventh_int
 
-            # 0-based, regardless of which chord.  Does not wrap, because we only go up to 7th.
+            # Only in the dict when in the chord symbol.
+            if ninth:
+                result['ninth_int_raw'] = root_int + 14
+            if bass != None:
+                result['bass'] = bass
+                result['bass_int'] = bass_int
+
+            # 0-based, regardless of which chord.  Does not wrap, because we
+            # only go up to the 9th (14).
             result['note_base_offsets'] = tuple(note_base_offsets)
             # Shifted from note_base_offsets based on Root value.  Can go above 11.
             result['note_ints_raw'] = tuple(note_ints_raw)
@@ -297,7 +638,7 @@ class ChordInfo(object):
             result['anti_note_ints_raw'] = tuple(anti_note_ints_raw)
             result['anti_note_ints'] = tuple(anti_note_ints)
         else:
-            raise ParseChordException("Failed to parse chord: %s" % chord)
+            raise ChordParseException("Failed to parse chord: %s" % chord)
 
         # Remember it
         remember_chord(chord, self)
@@ -328,32 +669,16 @@ class ChordInfo(object):
         """
         assert(len(tone_vector) == 12)
         assert(count < 12)
-        indexes = []
-        tone_vector_copy = tone_vector[:]
-        for _ in xrange(count):
-            # Get max
-            max_index = tone_vector_copy.index(max(tone_vector_copy))
-            indexes.append(max_index)
-            # Don't want to pick this one again, but leave it there so offsets stay the same.
-            tone_vector_copy[max_index] = -1000
-        return indexes
+        max_ranks, _ = rank_tone_vectors([tone_vector])
+        return max_ranks[0, :count].tolist()
         
     def indexes_of_min_n(self, tone_vector, count):
-        """Return the ordered list of indexes of the strongest vector tones.
+        """Return the ordered list of indexes of the weakest vector tones.
         """
         assert(len(tone_vector) == 12)
         assert(count < 12)
-        indexes = []
-        tone_vector_copy = tone_vector[:]
-        # When we've used one, we'll set it to 1000, to never be picked again.
-        assert max(tone_vector_copy) < 1000
-        tone_vector_copy = tone_vector[:]
-        for _ in xrange(count):
-            # Get min
-            min_index = tone_vector_copy.index(min(tone_vector_copy))
-            indexes.append(min_index)
-            tone_vector_copy[min_index] = 1000
-        return indexes
+        _, min_ranks = rank_tone_vectors([tone_vector])
+        return min_ranks[0, :count].tolist()
         
 
     def index_of_highest(self, tone_vector):
@@ -363,7 +688,7 @@ class ChordInfo(object):
         
     def index_is_in_chord(self, index):
         # This note (0-11) is a chord tone
-        return index in self.note_ints
+        return (self.note_bits >> index) & 1 == 1
 
     def index_is_in(self, index, index_set):
         return index in index_set
@@ -385,7 +710,7 @@ class ChordInfo(object):
         """
         analysis_tone_vector = analysis_bar.mean_pitches()
         # Notes of the chord
-        chord_set = set(self.chord_info['note_ints'])
+        chord_set = set(self.note_ints)
         # Notes not in the chord
         other_set = set(range(12)) - chord_set
         tone_vector_average = sum(analysis_tone_vector) / len(analysis_tone_vector)
@@ -473,37 +798,37 @@ class ChordInfo(object):
     def match_tone_vector(self, tone_vector):
         """Combine all sub-scores into one final score for the tone_vector.
         """
-        assert(len(self.note_ints) in [3, 4])
+        assert(len(self.note_ints) >= 3)
         OUT = """
         return (self.match_tone_vector_max_vector_tones(tone_vector, len(self.note_ints)) +
                 self.match_tone_vector_min_vector_tones(tone_vector, 4) +
                 self.match_tone_vector_delta_average(tone_vector))
 """
-        # count = len(self.chord_info['note_ints'])
+        # count = len(self.note_ints)
         count = 2
         total_score = 0
         score, raw_score = self.match_tone_vector_min_max_vector_tones_2(
-            tone_vector=tone_vector, indexes=self.chord_info['note_ints'],
+            tone_vector=tone_vector, indexes=self.note_ints,
             min_max='max', in_is_good=True, count=2)
         total_score += score
 
         score, raw_score = self.match_tone_vector_min_max_vector_tones_2(
-            tone_vector=tone_vector, indexes=self.chord_info['note_ints'],
+            tone_vector=tone_vector, indexes=self.note_ints,
             min_max='min', in_is_good=False, count=2)
         total_score += score
 
             # Anti-notes
 
-        # count = len(self.chord_info['note_ints'])
+        # count = len(self.note_ints)
         count = 2
         score, raw_score = self.match_tone_vector_min_max_vector_tones_2(
-            tone_vector=tone_vector, indexes=self.chord_info['note_ints'],
-            min_max='max', in_is_good=False, count=len(self.chord_info['anti_note_ints']))
+            tone_vector=tone_vector, indexes=self.note_ints,
+            min_max='max', in_is_good=False, count=len(self.anti_note_ints))
         total_score += score
 
         score, raw_score = self.match_tone_vector_min_max_vector_tones_2(
-            tone_vector=tone_vector, indexes=self.chord_info['note_ints'],
-            min_max='max', in_is_good=True, count=len(self.chord_info['anti_note_ints']))
+            tone_vector=tone_vector, indexes=self.note_ints,
+            min_max='max', in_is_good=True, count=len(self.anti_note_ints))
         total_score += score
 
             # multiply this?
@@ -593,9 +918,11 @@ class ChordInfo(object):
             - also return unscaled score, for easier testing.
           - If they are all chord tones, should return 1
         """
-        print "tone_vector: %s" % tone_vector
         if count == None:
             count = len(indexes)
+        if count == 0:
+            # Nothing to examine - eg anti-notes of a chord that has none.
+            return (0, 0.0)
         score = 0
         # Indexes of strongest tones - sorted descending.
         num_tried = 0
@@ -609,21 +936,25 @@ class ChordInfo(object):
         else:
             raise Exception("Bogus value for min_max: %s.  Expected 'min' or 'max' " %
                             min_max)
-        print("key_indexes: %s" % key_indexes)
+        matched_indexes = []
         for index in key_indexes:
             if self.index_is_in(index, indexes):
-                print "matched index: %s" % index
+                matched_indexes.append(index)
                 if in_is_good:
                     raw_score += cur_increment
             else:
-                print "did not match index: %s" % index
                 if not in_is_good:
                     raw_score += cur_increment
             potential_score += cur_increment
             # Next increment will be half as much
             cur_increment /= 2.0
-        print ("raw_score: %s  potential_score: %s" % (raw_score, potential_score))
-        
+        if score_trace.TRACE:
+            score_trace.TRACE.record(
+                'min_max', chord=self.chord, tone_vector=tone_vector,
+                indexes=indexes, min_max=min_max, in_is_good=in_is_good,
+                key_indexes=key_indexes, matched_indexes=matched_indexes,
+                raw_score=raw_score, potential_score=potential_score)
+
         if potential_score == 0:
             import pdb; pdb.set_trace()
 
@@ -660,7 +991,7 @@ class ChordInfo(object):
         """
 
         # Notes of the chord
-        chord_indexes = set(self.chord_info['note_ints'])
+        chord_indexes = set(self.note_ints)
         # Notes not in the chord
         non_chord_indexes = set(range(12)) - chord_indexes
 
@@ -687,3 +1018,140 @@ class ChordInfo(object):
         return score, raw_score
 
 
+    ###################################
+    # Batch matching of chord to tone_vectors
+    # - Each method takes an N x 12 array (see as_tone_matrix), and returns
+    #   the same results as its single tone_vector version, one per row.
+    ###################################
+
+    def indexes_of_max_n_batch(self, tone_matrix, count):
+        """Batch version of indexes_of_max_n - returns an N x count array."""
+        assert(count < 12)
+        max_ranks, _ = rank_tone_vectors(tone_matrix)
+        return max_ranks[:, :count]
+
+    def indexes_of_min_n_batch(self, tone_matrix, count):
+        """Batch version of indexes_of_min_n - returns an N x count array."""
+        assert(count < 12)
+        _, min_ranks = rank_tone_vectors(tone_matrix)
+        return min_ranks[:, :count]
+
+    def match_tone_vectors_min_max_vector_tones(self, tone_matrix, indexes, min_max,
+                                                in_is_good, count=None, ranks=None):
+        """Batch version of match_tone_vector_min_max_vector_tones_2.
+        - ranks: (max_ranks, min_ranks) from rank_tone_vectors, if already known.
+        - return: (scores, raw_scores) arrays, one value per row.
+        """
+        if count == None:
+            count = len(indexes)
+        assert(count > 0)
+        if ranks == None:
+            ranks = rank_tone_vectors(tone_matrix)
+        max_ranks, min_ranks = ranks
+        if min_max == 'min':
+            key_indexes = min_ranks[:, :count]
+        elif min_max == 'max':
+            key_indexes = max_ranks[:, :count]
+        else:
+            raise Exception("Bogus value for min_max: %s.  Expected 'min' or 'max' " %
+                            min_max)
+        matched = note_mask(indexes)[key_indexes]
+        if not in_is_good:
+            matched = ~matched
+        raw_scores, potential_score = ranked_raw_scores(matched)
+        scores = raw_scores / potential_score
+        return (scores, raw_scores)
+
+    def match_tone_vectors_delta_average(self, tone_matrix):
+        """Batch version of match_tone_vector_delta_average.
+        - return: (scores, raw_scores) arrays, one value per row.
+        """
+        return match_delta_average(tone_matrix, self.chord_mask)
+
+    def match_tone_vectors(self, tone_vectors):
+        """Batch version of match_tone_vector.
+        - tone_vectors: list of tone vectors, or N x 12 array.
+        - return: array of N scores.
+        """
+        assert(len(self.note_ints) >= 3)
+        tone_matrix = as_tone_matrix(tone_vectors)
+        chord_masks = self.chord_mask[np.newaxis]
+        anti_count = len(self.anti_note_ints)
+        return match_tone_matrix(tone_matrix, chord_masks, anti_count)[0]
+
+
+class ChordTemplate(object):
+    """A chord quality (eg 'm7'), for all 12 roots at once.
+    - note_bits: 12-bit mask of the notes, with root C.
+    - root_masks: 12 x 12 boolean array.  Row n is the chord with root n - a
+      circular shift of row 0.
+    - Like ChordInfo, templates behave like singletons - see get_chord_template().
+    """
+    def __init__(self, quality):
+        self.quality = quality
+        # Parse the quality once, with root C.
+        chord_info = get_chord_info('C' + quality)
+        self.note_bits = note_bits(chord_info.note_ints)
+        self.anti_note_count = len(chord_info.anti_note_ints)
+        c_mask = note_mask(chord_info.note_ints)
+        self.root_masks = np.array([np.roll(c_mask, root_int) for root_int in NOTES])
+        QUALITY_TO_CHORD_TEMPLATE[quality] = self
+
+    def chord(self, root_int):
+        """Chord symbol for this quality at root_int, eg 'Ebm7'."""
+        return quality_chord(self.quality, root_int)
+
+    def match_tone_vectors(self, tone_vectors):
+        """Score tone vectors against this quality at all 12 roots, in one pass.
+        - The tone vectors are ranked once, and the chord mask is shifted
+          to each root, rather than parsing and scoring 12 chords.
+        - return: 12 x N array.  Row n is the same as match_tone_vectors()
+          of this quality with root n.
+        """
+        return match_tone_matrix(as_tone_matrix(tone_vectors), self.root_masks,
+                                 self.anti_note_count)
+
+
+class ChordTable(object):
+    """Read-only table of chords - every root, for each of some qualities.
+    - chords: tuple of chord symbols.  Index is quality_index * 12 + root_int.
+    - chord_infos: tuple of the ChordInfo for each chord.
+    - note_bits, anti_note_bits: read-only arrays of 12-bit masks, per chord.
+    - chord_masks: read-only num_chords x 12 boolean array of notes, per chord.
+    """
+    __slots__ = ('qualities', 'chords', 'chord_infos', 'chord_indexes',
+                 'note_bits', 'anti_note_bits', 'chord_masks')
+
+    def __init__(self, qualities):
+        chords = tuple(quality_chord(quality, root_int)
+                       for quality in qualities
+                       for root_int in NOTES)
+        chord_infos = tuple(get_chord_info(chord) for chord in chords)
+        set_attr = super(ChordTable, self).__setattr__
+        set_attr('qualities', tuple(qualities))
+        set_attr('chords', chords)
+        set_attr('chord_infos', chord_infos)
+        set_attr('chord_indexes', dict((chord, index)
+                                       for index, chord in enumerate(chords)))
+        set_attr('note_bits', read_only(np.array(
+            [chord_info.note_bits for chord_info in chord_infos], dtype=int)))
+        set_attr('anti_note_bits', read_only(np.array(
+            [chord_info.anti_note_bits for chord_info in chord_infos], dtype=int)))
+        set_attr('chord_masks', read_only(np.array(
+            [chord_info.chord_mask for chord_info in chord_infos])))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ChordTable is read-only")
+
+    def __len__(self):
+        return len(self.chords)
+
+    def __contains__(self, chord):
+        return strip(chord) in self.chord_indexes
+
+    def index(self, chord):
+        """Index of a chord symbol in the table."""
+        return self.chord_indexes[strip(chord)]
+
+    def get_chord_info(self, index):
+        return self.chord_infos[index]
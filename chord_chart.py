@@ -0,0 +1,195 @@
+"""File: chord_chart.py
+- Bulk parsing of chord charts (lead sheets), for large chart libraries.
+
+- ChordChartParser parses chart text into ParsedChart objects:
+  - Each chart is a compact array of chord indexes, plus the index where each
+    measure starts.  Chord indexes are into one ChordTable, shared by every
+    chart from the same parser.
+  - Chord symbols are interned: a symbol is parsed (get_chord_info) the first
+    time the parser sees it, then it is one dict lookup.  Enharmonic
+    spellings ('C#m7', 'Dbm7') get the same chord index.
+  - Chord indexes are quality_index * 12 + root_int, like ChordTable.  New
+    qualities are added to the end of the parser's qualities, so indexes
+    already handed out never change, and a newer chord_table is a superset
+    of an older one.
+
+- Chart text format:
+
+    title: Blue Bossa
+    Cm7 | Cm7 | Fm7 | Fm7 |
+    Dm7b5 | G7 | Cm7 | Cm7 |
+    Ebm7 | Ab7 | DbM7 | % |
+    Dm7b5 G7 | Cm7 | % | % |
+
+  - '|' or end of line ends a measure.  Empty measures are ignored, so
+    leading and trailing '|' are optional.
+  - Two chords in one measure share it, like TuneInfo changes.
+  - '%' repeats the previous measure.
+  - A chart ends at a blank line, or at the next 'title:' line.
+  - '#' at the start of a word starts a comment, to end of line.
+
+"""
+
+import re
+
+import numpy as np
+
+from chord import get_chord_info
+from chord import ChordTable
+from chord import CHORD_QUALITIES
+from chord import NOTES
+
+# One pass over the whole text.  Order matters: blank lines before newlines.
+chart_token_regex = re.compile(r"""
+   (?P<comment>(?:^|(?<=\s))\#[^\n]*)
+  |(?P<title>^[ \t]*title:[^\n]*)
+  |(?P<blank>\n[ \t]*(?=\n))
+  |(?P<newline>\n)
+  |(?P<bar>\|)
+  |(?P<repeat>%)
+  |(?P<chord>[^\s|%]+)""",
+ re.VERBOSE | re.MULTILINE)
+
+
+class ChartParseException(Exception):
+    pass
+
+
+class ParsedChart(object):
+    """One chart from ChordChartParser.
+    - title: chart title, or None.
+    - chord_indexes: int32 array of chord indexes, in order.
+    - measure_starts: int32 array, num_measures + 1 long.  The chords of
+      measure n are chord_indexes[measure_starts[n]:measure_starts[n + 1]].
+    - chord_table: ChordTable the indexes are into.
+    """
+    __slots__ = ('title', 'chord_indexes', 'measure_starts', 'chord_table')
+
+    def __init__(self, title, chord_indexes, measure_starts, chord_table):
+        self.title = title
+        self.chord_indexes = np.array(chord_indexes, dtype=np.int32)
+        self.measure_starts = np.array(measure_starts, dtype=np.int32)
+        self.chord_table = chord_table
+
+    @property
+    def num_measures(self):
+        return len(self.measure_starts) - 1
+
+    def measure(self, index):
+        """Chord indexes of one measure."""
+        return self.chord_indexes[self.measure_starts[index]:self.measure_starts[index + 1]]
+
+    @property
+    def changes(self):
+        """List of measures, each a list of chord symbols - like TuneInfo.changes."""
+        chords = self.chord_table.chords
+        return [[chords[chord_index] for chord_index in self.measure(index)]
+                for index in xrange(self.num_measures)]
+
+    def tune_info(self, half_time=False):
+        """A tune_info dict for TuneInfo."""
+        return {'title': self.title,
+                'changes': self.changes,
+                'half_time': half_time}
+
+
+class ChordChartParser(object):
+    """Parse many charts, sharing interned chord symbols and one ChordTable.
+    - qualities: qualities to start the table with.  The default gives the
+      same indexes as chord.get_chord_table().
+    """
+    def __init__(self, qualities=CHORD_QUALITIES):
+        self.qualities = list(qualities)
+        self.quality_indexes = dict((quality, index)
+                                    for index, quality in enumerate(self.qualities))
+        # Chord symbol as written -> chord index.
+        self.symbol_indexes = {}
+        self._chord_table = None
+
+    @property
+    def chord_table(self):
+        """ChordTable of every quality seen so far - rebuilt only when a new
+        quality has been added.
+        """
+        if (self._chord_table == None or
+            len(self._chord_table.qualities) != len(self.qualities)):
+            self._chord_table = ChordTable(self.qualities)
+        return self._chord_table
+
+    def chord_index(self, symbol):
+        """Index of a chord symbol in chord_table, parsing it on first sight."""
+        index = self.symbol_indexes.get(symbol)
+        if index == None:
+            chord_info = get_chord_info(symbol)
+            quality = chord_info.quality
+            if quality not in self.quality_indexes:
+                self.quality_indexes[quality] = len(self.qualities)
+                self.qualities.append(quality)
+            index = self.quality_indexes[quality] * len(NOTES) + chord_info.root_int
+            self.symbol_indexes[intern(symbol)] = index
+        return index
+
+    def parse_changes(self, changes, title=None):
+        """ParsedChart from a list of measures of chord symbols (as in a
+        tune_info dict).
+        """
+        chord_indexes = []
+        measure_starts = [0]
+        for measure in changes:
+            chord_indexes.extend(self.chord_index(chord.strip()) for chord in measure)
+            measure_starts.append(len(chord_indexes))
+        return ParsedChart(title, chord_indexes, measure_starts, self.chord_table)
+
+    def parse_charts(self, text):
+        """Parse every chart in text.
+        - return: list of ParsedChart.
+        """
+        charts = []
+        # Current chart and measure.
+        title = None
+        chord_indexes = []
+        measure_starts = [0]
+        measure = []
+        chord_index = self.chord_index
+        for match in chart_token_regex.finditer(text):
+            kind = match.lastgroup
+            if kind == 'chord':
+                measure.append(chord_index(match.group()))
+                continue
+            if kind == 'comment':
+                continue
+            # Anything else ends the measure.
+            if measure:
+                chord_indexes.extend(measure)
+                measure_starts.append(len(chord_indexes))
+                measure = []
+            if kind == 'repeat':
+                if len(measure_starts) < 2:
+                    raise ChartParseException(
+                        "'%%' with no measure to repeat, at: %d" % match.start())
+                measure = chord_indexes[measure_starts[-2]:measure_starts[-1]]
+            elif kind in ['blank', 'title']:
+                if len(measure_starts) > 1:
+                    charts.append(ParsedChart(title, chord_indexes, measure_starts, None))
+                title = None
+                chord_indexes = []
+                measure_starts = [0]
+                if kind == 'title':
+                    title = match.group().split(':', 1)[1].strip() or None
+        if measure:
+            chord_indexes.extend(measure)
+            measure_starts.append(len(chord_indexes))
+        if len(measure_starts) > 1:
+            charts.append(ParsedChart(title, chord_indexes, measure_starts, None))
+        # Only look up the table once all of the qualities are in.
+        chord_table = self.chord_table
+        for chart in charts:
+            chart.chord_table = chord_table
+        return charts
+
+    def parse_file(self, filename):
+        """Parse every chart in a chart file - see parse_charts()."""
+        in_file = open(filename)
+        text = in_file.read()
+        in_file.close()
+        return self.parse_charts(text)
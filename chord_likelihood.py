@@ -0,0 +1,208 @@
+"""File: chord_likelihood.py
+- ChordLikelihood: score every chord against every beat and bar of a
+  recording, once.
+
+- beat_scores[chord_row, beat] and bar_scores[chord_row, bar] hold
+  ChordInfo.match_tone_vector() results.  Scoring a chorus at any start bar is
+  then a gather and sum over these, rather than re-scoring the same beat
+  against the same chord for every start offset that covers it.
+
+- Scores come from one of the scorers in scorers.py - 'v4' by default.
+
+- Chords are scored by quality (see chord.ChordTemplate): each quality is
+  scored at all 12 roots in one pass, and chord rows are picked from that.
+  So a transposed ChordLikelihood (eg for a recording in another key) costs
+  nothing more to build.
+
+"""
+
+import numpy as np
+
+from chord import get_chord_info
+from chord import get_chord_template
+from scorers import get_scorer
+
+
+class ChordLikelihood(object):
+    """Chord x beat and chord x bar score matrices for one AnalysisFeatures.
+    """
+    def __init__(self, features, chords=(), transposition=0, quality_scores=None,
+                 scorer=None):
+        """
+        - transposition: semitones to shift every chord's root by.
+        - quality_scores: quality -> (beat_scores, bar_scores), 12 rows each,
+          one per root.  Can be shared between ChordLikelihoods of the same
+          features and scorer.
+        - scorer: scorer name or object - see scorers.py.
+        """
+        self.features = features
+        self.scorer = get_scorer(scorer)
+        self.transposition = transposition
+        if quality_scores == None:
+            quality_scores = {}
+        self.quality_scores = quality_scores
+        # Chord symbols, in row order.
+        self.chords = []
+        self.chord_rows = {}
+        self.beat_scores = np.zeros((0, features.num_beats))
+        self.bar_scores = np.zeros((0, features.num_bars))
+        # Measure (tuple of chord symbols) -> score for every bar.  Nothing
+        # here depends on the chart, so these carry over to a changed chart.
+        self._measure_scores = {}
+        # (measure, beats_per_bar) -> score for every start beat.
+        self._measure_beat_window_scores = {}
+        self.add_chords(chords)
+
+    @property
+    def num_chords(self):
+        return len(self.chords)
+
+    def add_chords(self, chords):
+        """Score any chords we haven't seen yet against every beat and bar.
+        """
+        new_chords = []
+        for chord in chords:
+            chord = get_chord_info(chord).chord
+            if chord not in self.chord_rows and chord not in new_chords:
+                new_chords.append(chord)
+        if not new_chords:
+            return
+        beat_scores = []
+        bar_scores = []
+        for chord in new_chords:
+            chord_info = get_chord_info(chord)
+            quality_beat_scores, quality_bar_scores = self.score_quality(chord_info.quality)
+            root_int = (chord_info.root_int + self.transposition) % 12
+            beat_scores.append(quality_beat_scores[root_int:root_int + 1])
+            bar_scores.append(quality_bar_scores[root_int:root_int + 1])
+        for chord in new_chords:
+            self.chord_rows[chord] = len(self.chords)
+            self.chords.append(chord)
+        self.beat_scores = np.vstack([self.beat_scores] + beat_scores)
+        self.bar_scores = np.vstack([self.bar_scores] + bar_scores)
+
+    def score_quality(self, quality):
+        """Score a chord quality at all 12 roots against every beat and bar.
+        - return: (beat_scores, bar_scores), 12 rows each, one per root.
+        """
+        if quality not in self.quality_scores:
+            self.quality_scores[quality] = self.scorer.score_quality(
+                self.features, get_chord_template(quality))
+        return self.quality_scores[quality]
+
+    def transposed(self, transposition):
+        """Return a ChordLikelihood for the same chords, with roots shifted
+        by transposition semitones.  Shares the already scored qualities.
+        """
+        return ChordLikelihood(self.features, self.chords,
+                               transposition=self.transposition + transposition,
+                               quality_scores=self.quality_scores,
+                               scorer=self.scorer)
+
+    def chord_row(self, chord):
+        chord = get_chord_info(chord).chord
+        if chord not in self.chord_rows:
+            self.add_chords([chord])
+        return self.chord_rows[chord]
+
+    def bar_beat_sums(self, chord, first_beat=0, last_beat=None):
+        """For every bar, the sum of chord's scores for beats [first_beat:last_beat].
+        - Same as ChordInfo.match_beats(bar.children()[first_beat:last_beat]).
+        """
+        row = self.chord_row(chord)
+        bar_beats = self.features.bar_beats[:, first_beat:last_beat]
+        bar_beat_mask = self.features.bar_beat_mask[:, first_beat:last_beat]
+        beat_scores = np.where(bar_beat_mask, self.beat_scores[row][bar_beats], 0.0)
+        # Add up beats in order, like match_beats does, so sums match exactly.
+        sums = np.zeros(self.features.num_bars)
+        for column in xrange(beat_scores.shape[1]):
+            sums += beat_scores[:, column]
+        return sums
+
+    def measure_scores(self, measure):
+        """Score one measure of the changes against every bar.
+        - measure: list of one or two chord symbols.
+        - return: array with one score per bar.  With the 'v4' scorer, the
+          same as JamTune.match_bar.
+        """
+        measure = tuple(measure)
+        if measure not in self._measure_scores:
+            # Adding rows replaces the score matrices, so before indexing them.
+            self.add_chords(measure)
+            if len(measure) == 2:
+                scores = (self.bar_beat_sums(measure[0], 0, 2) +
+                          self.bar_beat_sums(measure[1], 2, None))
+            else:
+                bar_score = self.bar_scores[self.chord_row(measure[0])]
+                beat_score = self.bar_beat_sums(measure[0], 0, 4)
+                scores = self.scorer.combine_measure(beat_score, bar_score)
+            self._measure_scores[measure] = scores
+        return self._measure_scores[measure]
+
+    def unique_changes_scores(self, changes):
+        """Score each unique measure of the changes against every bar, once.
+        - return: (measure_scores, measure_indexes).  measure_scores has one
+          row per unique measure, in order of first appearance, and
+          measure_indexes the row of each measure of the changes.  So
+          changes_scores(changes)[bar, n] is
+          measure_scores[measure_indexes[n], bar].
+        """
+        rows = {}
+        measure_indexes = np.zeros(len(changes), dtype=int)
+        for index, measure in enumerate(changes):
+            measure_indexes[index] = rows.setdefault(tuple(measure), len(rows))
+        measure_scores = np.zeros((len(rows), self.features.num_bars))
+        for measure, row in rows.items():
+            measure_scores[row] = self.measure_scores(measure)
+        return measure_scores, measure_indexes
+
+    def changes_scores(self, changes):
+        """Score every measure of the changes against every bar.
+        - changes: list of measures, as in TuneInfo.changes.
+        - return: num_bars x len(changes) array.  Column n is
+          measure_scores(changes[n]) - repeated measures are only scored once.
+        """
+        scores = np.zeros((self.features.num_bars, len(changes)))
+        for index, measure in enumerate(changes):
+            scores[:, index] = self.measure_scores(measure)
+        return scores
+
+    def measure_beat_window_scores(self, measure, beats_per_bar=4):
+        """Score one measure of the changes starting at every beat, ignoring
+        the analyzer's bar lines.
+        - The measure covers beats_per_bar beats from the start beat.  Two
+          chord measures split them in half, like measure_scores().
+        - Beats only - there is no bar tone vector for a bar starting on any beat.
+        - return: array with one score per start beat that has a full
+          measure of beats after it.
+        """
+        key = (tuple(measure), beats_per_bar)
+        if key in self._measure_beat_window_scores:
+            return self._measure_beat_window_scores[key]
+        self.add_chords(measure)
+        num_starts = max(self.features.num_beats - beats_per_bar + 1, 0)
+        if len(measure) == 2:
+            chords = ([measure[0]] * (beats_per_bar // 2) +
+                      [measure[1]] * (beats_per_bar - beats_per_bar // 2))
+        else:
+            chords = [measure[0]] * beats_per_bar
+        # Add beats in order, like match_beats does.
+        scores = np.zeros(num_starts)
+        for beat, chord in enumerate(chords):
+            scores += self.beat_scores[self.chord_row(chord), beat:beat + num_starts]
+        self._measure_beat_window_scores[key] = scores
+        return scores
+
+    def measure_beat_scores(self, measure, bar_index):
+        """Scores for each beat of one bar, against the chord of the measure
+        that beat is matched with - see measure_scores().
+        """
+        self.add_chords(measure)
+        beats = self.features.bar_beats[bar_index][self.features.bar_beat_mask[bar_index]]
+        if len(measure) == 2:
+            beat_groups = [(measure[0], beats[:2]), (measure[1], beats[2:])]
+        else:
+            beat_groups = [(measure[0], beats[:4])]
+        return [self.beat_scores[self.chord_row(chord), beat]
+                for chord, group in beat_groups
+                for beat in group]
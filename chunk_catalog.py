@@ -0,0 +1,117 @@
+"""File: chunk_catalog.py
+- Catalog of the solo chunks a jam can be spliced from, with a quality score
+  for each, so bad chunks are never picked.
+
+- A chunk is chunk_num_bars bars of one solo chorus, starting at a chart
+  position that is a multiple of chunk_num_bars (like
+  Jammer.generate_solo_chorus).  Each chunk has:
+  - match: how well its bars match the chart, in standard deviations from
+    the average aligned bar at the same chart measure - the mean and
+    standard deviation of each measure are over every chorus, head and head
+    out included.  Drum solos and misaligned choruses score low.
+  - loudness: mean bar loudness, in dB relative to JamTune.average_loudness.
+    Quiet breaks score low.
+  - conformity: fraction of its bars with the usual bar duration
+    (JamTune.bar_in_primary_bin).
+  - tempo: its local tempo (JamTune.local_tempo), for splicing chunks of
+    similar tempo.
+  - drums: fraction of its bars that look drums-only (flat chroma, but loud
+    - see analysis_features.drum_bars).  Drum solos score high.
+- Chunks passing all of the thresholds are listed per chart position once,
+  when the catalog is built.  Picking one is then a random index into a list
+  (see Jammer.generate_solo_chorus).
+
+"""
+
+import numpy as np
+
+# Default thresholds - see ChunkCatalog.
+MIN_CHUNK_MATCH = -1.0
+MIN_CHUNK_LOUDNESS = -6.0
+MIN_CHUNK_CONFORMITY = 1.0
+MAX_CHUNK_DRUMS = 0.5
+
+# One record per chunk.  chorus is a chorus number (see JamTune.chorus_index),
+# position is the chart measure the chunk starts on.
+CHUNK_DTYPE = np.dtype([('chorus', int),
+                        ('position', int),
+                        ('num_bars', int),
+                        ('match', float),
+                        ('loudness', float),
+                        ('conformity', float),
+                        ('tempo', float),
+                        ('drums', float)])
+
+
+def calc_chunks(chorus_bar_map, solo_choruses, measure_scores, measure_indexes,
+                bar_loudness, bar_conforms, bar_drums, chunk_num_bars, local_tempo=None):
+    """Score every chunk of every solo chorus.
+    - chorus_bar_map: num_choruses x chorus_len array of bar indexes
+      (JamTune.chorus_bar_map).
+    - solo_choruses: chorus numbers to make chunks from.
+    - measure_scores, measure_indexes: each unique measure of the changes
+      scored against every bar, and the row of each chart measure
+      (ChordLikelihood.unique_changes_scores).
+    - bar_loudness: loudness of every bar, relative to the average.
+    - bar_conforms: bool array, True for every bar with the usual duration.
+    - bar_drums: bool array, True for every drums-only bar.
+    - local_tempo: function(first_bar, last_bar) giving the tempo of a range
+      of bars, or None to leave tempo 0.
+    - return: array of CHUNK_DTYPE records, by chorus then position.
+    """
+    num_choruses, chorus_len = chorus_bar_map.shape
+    positions = np.arange(0, chorus_len, chunk_num_bars)
+    chunks = np.zeros(len(solo_choruses) * len(positions), dtype=CHUNK_DTYPE)
+    if len(chunks) == 0:
+        return chunks
+    # Every aligned bar's score against its chart measure, standardized
+    # against all choruses (heads too) at the same measure.  A measure every
+    # chorus scores the same on gives 0.
+    aligned = measure_scores[measure_indexes, chorus_bar_map]
+    aligned = (aligned - aligned.mean(axis=0)) / np.maximum(aligned.std(axis=0), 1e-9)
+    index = 0
+    for chorus in solo_choruses:
+        for position in positions:
+            bar_indexes = chorus_bar_map[chorus, position:position + chunk_num_bars]
+            tempo = 0.0
+            if local_tempo != None:
+                tempo = local_tempo(bar_indexes[0], bar_indexes[-1])
+            chunks[index] = (chorus, position, len(bar_indexes),
+                             aligned[chorus, position:position + chunk_num_bars].mean(),
+                             bar_loudness[bar_indexes].mean(),
+                             bar_conforms[bar_indexes].mean(),
+                             tempo,
+                             bar_drums[bar_indexes].mean())
+            index += 1
+    return chunks
+
+
+class ChunkCatalog(object):
+    """The chunks of one JamTune, and which of them pass the thresholds.
+    - chunks: array of CHUNK_DTYPE records, see calc_chunks().
+    - min_match, min_loudness, min_conformity: lowest match, loudness and
+      conformity a chunk can have and still be picked.
+    - max_drums: highest drums fraction a chunk can have and still be picked.
+    """
+    def __init__(self, chunks, chunk_num_bars, min_match=MIN_CHUNK_MATCH,
+                 min_loudness=MIN_CHUNK_LOUDNESS, min_conformity=MIN_CHUNK_CONFORMITY,
+                 max_drums=MAX_CHUNK_DRUMS):
+        self.chunks = chunks
+        self.chunk_num_bars = chunk_num_bars
+        self.min_match = min_match
+        self.min_loudness = min_loudness
+        self.min_conformity = min_conformity
+        self.max_drums = max_drums
+        passing = ((chunks['match'] >= min_match) &
+                   (chunks['loudness'] >= min_loudness) &
+                   (chunks['conformity'] >= min_conformity) &
+                   (chunks['drums'] <= max_drums))
+        # position -> list of chorus numbers of the passing chunks there.
+        self.passing_choruses = {}
+        for chunk in chunks[passing]:
+            self.passing_choruses.setdefault(int(chunk['position']), []).append(
+                int(chunk['chorus']))
+
+    def choruses_at(self, position):
+        """Chorus numbers of the passing chunks starting at chart position."""
+        return self.passing_choruses.get(position, [])
@@ -3,6 +3,21 @@
 '''File: dur.py
 Description: Information about durations of beats and bars.
 
+- Durations are grouped into bins of roughly the same duration, by one of
+  BIN_ENGINES:
+  - 'histogram': the default.  Bucket log durations into a histogram (one
+    np.bincount), then repeatedly make a bin of the fullest bucket left and
+    the durations near it that are within tolerance of the bin's mean.
+    Roughly linear in the number of durations.
+  - 'greedy': the original - each duration goes in the first bin whose
+    running mean it is within tolerance of, else a new bin.  Kept for
+    compatibility; linear in durations times bins.
+
+- DurationProfile: local durations, for recordings that drift in tempo.
+  Prefix sums of the durations in the primary bin give the mean duration of
+  any range of beats or bars in O(1) - eg the local tempo of one chorus or
+  chunk - and a rolling mean over TEMPO_WINDOW items, in one pass.
+
 '''
 
 import re
@@ -15,12 +30,25 @@ from chord import get_chord_info
 from tune_info import TuneInfo
 from audio_bars import AudioBars
 
+import numpy as np
+
+BIN_ENGINES = ('histogram', 'greedy')
+DEFAULT_BIN_ENGINE = 'histogram'
+# Histogram buckets across one tolerance, in the log domain.
+BUCKETS_PER_TOLERANCE = 4
+# Durations are clipped to this before taking logs.
+MIN_DURATION = 1e-6
+# Width of DurationProfile's rolling window, in beats or bars.
+TEMPO_WINDOW = 8
+
 
 class Bin(object):
     """A collection of beats with roughly the same duration"""
     def __init__(self, tolerance=0.2):
         self.tolerance = tolerance
         self.durations = []
+        # Running total, so the mean is O(1) per added duration.
+        self.total_duration = 0.0
         self.average_duration = None
 
 
@@ -33,31 +61,63 @@ class Bin(object):
         else:
             return False
 
+    def durations_in_bin(self, durations):
+        """duration_belongs_in_bin() for an array of durations, at once."""
+        durations = np.asarray(durations, dtype=float)
+        if self.durations == []:
+            return np.ones(len(durations), dtype=bool)
+        return (np.abs(durations - self.average_duration) <
+                self.tolerance * self.average_duration)
+
     def add_duration(self, duration):
         """Add this duration if it belongs here, and return True, else False
         """
         if self.duration_belongs_in_bin(duration):
             self.durations.append(duration)
-            self.average_duration = sum(self.durations) / float(len(self.durations))
+            self.total_duration += duration
+            self.average_duration = self.total_duration / float(len(self.durations))
             return True
         else:
             return False
 
+    def add_durations(self, durations):
+        """Add all of these durations, whether or not they belong."""
+        self.durations.extend(durations)
+        self.total_duration += sum(durations)
+        self.average_duration = self.total_duration / float(len(self.durations))
+
 
 class Bins(object):
     """Group beat durations into bins.
     - Normally expect 2 bins - target duration, and 1/2 that value or so.
     """
-    def __init__(self, items, tolerance=0.2):
+    def __init__(self, items=None, tolerance=0.2, engine=None, durations=None):
+        """
+        - items: beats or bars, to bin by duration.
+        - engine: one of BIN_ENGINES.
+        - durations: list of durations to bin, instead of items'.
+        """
         self.tolerance = tolerance
+        self.engine = engine or DEFAULT_BIN_ENGINE
+        assert(self.engine in BIN_ENGINES)
         self.items = items
         self.bins = []
-        all_durations = [item.duration for item in self.items]
-        for duration in all_durations:
-            self.add_duration(duration)
+        if durations == None:
+            durations = [item.duration for item in self.items]
+        if self.engine == 'histogram':
+            self.add_histogram_bins(durations)
+        else:
+            for duration in durations:
+                self.add_duration(duration)
         self.primary_bin = self.get_primary_bin()
         self.average_duration = self.get_average_duration()
 
+    def __getstate__(self):
+        """Pickle the bins, not the beats or bars they were made from."""
+        state = self.__dict__.copy()
+        state['items'] = None
+        return state
+
 
     def add_duration(self, duration):
         """Add a duration to one of the bins - creating one if necessary.
@@ -76,6 +136,63 @@ class Bins(object):
             self.bins.append(new_bin)
         return
 
+    def add_histogram_bins(self, durations):
+        """Bin all durations at once, from a histogram of their logs.
+        - Buckets are 1 / BUCKETS_PER_TOLERANCE of log(1 + tolerance) wide.
+          Each bin starts from the fullest bucket not yet binned, and the
+          unbinned durations up to BUCKETS_PER_TOLERANCE buckets either side
+          of it.  A window that wide can reach past tolerance of the bin's
+          mean, so durations the bin itself wouldn't accept
+          (Bin.durations_in_bin) are dropped until it accepts all of them.
+          They are left for later bins.
+        - Bins are added fullest first.
+        """
+        if len(durations) == 0:
+            return
+        durations = np.asarray(durations, dtype=float)
+        logs = np.log(np.maximum(durations, MIN_DURATION))
+        width = np.log1p(self.tolerance) / BUCKETS_PER_TOLERANCE
+        buckets = ((logs - logs.min()) / width).astype(int)
+        # Indexes of the durations in each bucket, in their original order.
+        order = np.argsort(buckets, kind='mergesort')
+        bucket_starts = np.searchsorted(buckets[order], np.arange(buckets.max() + 2))
+        binned = np.zeros(len(durations), dtype=bool)
+        # Unbinned durations left in each bucket.
+        remaining = np.bincount(buckets)
+        while remaining.any():
+            peak = remaining.argmax()
+            first = max(peak - BUCKETS_PER_TOLERANCE, 0)
+            last = min(peak + BUCKETS_PER_TOLERANCE + 1, len(remaining))
+            window = order[bucket_starts[first]:bucket_starts[last]]
+            members = self.histogram_bin_members(durations, np.sort(window[~binned[window]]))
+            if len(members) == 0:
+                # Only the peak bucket, which is narrower than tolerance.
+                peak_bucket = order[bucket_starts[peak]:bucket_starts[peak + 1]]
+                members = np.sort(peak_bucket[~binned[peak_bucket]])
+                accepted = self.histogram_bin_members(durations, members)
+                if len(accepted) > 0:
+                    members = accepted
+            binned[members] = True
+            remaining -= np.bincount(buckets[members], minlength=len(remaining))
+            bin = Bin(tolerance=self.tolerance)
+            bin.add_durations(durations[members].tolist())
+            self.bins.append(bin)
+
+    def histogram_bin_members(self, durations, members):
+        """The indexes of durations[members] that a bin of them accepts
+        (Bin.durations_in_bin) - maybe none.
+        - Dropping durations moves the mean, so repeat until the bin accepts
+          every duration it holds.
+        """
+        while len(members) > 0:
+            bin = Bin(tolerance=self.tolerance)
+            bin.add_durations(durations[members].tolist())
+            accepted = bin.durations_in_bin(durations[members])
+            if accepted.all():
+                break
+            members = members[accepted]
+        return members
+
     def get_bins(self):
         return self.bins
 
@@ -97,15 +214,66 @@ class Bins(object):
                     
             
 
+class DurationProfile(object):
+    """Local mean durations of a sequence of beats or bars.
+    - Only durations in primary_bin count, so a spurious short bar doesn't
+      skew the local tempo.
+    - in_bin: bool array, True for each duration in primary_bin.
+    - out_of_bin: indexes of the durations that aren't.
+    - rolling_durations: mean in-bin duration of the window around each item.
+    """
+    def __init__(self, durations, primary_bin, window=TEMPO_WINDOW):
+        self.durations = np.asarray(durations, dtype=float)
+        self.primary_bin = primary_bin
+        if primary_bin == None:
+            self.in_bin = np.ones(len(self.durations), dtype=bool)
+        else:
+            self.in_bin = primary_bin.durations_in_bin(self.durations)
+        self.out_of_bin = np.flatnonzero(~self.in_bin)
+        # Prefix sums: item n's total is [n + 1] - [first].
+        self.cumulative_durations = np.concatenate(
+            [[0.0], np.cumsum(np.where(self.in_bin, self.durations, 0.0))])
+        self.cumulative_counts = np.concatenate([[0], np.cumsum(self.in_bin)])
+        starts = np.clip(np.arange(len(self.durations)) - window // 2, 0,
+                         max(len(self.durations) - window, 0))
+        self.rolling_durations = self.mean_durations(
+            starts, np.minimum(starts + window, len(self.durations)) - 1)
+
+    def mean_durations(self, first, last):
+        """Mean in-bin duration of items first to last (inclusive) - arrays
+        or single indexes.  The primary bin's average where none are in it.
+        """
+        total = self.cumulative_durations[np.add(last, 1)] - self.cumulative_durations[first]
+        count = self.cumulative_counts[np.add(last, 1)] - self.cumulative_counts[first]
+        average = np.nan
+        if self.primary_bin != None:
+            average = self.primary_bin.average_duration
+        return np.where(count > 0, total / np.maximum(count, 1), average)
+
+    def mean_duration(self, first, last):
+        """mean_durations() of one range, as a float."""
+        return float(self.mean_durations(first, last))
+
+
 class DurationInfo(object):
     """Information about beat and bar durations.
     """
-    def __init__(self, beats, bars, tolerance=0.2):
-        self.beat_bins = Bins(items=beats, tolerance=tolerance)
-        self.bar_bins = Bins(items=bars, tolerance=tolerance)
+    def __init__(self, beats, bars, tolerance=0.2, engine=None):
+        """
+        - engine: how to bin durations, one of BIN_ENGINES.
+        """
+        self.beat_bins = Bins(items=beats, tolerance=tolerance, engine=engine)
+        self.bar_bins = Bins(items=bars, tolerance=tolerance, engine=engine)
     
         self.primary_beat_bin = self.beat_bins.get_primary_bin()
         self.average_beat_duration = self.beat_bins.get_average_duration()
         self.primary_bar_bin = self.bar_bins.get_primary_bin()
         self.average_bar_duration = self.bar_bins.get_average_duration()
+        # Local tempo - see DurationProfile.
+        self.beat_profile = DurationProfile([beat.duration for beat in beats],
+                                            self.primary_beat_bin)
+        self.bar_profile = DurationProfile([bar.duration for bar in bars],
+                                           self.primary_bar_bin)
+        # Indexes of the bars with an unusual duration.
+        self.out_of_bin_bars = self.bar_profile.out_of_bin
 
@@ -13,8 +13,11 @@ Description: Combine jazz tunes with simple chord structures (eg blues, blue bos
 Notes
  - Maybe prefer choruses in the middle
  - Beware intro, outro
+   (chunks only come from solo choruses, and quiet ones are filtered - see
+   chunk_catalog.py)
  - Beware fancy break bt head in and solos.
  - Beware of drums-only (or maybe use late in the tune as trade 4s)
+   (chunk_catalog.py filters chunks of mostly drums-only bars)
  - Do sliding full-chorus match all the way through.  Eg 16-bar match for Blue Bossa.
  "Glue Bossa"
  - Only use a 12-bar section that is a good match for the chords.
@@ -38,6 +41,7 @@ History:
 
 import sys
 import re
+import multiprocessing
 from optparse import OptionParser
 import random
 
@@ -46,21 +50,78 @@ from chord import ChordInfo
 from chord import get_chord_info
 from tune_info import TuneInfo
 from jam_tune import JamTune
+from jam_tune import ALIGN_MODES
+from jam_tune import DEFAULT_ALIGN_MODE
+from jam_tune import load_jam_tune_state
+import score_trace
+from scorers import scorer_names
+from analysis_cache import AnalysisCache
+from audio_bars import render_audio_bars
 
 CHUNK_NUM_BARS = 4
 CHUNK_NUM_BARS = 8
 
 class Jammer(object):
-    def __init__(self, tune_info_module_name, input_filenames, output_filename, num_choruses=3):
+    def __init__(self, tune_info_module_name, input_filenames, output_filename, num_choruses=3,
+                 scorer=None, align_mode=None, analysis_cache=None, jobs=1,
+                 chunk_thresholds=None):
         # TuneInfo describes the changes, time signature etc.
         # Currently we assume 4/4 time.
         tune_info_module = __import__(tune_info_module_name)
         self.tune_info = TuneInfo(tune_info_module.tune_info)
         self.input_filenames = input_filenames
         self.output_filename = output_filename
+        # Scorer to align with (see scorers.py).  None means the tune_info's.
+        self.scorer = scorer
+        # min_match, min_loudness, min_conformity, max_drums for solo chunks - see
+        # chunk_catalog.py.  None means the defaults.
+        self.chunk_thresholds = chunk_thresholds or {}
+        # chunk_num_bars -> {position: [(jam_tune, chorus), ...]}, per alignment.
+        self.chunk_choices = {}
         # Load and analyze audio files.
-        self.jam_tunes = [JamTune(self.tune_info, input_filename)
-                          for input_filename in self.input_filenames]
+        if jobs > 1:
+            self.jam_tunes = self.load_jam_tunes_in_pool(tune_info_module.tune_info, scorer,
+                                                         align_mode, analysis_cache, jobs)
+        else:
+            self.jam_tunes = [JamTune(self.tune_info, input_filename, scorer=scorer,
+                                      align_mode=align_mode, analysis_cache=analysis_cache)
+                              for input_filename in self.input_filenames]
+
+    def load_jam_tunes_in_pool(self, tune_info, scorer, align_mode, analysis_cache, jobs):
+        """Load and align each recording in a pool of jobs processes.
+        - Only each JamTune's compact_state() comes back, and the JamTunes are
+          rebuilt from that here.  The audio is decoded again only if rendered.
+        """
+        pool = multiprocessing.Pool(min(jobs, len(self.input_filenames)))
+        try:
+            states = pool.map(load_jam_tune_state,
+                              [(tune_info, input_filename, scorer, align_mode, analysis_cache)
+                               for input_filename in self.input_filenames])
+        finally:
+            pool.close()
+            pool.join()
+        return [JamTune(self.tune_info, input_filename, scorer=scorer,
+                        align_mode=align_mode, state=state)
+                for input_filename, state in zip(self.input_filenames, states)]
+
+    def set_scorer(self, scorer):
+        """Re-align all loaded tunes with another scorer, without re-analysis.
+        - return: list of best_global_offset, one per tune.
+        """
+        self.scorer = scorer
+        self.chunk_choices = {}
+        return [jam_tune.set_scorer(scorer) for jam_tune in self.jam_tunes]
+
+    def set_tune_info(self, tune_info_module_name):
+        """Re-align all loaded tunes to another chart module, without
+        re-analysis - eg after editing the chart.  The module is reloaded, so
+        edits are picked up.
+        - return: list of best_global_offset, one per tune.
+        """
+        tune_info_module = reload(__import__(tune_info_module_name))
+        self.tune_info = TuneInfo(tune_info_module.tune_info)
+        self.chunk_choices = {}
+        return [jam_tune.set_tune_info(self.tune_info) for jam_tune in self.jam_tunes]
 
 
     # ZZZ ZZZ ZZZ
@@ -73,22 +134,11 @@ class Jammer(object):
         # ZZZ
         # final_audio = audio.getpieces(self.audio_analysis, output_bars)
         # import pdb; pdb.set_trace()
-        # Start with first ones - should be the head in
-        first_audio_bars = all_output_audio_bars.pop(0)
-
-        # Create an audioData object for the first bars, but it will end up including
-        # everything, so call it all_pieces.
-        all_pieces = first_audio_bars.get_pieces()
-        # Add the rest of the pieces
-
-        # Temporarily just the head in
-        for audio_bars in all_output_audio_bars:
-            # Create an audioData objects for the next few bars
-            next_piece = audio_bars.get_pieces()
-            # Join that into the first audioData object.
-            all_pieces.append(next_piece)
-        # final_audio = all_pieces.getpieces()
+        # Head in, solos, head out - allocated once, and each bar copied into
+        # place (rather than appending each piece to a growing AudioData).
+        all_pieces = render_audio_bars(all_output_audio_bars)
         all_pieces.encode(self.output_filename)
+        return all_pieces
 
 
     def generate_jam(self, num_choruses):
@@ -113,26 +163,69 @@ class Jammer(object):
 
     def generate_solo_chorus(self, chunk_num_bars):
         """Generate a solo chorus by taking chunks from the available solo choruses
+        - Each chunk is a random one of the chunks, from every tune, that pass
+          chunk_thresholds.  If none pass at some position, any solo chorus.
+        - Half time (set in the chart, or detected) is the first tune's.
         """
         chorus = []
         chunk_real_num_bars = chunk_num_bars
-        if self.tune_info.tune_info['half_time']:
+        # The changes as aligned - half time merged, if it is.
+        tune_info = self.jam_tunes[0].tune_info
+        if tune_info.half_time:
             chunk_real_num_bars = chunk_real_num_bars / 2
             
 
-        for bar_index in xrange(0, self.tune_info.chorus_num_bars, chunk_real_num_bars):
-            jam_tune = self.get_random_jam_tune()
-            audio_bars = jam_tune.get_nth_audio_bar_of_random_solo_chorus(bar_index, chunk_real_num_bars)
+        chunk_choices = self.get_chunk_choices(chunk_real_num_bars)
+        for bar_index in xrange(0, tune_info.chorus_num_bars, chunk_real_num_bars):
+            choices = chunk_choices.get(bar_index)
+            if choices:
+                jam_tune, chorus_number = choices[random.randrange(len(choices))]
+                audio_bars = jam_tune.get_chunk_audio_bars(chorus_number, bar_index,
+                                                           chunk_real_num_bars)
+            else:
+                jam_tune = self.get_random_jam_tune()
+                audio_bars = jam_tune.get_nth_audio_bar_of_random_solo_chorus(bar_index, chunk_real_num_bars)
             chorus.append(audio_bars)
         return chorus
+
+    def get_chunk_choices(self, chunk_num_bars):
+        """Passing chunks of every tune, by chart position - built once."""
+        if chunk_num_bars not in self.chunk_choices:
+            chunk_choices = {}
+            for jam_tune in self.get_same_meter_jam_tunes():
+                catalog = jam_tune.chunk_catalog(chunk_num_bars, **self.chunk_thresholds)
+                for position, choruses in catalog.passing_choruses.items():
+                    chunk_choices.setdefault(position, []).extend(
+                        (jam_tune, chorus) for chorus in choruses)
+            self.chunk_choices[chunk_num_bars] = chunk_choices
+        return self.chunk_choices[chunk_num_bars]
             
+    def get_same_meter_jam_tunes(self):
+        """Tunes aligned in the same meter (full or half time) as the first,
+        so their chorus bars line up.
+        """
+        half_time = self.jam_tunes[0].tune_info.half_time
+        return [jam_tune for jam_tune in self.jam_tunes
+                if jam_tune.tune_info.half_time == half_time]
+
     def get_random_jam_tune(self):
-        """Randomly return one of the jam tunes"""
-        return self.jam_tunes[random.randrange(len(self.jam_tunes))]
+        """Randomly return one of the jam tunes (in the same meter as the first)"""
+        jam_tunes = self.get_same_meter_jam_tunes()
+        return jam_tunes[random.randrange(len(jam_tunes))]
 
 
-def main(tune_info_module_name, input_filenames, output_filename, num_choruses=4):
-    jammer = Jammer(tune_info_module_name, input_filenames, output_filename, num_choruses=num_choruses)
+def main(tune_info_module_name, input_filenames, output_filename, num_choruses=4,
+         trace_filename=None, scorer=None, align_mode=None, cache_dir=None,
+         refresh_cache=False, jobs=1):
+    if trace_filename:
+        score_trace.start_trace(trace_filename)
+    analysis_cache = None
+    if cache_dir:
+        analysis_cache = AnalysisCache(cache_dir, refresh=refresh_cache)
+    jammer = Jammer(tune_info_module_name, input_filenames, output_filename, num_choruses=num_choruses,
+                    scorer=scorer, align_mode=align_mode, analysis_cache=analysis_cache,
+                    jobs=jobs)
+    score_trace.stop_trace()
     jam_tunes = jammer.jam_tunes
     jam_tune = jam_tunes[0]
     jammer.save_result()
@@ -152,11 +245,42 @@ if __name__ == '__main__':
         parser.add_option("-c", "--choruses", dest="num_choruses",
                           default=4,
                           help="Number of solo choruses")
+        parser.add_option("-T", "--trace", dest="trace_filename",
+                          default=None,
+                          help="Write match score records (JSONL) to FILE",
+                          metavar="FILE")
+        parser.add_option("-s", "--scorer", dest="scorer",
+                          type="choice", choices=scorer_names(), default=None,
+                          help="Match chords with SCORER, one of: %s (default: tune_info's)" %
+                          ', '.join(scorer_names()),
+                          metavar="SCORER")
+        parser.add_option("-a", "--align", dest="align_mode",
+                          type="choice", choices=ALIGN_MODES, default=None,
+                          help="Search global offsets with MODE, one of: %s (default: %s)" %
+                          (', '.join(ALIGN_MODES), DEFAULT_ALIGN_MODE),
+                          metavar="MODE")
+        parser.add_option("-C", "--cache_dir", dest="cache_dir",
+                          default=None,
+                          help="Cache audio analyses in DIR, keyed by file content",
+                          metavar="DIR")
+        parser.add_option("-R", "--refresh_cache", dest="refresh_cache",
+                          action="store_true", default=False,
+                          help="Re-analyze, and overwrite cached analyses")
+        parser.add_option("-j", "--jobs", dest="jobs",
+                          type="int", default=1,
+                          help="Load and align recordings in N processes",
+                          metavar="N")
         (options, args) = parser.parse_args()
         output_filename = options.output_filename
         # ZZZ strip .py if present
         tune_info_module = options.tune_info
         num_choruses = options.num_choruses
+        trace_filename = options.trace_filename
+        scorer = options.scorer
+        align_mode = options.align_mode
+        cache_dir = options.cache_dir
+        refresh_cache = options.refresh_cache
+        jobs = options.jobs
         input_filenames = args
     except :
         parser.print_help()
@@ -164,5 +288,10 @@ if __name__ == '__main__':
     if args == []:
         parser.print_help()
         sys.exit(-1)
-    main(tune_info_module, input_filenames, output_filename, num_choruses=num_choruses)
+    if trace_filename and jobs > 1:
+        # Workers can't write to this process's trace file.
+        parser.error("--trace only records scores without --jobs")
+    main(tune_info_module, input_filenames, output_filename, num_choruses=num_choruses,
+         trace_filename=trace_filename, scorer=scorer, align_mode=align_mode,
+         cache_dir=cache_dir, refresh_cache=refresh_cache, jobs=jobs)
 
@@ -44,24 +44,166 @@ from optparse import OptionParser
 import random
 import math
 
+import numpy as np
+
 import echonest.remix.audio as audio
 from chord import ChordInfo
 from chord import get_chord_info
 from tune_info import TuneInfo
+from tune_info import HALF_TIME_AUTO
 from audio_bars import AudioBars
+from audio_bars import BeatBar
 from duration import DurationInfo
+from duration import Bins
+from analysis_features import AnalysisFeatures
+from analysis_features import drum_bars
+from chord_likelihood import ChordLikelihood
+from scorers import get_scorer
+from offset_search import unique_measures
+from offset_search import fft_chorus_scores
+from offset_search import fold_global_offset_scores
+from offset_search import refine_global_offset_scores
+from offset_search import rank_global_offsets
+from bar_map import banded_bar_map
+from bar_map import chorus_bar_map
+from analysis_cache import load_audio_file
+from analysis_cache import analysis_arrays
+from analysis_cache import CachedAnalysis
+from analysis_cache import CachedAudioFile
+from chunk_catalog import calc_chunks
+from chunk_catalog import ChunkCatalog
+from chord_chart import ChordChartParser
+from chart_library import ChartLibrary
+import score_trace
+
+# How match_all_changes searches global offsets:
+# - 'diagonal': exact diagonal sums (calc_chorus_scores).  The default.
+# - 'fft': FFT cross-correlation (see offset_search.py).  Same
+#   best_global_offset, but only the best global offset scores are exact,
+#   and chorus_scores is left None.  Not faster for charts of usual length.
+ALIGN_MODES = ('diagonal', 'fft')
+DEFAULT_ALIGN_MODE = 'diagonal'
+
+# Chorus roles, in JamTune.chorus_index.
+ROLE_HEAD = 'head'
+ROLE_SOLO = 'solo'
+ROLE_HEAD_OUT = 'head_out'
+# One record per chorus.  first_bar and last_bar are indexes into bars,
+# start and end are in seconds, tempo is the chorus's local tempo in beats
+# per minute.  loudness is its mean bar loudness relative to the average,
+# peakiness its mean bar chroma peakiness, and drums the fraction of its bars
+# that look drums-only (see analysis_features.py).
+CHORUS_INDEX_DTYPE = np.dtype([('chorus', int),
+                               ('role', 'S8'),
+                               ('first_bar', int),
+                               ('last_bar', int),
+                               ('start', float),
+                               ('end', float),
+                               ('tempo', float),
+                               ('loudness', float),
+                               ('peakiness', float),
+                               ('drums', float)])
+
+# Half time detection: the most a meter's alignment score (per measure) is
+# cut for a poor duration fit, as a fraction of the score - see choose_meter().
+METER_FIT_WEIGHT = 0.1
+
+# Alignment results, in JamTune.compact_state().
+ALIGNMENT_ATTRIBUTES = ('best_global_offset', 'chorus_scores', 'global_offset_scores',
+                        'ranked_global_offsets', 'chorus_bar_map', 'chorus_index')
+
+
+def load_jam_tune_state(args):
+    """Process pool worker: load, analyze and align one recording.
+    - args: (tune_info dict, input_filename, scorer, align_mode, analysis_cache)
+    - return: JamTune.compact_state()
+    """
+    tune_info, input_filename, scorer, align_mode, analysis_cache = args
+    # The parent's trace file isn't ours to write to (or close).  jam.py
+    # doesn't allow --trace with --jobs.
+    score_trace.TRACE = None
+    jam_tune = JamTune(TuneInfo(tune_info), input_filename, scorer=scorer,
+                       align_mode=align_mode, analysis_cache=analysis_cache)
+    return jam_tune.compact_state()
+
 
 class JamTune(object):
-    def __init__(self, tune_info, input_filename):
+    def __init__(self, tune_info, input_filename, scorer=None, align_mode=None,
+                 analysis_cache=None, state=None):
+        """
+        - scorer: name of the scorer to match with (see scorers.py).  Default
+          is the tune_info's scorer.
+        - align_mode: one of ALIGN_MODES.
+        - analysis_cache: AnalysisCache to load the analysis from (and save
+          it to), or None to always analyze.
+        - state: compact_state() of a JamTune for the same file, eg from a
+          worker process.  Rebuilds without analysis, scoring or alignment;
+          the audio is only decoded if it is rendered.
+        - If tune_info's half_time is HALF_TIME_AUTO, the tune is aligned
+          with whichever of full time and half time fits better (see
+          choose_meter), and self.tune_info is that one.
+        """
         self.tune_info = tune_info
+        self.align_mode = align_mode or DEFAULT_ALIGN_MODE
+        assert(self.align_mode in ALIGN_MODES)
         self.input_filename = input_filename
-        self.audio_analysis = audio.LocalAudioFile(self.input_filename)
+        if state != None:
+            self.audio_analysis = CachedAudioFile(input_filename,
+                                                  CachedAnalysis(state['analysis']))
+        else:
+            self.audio_analysis = load_audio_file(self.input_filename, analysis_cache)
         self.best_global_offset = None
+        self.chorus_scores = None
+        self.global_offset_scores = None
+        # [(global_offset, score), ...], best first.
+        self.ranked_global_offsets = None
+        # total_num_choruses x chorus_num_bars array of bar indexes, after
+        # local re-alignment - see bar_map.py.
+        self.chorus_bar_map = None
+        # Built once per alignment - see build_chorus_index() and
+        # set_chorus_bars().
+        self.chorus_index = None
+        self.aligned_bars = None
+        self.chorus_bars = None
+        self.solo_choruses = None
+        self._valid_bars = None
+        self._role_bars = None
+        # (chunk_num_bars, thresholds) -> ChunkCatalog, per alignment.
+        self.chunk_catalogs = {}
+        # half_time -> (alignment score per measure, duration fit, combined
+        # score), when half_time was detected - see choose_meter().
+        self.meter_scores = None
+        # Beat level alignment - a chorus can start on any beat.  Matched
+        # with every alignment, to place the bar lines - see set_aligned_bars().
+        self.best_beat_offset = None
+        self.beat_chorus_scores = None
+        self.beat_offset_scores = None
+        # Chart independent arrays, and every chord of the chart scored
+        # against every beat and bar, once per scorer.
+        if state != None:
+            self.features = state['features']
+            self.chord_likelihoods = state['chord_likelihoods']
+            self.duration_info = state['duration_info']
+            self._average_loudness = state['average_loudness']
+            self.drum_bars = state['drum_bars']
+        else:
+            self.features = AnalysisFeatures(self.beats, self.bars)
+            self.chord_likelihoods = {}
+            self.duration_info = DurationInfo(self.beats, self.bars)
+            self._average_loudness = self.calc_average_loudness()
+            # Bars that look drums-only - see analysis_features.drum_bars.
+            self.drum_bars = drum_bars(self.features.bar_peakiness,
+                                       self.features.bar_loudness, self.average_loudness)
+        self.chord_likelihood = self.get_chord_likelihood(scorer or tune_info.scorer)
         # Do all matching calculations, building result data structures
         self.match_info = None
-        self.match_all_changes()
-        self.duration_info = DurationInfo(self.beats, self.bars)
-        self._average_loudness = self.calc_average_loudness()
+        if state != None:
+            if tune_info.half_time == HALF_TIME_AUTO:
+                self.tune_info = tune_info.with_half_time(state['half_time'])
+            self.set_alignment(state['alignment'])
+        else:
+            self.tune_info = self.choose_meter(tune_info)
+            self.match_all_changes()
         assert(self.time_signature['value'] == 4)
         print "JamTune Summary"
         print "input_filename: %s" % input_filename
@@ -71,6 +213,8 @@ class JamTune(object):
         print ' average_loudness: %s' % self.average_loudness
         print ' average_bar_duration: %s' % self.average_bar_duration
         print ' chorus_num_bars: %s' % self.tune_info.chorus_num_bars
+        print ' scorer: %s  best_global_offset: %s' % (self.scorer_name,
+                                                       self.best_global_offset)
         # import pdb; pdb.set_trace()
         x = 10
 
@@ -105,6 +249,13 @@ class JamTune(object):
     def average_bar_duration(self):
         return self.duration_info.average_bar_duration
 
+    def local_tempo(self, first_bar, last_bar):
+        """Tempo of bars first_bar to last_bar (inclusive), in beats per
+        minute - from the bars with the usual duration.  O(1).
+        """
+        return 60.0 * self.beats_per_bar / self.duration_info.bar_profile.mean_duration(
+            first_bar, last_bar)
+
     def beat_in_primary_bin(self, beat):
         return self.primary_beat_bin.duration_belongs_in_bin(beat.duration)
 
@@ -116,22 +267,137 @@ class JamTune(object):
     # CHORUSES
     @property
     def total_num_choruses(self):
-        num_choruses = (len(self.bars)
-                        - self.best_global_offset) / self.tune_info.chorus_num_bars
-
-        return num_choruses
+        return len(self.chorus_index)
 
+    def compact_state(self):
+        """What a worker process sends back: the analysis arrays, features,
+        chord likelihoods (with every measure scored so far), duration info,
+        drum bars and alignment.  Small and picklable - see
+        JamTune(state=...).
+        """
+        return {'input_filename': self.input_filename,
+                'scorer': self.scorer_name,
+                'half_time': self.tune_info.half_time,
+                'align_mode': self.align_mode,
+                'analysis': analysis_arrays(self.audio_analysis),
+                'features': self.features,
+                'chord_likelihoods': self.chord_likelihoods,
+                'duration_info': self.duration_info,
+                'average_loudness': self._average_loudness,
+                'drum_bars': self.drum_bars,
+                'alignment': dict((name, getattr(self, name))
+                                  for name in ALIGNMENT_ATTRIBUTES)}
+
+    def set_alignment(self, alignment):
+        """Set alignment results from compact_state(), instead of matching."""
+        for name in ALIGNMENT_ATTRIBUTES:
+            setattr(self, name, alignment[name])
+        self.set_aligned_bars()
+        self.set_chorus_bars()
+
+    def calc_total_num_choruses(self):
+        """Whole choruses from best_global_offset to the last bar."""
+        if self.best_global_offset == None:
+            return 0
+        return (len(self.bars) - self.best_global_offset) / self.tune_info.chorus_num_bars
 
     @property
     def num_solo_choruses(self):
-        num_choruses = self.total_num_choruses
-        # Don't count head in (2x) for solo changes.
-        num_choruses -= 2
-        # Don't use head out (probably should use 2)
-        num_choruses -= 1
-        return num_choruses
-
-
+        return len(self.solo_choruses)
+
+    def build_chorus_index(self):
+        """Build chorus_index and the chorus bar lists, once per alignment.
+        - chorus_index: array with one CHORUS_INDEX_DTYPE record per chorus,
+          for tooling: chorus number, role ('head', 'solo', 'head_out'),
+          first and last bar (indexes into bars), start and end time.
+        - Two head choruses, then solos, then one head out.
+        - Start and end times are of aligned_bars.
+        """
+        self.set_aligned_bars()
+        bars = self.aligned_bars
+        num_choruses = len(self.chorus_bar_map)
+        chorus_index = np.zeros(num_choruses, dtype=CHORUS_INDEX_DTYPE)
+        bar_loudness = self.features.bar_loudness - self.average_loudness
+        for chorus, bar_indexes in enumerate(self.chorus_bar_map):
+            first_bar = bars[bar_indexes[0]]
+            last_bar = bars[bar_indexes[-1]]
+            if chorus < 2:
+                role = ROLE_HEAD
+            elif chorus == num_choruses - 1:
+                role = ROLE_HEAD_OUT
+            else:
+                role = ROLE_SOLO
+            chorus_index[chorus] = (chorus, role,
+                                    self.chorus_bar_map[chorus, 0],
+                                    self.chorus_bar_map[chorus, -1],
+                                    first_bar.start,
+                                    last_bar.start + last_bar.duration,
+                                    self.local_tempo(bar_indexes[0], bar_indexes[-1]),
+                                    bar_loudness[bar_indexes].mean(),
+                                    self.features.bar_peakiness[bar_indexes].mean(),
+                                    self.drum_bars[bar_indexes].mean())
+        self.chorus_index = chorus_index
+        self.set_chorus_bars()
+
+    def set_aligned_bars(self):
+        """Match the beat offsets (match_all_beat_offsets), and set
+        aligned_bars: the analyzer's bars, with their bar lines moved
+        beat_shift beats (see shifted_bars).  Bars are what gets spliced,
+        so a jam starts each chorus where the beat level alignment does.
+        - Only a shift of less than a bar moves the bar lines.  A longer one
+          is the two alignments disagreeing about which bars make a chorus,
+          and the bar level alignment (with its bar map) is kept.
+        """
+        self.match_all_beat_offsets()
+        shift = self.beat_shift
+        if shift == None or abs(shift) >= self.beats_per_bar:
+            shift = 0
+        self.aligned_bars = self.shifted_bars(shift)
+
+    def shifted_bars(self, shift):
+        """The analyzer's bars, each moved shift beats (a BeatBar), with as
+        many beats as it has.  Bars that would run off either end of the
+        beats are kept as they are.
+        - return: list with one bar per analyzer bar - bars itself for a 0 shift.
+        """
+        bars = self.bars
+        if shift == 0:
+            return bars
+        beats = self.beats
+        shifted = []
+        for bar_index, bar in enumerate(bars):
+            num_beats = self.features.bar_beat_mask[bar_index].sum()
+            first_beat = self.features.bar_beats[bar_index, 0] + shift
+            if num_beats > 0 and first_beat >= 0 and first_beat + num_beats <= len(beats):
+                bar = BeatBar(beats[first_beat:first_beat + num_beats])
+            shifted.append(bar)
+        return shifted
+
+    def set_chorus_bars(self):
+        """Build the bar lists of the alignment, once per alignment, from
+        chorus_bar_map, chorus_index and aligned_bars.
+        - chorus_bars: one list of bars per chorus.
+        - valid_bars, and the bars of each role (chorus_bars_with_role).
+        - Also resets what depends on them: solo_choruses and chunk_catalogs.
+        """
+        bars = self.aligned_bars
+        self.chorus_bars = [[bars[bar_index] for bar_index in bar_indexes]
+                            for bar_indexes in self.chorus_bar_map]
+        self._valid_bars = [bar for chorus_bars in self.chorus_bars for bar in chorus_bars]
+        roles = self.chorus_index['role']
+        self._role_bars = dict((role, [bar
+                                       for chorus in np.flatnonzero(roles == role)
+                                       for bar in self.chorus_bars[chorus]])
+                               for role in (ROLE_HEAD, ROLE_SOLO, ROLE_HEAD_OUT))
+        # Chorus numbers of the solo choruses, in order.
+        self.solo_choruses = np.flatnonzero(roles == ROLE_SOLO)
+        self.chunk_catalogs = {}
+
+    def chorus_bars_with_role(self, role):
+        """All bars of the choruses with this role, in order.  Built once per
+        alignment - don't modify the list.
+        """
+        return self._role_bars[role]
 
 
     # BARS, AUDIO BARS
@@ -151,10 +417,8 @@ class JamTune(object):
 
     @property
     def valid_bars(self):
-        return self.bars[
-            self.best_global_offset :
-                self.best_global_offset + 
-            self.total_num_choruses * self.tune_info.chorus_num_bars]
+        """All bars of the choruses, in order.  Built once per alignment."""
+        return self._valid_bars
         
     @property
     def valid_audio_bars(self):
@@ -162,9 +426,11 @@ class JamTune(object):
 
     @property
     def head_bars(self):
-        """One chorus of the head.
+        """One chorus of the head.  [] if there are no choruses.
         """
-        return self.valid_bars[ :self.tune_info.chorus_num_bars]
+        if len(self.chorus_bars) == 0:
+            return []
+        return self.chorus_bars[0]
 
     @property
     def head_audio_bars(self):
@@ -173,9 +439,11 @@ class JamTune(object):
 
     @property
     def head_out_bars(self):
-        """One chorus of the head out.
+        """One chorus of the head out.  [] if there are no choruses.
         """
-        return self.valid_bars[-self.tune_info.chorus_num_bars:]
+        if len(self.chorus_bars) == 0:
+            return []
+        return self.chorus_bars[-1]
 
     @property
     def head_out_audio_bars(self):
@@ -186,10 +454,7 @@ class JamTune(object):
     def solo_bars(self):
         """Return bars after 2 head choruses, and not including 1 head out chorus
         """
-        head_offset = self.tune_info.chorus_num_bars * 2
-        return self.valid_bars[head_offset :
-                                   head_offset +
-                               self.tune_info.chorus_num_bars * self.num_solo_choruses]
+        return self.chorus_bars_with_role(ROLE_SOLO)
 
     @property
     def solo_audio_bars(self):
@@ -198,10 +463,10 @@ class JamTune(object):
 
     def get_nth_chorus_bars(self, index):
         """Return one chorus of bars, using the nth solo chorus.
+        - Bars come from chorus_bar_map, so a dropped or extra analyzer bar
+          only affects the chorus it is in.
         """
-        chorus_offset = self.tune_info.chorus_num_bars * index
-        return self.solo_bars[chorus_offset : 
-                              chorus_offset + self.tune_info.chorus_num_bars]
+        return self.chorus_bars[self.solo_choruses[index]]
 
     def get_nth_chorus_audio_bars(self, index):
         bars = self.get_nth_chorus_bars(index)
@@ -218,6 +483,30 @@ class JamTune(object):
         return AudioBars(self.audio_analysis, bars)
 
 
+    def chunk_catalog(self, chunk_num_bars, **thresholds):
+        """ChunkCatalog of the solo choruses, built once per alignment.
+        - thresholds: min_match, min_loudness, min_conformity, max_drums - see
+          chunk_catalog.py.
+        """
+        key = (chunk_num_bars, tuple(sorted(thresholds.items())))
+        if key not in self.chunk_catalogs:
+            measure_scores, measure_indexes = self.chord_likelihood.unique_changes_scores(
+                self.tune_info.changes)
+            chunks = calc_chunks(self.chorus_bar_map, self.solo_choruses,
+                                 measure_scores, measure_indexes,
+                                 self.features.bar_loudness - self.average_loudness,
+                                 self.duration_info.bar_profile.in_bin, self.drum_bars,
+                                 chunk_num_bars, self.local_tempo)
+            self.chunk_catalogs[key] = ChunkCatalog(chunks, chunk_num_bars, **thresholds)
+        return self.chunk_catalogs[key]
+
+    def get_chunk_audio_bars(self, chorus, position, num_bars):
+        """AudioBars of num_bars bars of a chorus (by chorus number), from
+        chart position.
+        """
+        return AudioBars(self.audio_analysis,
+                         self.chorus_bars[chorus][position:position + num_bars])
+
     def get_nth_bar(self, bars, index, num_bars=1):
         """Usually a bar from a solo chorus"""
         return bars[index:index+num_bars]
@@ -254,105 +543,317 @@ class JamTune(object):
 
     def match_chorus(self, start_bar):
         """Match changes from tune_info to analyzer_tones for full length of tune.
-        - start_measure: 0-based index of measure to start match on
-        - result is a chorus_match dict
-          {'start_bar': <n>,
-           'bars': <analyzer_bars>
-           'match_results': [{'chord_info': ChordInfo object
-                             'analyzer_tones': z,
-                             'score': z }
-                             ...]  (for full length of chorus
+        - start_bar: 0-based index of measure to start match on
+        - return: total score for the chorus.
+        - If tracing (see score_trace.py), also record the chorus_match.
+        """
+        # Now this is a list of measures, not a list of chords.
+        changes = self.tune_info.changes
+        assert(start_bar + len(changes) <= len(self.bars))
+        # match_fn = ChordInfo.match_analysis_tone_vector
+        # match_fn = ChordInfo.match_analysis_bar
+        # Every measure has already been scored against every bar.
+        match_scores = [self.chord_likelihood.measure_scores(measure)[start_bar + index]
+                        for index, measure in enumerate(changes)]
+
+        if score_trace.TRACE:
+            score_trace.TRACE.record(
+                'chorus', **self.readable_chorus_match([self.chorus_match(start_bar)])[0])
+        return sum(match_scores)
+
+    def chorus_bar_infos(self, start_bar):
+        """Return [(measure_chord_infos, bar), ...] for one chorus from start_bar.
+        - measure_chord_infos is one or two chord_infos in a list, for one measure.
         """
-        result = {'start_bar': start_bar, }
-        print "start bar: %s" % start_bar
         # Now this is a list of measures, not a list of chords.
         changes = self.tune_info.changes
         chorus_bars = self.bars[start_bar:start_bar + len(changes)]
-        # chord_infos = [get_chord_info(chord) for chord in changes]
-        # measure_chord_infos is one or two chord_infos in a list, for one measure.
         measure_chord_infos = [[get_chord_info(chord) 
                                 for chord in measure]
                                for measure in changes]
-
-        # assert(len(chorus_bars) == len(chord_infos))
         assert(len(chorus_bars) == len(measure_chord_infos))
-        # bars_infos = zip(chord_infos, chorus_bars)
-        bar_infos = zip(measure_chord_infos, chorus_bars)
-
-        # match_fn = ChordInfo.match_analysis_tone_vector
-        # match_fn = ChordInfo.match_analysis_bar
-        match_beats_fn = ChordInfo.match_beats
-        match_bar_fn = ChordInfo.match_bar
-        # ZZZ Do it twice for now...DEBUG
+        return zip(measure_chord_infos, chorus_bars)
 
-        # import pdb; pdb.set_trace()
-        match_scores = [
-            self.match_bar(match_bar_fn, match_beats_fn, measure_chord_info, bar)
-            for measure_chord_info, bar in bar_infos]
-
-        print 'match_scores: ',
-        for match_score in match_scores:
-            print '%0.4f' % match_score,
-        print '  sum: %0.4f' % sum(match_scores)
-        print 'measure lengths:',
-        for bar in chorus_bars:
-            print '%0.4f' % bar.duration,
-        print '\n'
-        OUT = """
-        for chord_info, bar in bars_infos:
-            print('chord_info: %s  bar duration: %0.4f  mean_pitches:' %
-                  (chord_info.chord_info, bar.duration), )
-            for pitch in bar.mean_pitches():
-                print '%0.4f ' % pitch,
-            # score = chord_info.match_analysis_tone_vector(bar.mean_pitches())
-            score = match_fn(chord_info, bar)
-            print('score: %0.4f' % score)
-        print '\n\n'
-"""
-        return sum(match_scores)
+    def chorus_match(self, start_bar):
+        """Match one chorus from start_bar, keeping the details, for study/debug.
+        - result is a chorus_match dict
+          {'start_bar': <n>,
+           'bars': <analyzer_bars>
+           'match_results': [{'chord_infos': [ChordInfo object, ...],
+                             'analyzer_tones': <bar mean_pitches>,
+                             'beat_scores': [<score>, ...],
+                             'score': <bar score> }
+                             ...]  (for full length of chorus)
+        """
+        bar_infos = self.chorus_bar_infos(start_bar)
+        changes = self.tune_info.changes
+        chord_likelihood = self.chord_likelihood
+        match_results = [
+            {'chord_infos': measure_chord_infos,
+             'analyzer_tones': bar.mean_pitches(),
+             'beat_scores': chord_likelihood.measure_beat_scores(measure, start_bar + index),
+             'score': chord_likelihood.measure_scores(measure)[start_bar + index]}
+            for index, (measure, (measure_chord_infos, bar))
+            in enumerate(zip(changes, bar_infos))]
+        return {'start_bar': start_bar,
+                'bars': [bar for _, bar in bar_infos],
+                'match_results': match_results}
 
-                        
     def readable_chorus_match(self, chorus_match):
         """Extract readable stuff from objects, for saving in file, for study/debug.
+        - chorus_match: list of chorus_match dicts (see chorus_match())
         """
         return([{'start_bar': chord_match['start_bar'],
-                 'bar_tones': ['ZZZ'],
-                 'etc': 'z'} for chord_match in chorus_match])
+                 'chords': [[chord_info.chord for chord_info in result['chord_infos']]
+                            for result in chord_match['match_results']],
+                 'bar_durations': [round(bar.duration, 4)
+                                   for bar in chord_match['bars']],
+                 'bar_tones': [[round(tone, 4) for tone in result['analyzer_tones']]
+                               for result in chord_match['match_results']],
+                 'beat_scores': [[round(score, 4) for score in result['beat_scores']]
+                                 for result in chord_match['match_results']],
+                 'bar_scores': [round(result['score'], 4)
+                                for result in chord_match['match_results']],
+                 'score': round(sum(result['score']
+                                    for result in chord_match['match_results']), 4),
+                 } for chord_match in chorus_match])
+
+    def get_chord_likelihood(self, scorer):
+        """Return the ChordLikelihood of the chart's chords for this scorer,
+        scoring them on first use.
+        """
+        scorer = get_scorer(scorer)
+        if scorer.key not in self.chord_likelihoods:
+            self.chord_likelihoods[scorer.key] = ChordLikelihood(
+                self.features, sorted(self.tune_info.unique_chords), scorer=scorer)
+        return self.chord_likelihoods[scorer.key]
+
+    def set_scorer(self, scorer):
+        """Re-align with another scorer, without re-analysis.
+        - return: the new best_global_offset
+        """
+        self.chord_likelihood = self.get_chord_likelihood(scorer)
+        self.match_all_changes()
+        return self.best_global_offset
+
+    def set_tune_info(self, tune_info):
+        """Re-align to another chart (TuneInfo), without re-analysis.
+        - features and the chord likelihoods don't depend on the chart, so
+          they are kept.  Only chords this recording hasn't seen yet are
+          scored, and measures already scored are reused.
+        - return: the new best_global_offset
+        """
+        for chord_likelihood in self.chord_likelihoods.values():
+            chord_likelihood.add_chords(sorted(tune_info.unique_chords))
+        self.tune_info = self.choose_meter(tune_info)
+        self.match_all_changes()
+        return self.best_global_offset
+
+    def identify_charts(self, chart_library):
+        """Rank every chart of a chart_library.ChartLibrary against this
+        recording, with the same chord likelihoods as the alignment.
+        - return: [(chart, best_global_offset, score), ...], best first.
+        """
+        return chart_library.rank(self.chord_likelihood)
+
+    def choose_meter(self, tune_info):
+        """Return the TuneInfo to align with: tune_info, or if its half_time is
+        HALF_TIME_AUTO, whichever of its full time and half time versions fits
+        this recording better.
+        - Both are aligned in one pass (see chart_library.py), each giving an
+          alignment score per measure.
+        - Each also gets a duration fit (meter_duration_fit) over the bars its
+          choruses cover: full time of single bars, half time of bar pairs,
+          each against the usual duration of its own units.
+        - The better combined score wins: the alignment score, less up to
+          METER_FIT_WEIGHT of it for a poor fit.  Ties go to full time.
+        - Sets meter_scores: half_time -> (score, fit, combined score).  None
+          when tune_info sets half_time.
+        """
+        if tune_info.half_time != HALF_TIME_AUTO:
+            self.meter_scores = None
+            return tune_info
+        candidates = [tune_info.with_half_time(False), tune_info.with_half_time(True)]
+        parser = ChordChartParser()
+        charts = [parser.parse_changes(candidate.changes) for candidate in candidates]
+        self.meter_scores = {}
+        for chart, offset, score in self.identify_charts(ChartLibrary(charts)):
+            candidate = candidates[charts.index(chart)]
+            chorus_len = candidate.chorus_num_bars
+            num_bars = (len(self.bars) - offset) // chorus_len * chorus_len
+            fit = self.meter_duration_fit(offset, num_bars, 2 if candidate.half_time else 1)
+            combined = score - METER_FIT_WEIGHT * abs(score) * (1.0 - fit)
+            self.meter_scores[candidate.half_time] = (score, fit, combined)
+        if len(self.meter_scores) < 2:
+            # Too short for a full time chorus (or any chorus).
+            return candidates[True in self.meter_scores]
+        return candidates[self.meter_scores[True][2] > self.meter_scores[False][2]]
+
+    def meter_duration_fit(self, first_bar, num_bars, bars_per_unit):
+        """How regular num_bars bars from first_bar are, taken bars_per_unit
+        bars at a time: the fraction of units (eg bar pairs) whose total
+        duration is in the primary bin of the unit durations.  0 if there are
+        no whole units.
+        """
+        durations = self.duration_info.bar_profile.durations[first_bar:first_bar + num_bars]
+        num_units = len(durations) // bars_per_unit
+        if num_units == 0:
+            return 0.0
+        unit_durations = durations[:num_units * bars_per_unit].reshape(
+            num_units, bars_per_unit).sum(axis=1)
+        primary_bin = Bins(durations=unit_durations.tolist()).primary_bin
+        return float(primary_bin.durations_in_bin(unit_durations).mean())
+
+    @property
+    def scorer_name(self):
+        return self.chord_likelihood.scorer.name
 
     def match_all_changes(self):
         """Match changes with analyzer_tones for *every* start_measure offset
         - start_measure: 0-based index of measure to start match on
+        - Sets chorus_scores (score of a full chorus at each start bar - None
+          for the 'fft' align_mode), global_offset_scores,
+          ranked_global_offsets and best_global_offset.
         """
         # Score a full chorus at every measure offset that allows a full chorus.
         num_cycles = (len(self.audio_analysis.analysis.bars) - 
                       len(self.tune_info.changes))
+        if self.align_mode == 'fft':
+            self.chorus_scores = None
+            self.global_offset_scores = self.fft_global_offset_scores(max(num_cycles, 0))
+        else:
+            self.chorus_scores = self.calc_chorus_scores(max(num_cycles, 0))
+            self.global_offset_scores = fold_global_offset_scores(
+                self.chorus_scores, len(self.tune_info.changes))
+        if score_trace.TRACE:
+            for start_offset in xrange(num_cycles):
+                score_trace.TRACE.record(
+                    'chorus',
+                    **self.readable_chorus_match([self.chorus_match(start_offset)])[0])
 
-        chorus_scores = []
-        chorus_len = len(self.tune_info.changes)
-        for start_offset in xrange(num_cycles):
-            chorus_score = self.match_chorus(start_offset)
-            chorus_scores.append(chorus_score)
-
-        print 'chorus_scores: %s' % chorus_scores
         # Which global_offset gives the best total score over all choruses
+        self.ranked_global_offsets = rank_global_offsets(self.global_offset_scores)
         global_offset_max = -1000
         best_global_offset = None
-        for global_offset in xrange(chorus_len):
-            offset_scores = [chorus_scores[offset] for offset in xrange(num_cycles)
-                             if offset % chorus_len == global_offset]
-            sum_offset_scores = sum(offset_scores)
-            print 'global_offset: %s' % global_offset
-            print 'sum_offset_scores: %0.4f\n' % sum_offset_scores
+        for global_offset, sum_offset_scores in enumerate(self.global_offset_scores):
+            if score_trace.TRACE:
+                score_trace.TRACE.record('global_offset', global_offset=global_offset,
+                                         score=sum_offset_scores)
             if sum_offset_scores > global_offset_max:
                 global_offset_max = sum_offset_scores
                 best_global_offset = global_offset
         self.best_global_offset = best_global_offset
+        self.chorus_bar_map = self.calc_chorus_bar_map()
+        self.build_chorus_index()
+
+    def match_all_beat_offsets(self):
+        """Like match_all_changes, but a chorus can start on any beat, not
+        just on the analyzer's bar lines.
+        - Sets beat_chorus_scores, beat_offset_scores (one per beat of a
+          chorus) and best_beat_offset.
+        - Called with every alignment, by set_aligned_bars.
+        """
+        chorus_beats = self.beats_per_bar * self.tune_info.chorus_num_bars
+        self.beat_chorus_scores = self.calc_beat_chorus_scores()
+        self.beat_offset_scores = fold_global_offset_scores(self.beat_chorus_scores,
+                                                            chorus_beats)
+        self.best_beat_offset = None
+        if len(self.beat_chorus_scores):
+            self.best_beat_offset = int(self.beat_offset_scores.argmax())
+
+    def calc_beat_chorus_scores(self):
+        """Score of a full chorus starting at every beat.
+        - Same diagonal sums as calc_chorus_scores, over the beat level scores
+          (ChordLikelihood.measure_beat_window_scores).  Measure n of a chorus
+          starting at beat t starts at beat t + n * beats_per_bar.
+        """
+        beats_per_bar = self.beats_per_bar
+        changes = self.tune_info.changes
+        num_starts = max(len(self.beats) - beats_per_bar * len(changes) + 1, 0)
+        chorus_scores = np.zeros(num_starts)
+        for index, measure in enumerate(changes):
+            window_scores = self.chord_likelihood.measure_beat_window_scores(
+                measure, beats_per_bar)
+            first_beat = index * beats_per_bar
+            chorus_scores += window_scores[first_beat:first_beat + num_starts]
+        return chorus_scores
+
+    @property
+    def beats_per_bar(self):
+        return self.time_signature['value']
+
+    @property
+    def beat_shift(self):
+        """How many beats the beat level alignment starts after the bar level
+        one (best_global_offset) - eg -1 if the analyzer's bar lines are a beat late.
+        None if either alignment found no whole chorus.
+        """
+        if self.best_beat_offset == None or self.best_global_offset == None:
+            return None
+        chorus_beats = self.beats_per_bar * self.tune_info.chorus_num_bars
+        grid_beat = self.features.bar_beats[self.best_global_offset, 0]
+        shift = (self.best_beat_offset - grid_beat) % chorus_beats
+        if shift >= chorus_beats // 2:
+            shift -= chorus_beats
+        return shift
+
+    def get_nth_chorus_beats(self, index):
+        """Return one chorus of beats, using the nth solo chorus of the beat
+        level alignment.
+        - Raises IndexError if there is no whole chorus of beats there, like
+          get_nth_chorus_bars past the last solo chorus.
+        """
+        chorus_beats = self.beats_per_bar * self.tune_info.chorus_num_bars
+        if self.best_beat_offset == None or index < 0:
+            raise IndexError('No solo chorus %d of beats' % index)
+        # Solo choruses start after 2 head choruses, as for bars.
+        start_beat = self.best_beat_offset + (index + 2) * chorus_beats
+        if start_beat + chorus_beats > len(self.beats):
+            raise IndexError('No solo chorus %d of beats' % index)
+        return self.beats[start_beat:start_beat + chorus_beats]
+
+    def calc_chorus_bar_map(self):
+        """Re-align each chorus locally, from best_global_offset - see bar_map.py.
+        - return: total_num_choruses x chorus_num_bars array of bar indexes.
+        """
+        chorus_len = self.tune_info.chorus_num_bars
+        if self.best_global_offset == None:
+            return np.zeros((0, chorus_len), dtype=int)
+        measure_scores, measure_indexes = self.chord_likelihood.unique_changes_scores(
+            self.tune_info.changes)
+        bar_map = banded_bar_map(measure_scores, measure_indexes, self.best_global_offset,
+                                 self.calc_total_num_choruses() * chorus_len)
+        return chorus_bar_map(bar_map, chorus_len)
+
+    def calc_chorus_scores(self, num_cycles):
+        """Score of a full chorus at each of the first num_cycles start bars.
+        - Same as match_chorus() for each start bar, from one bar x measure
+          score matrix: chorus n is the sum down the diagonal from row n.
+        - Diagonals are added a measure at a time, in the same order as
+          match_chorus, so scores match exactly.
+        """
+        changes = self.tune_info.changes
+        scores = self.chord_likelihood.changes_scores(changes)
+        chorus_scores = np.zeros(num_cycles)
+        for index in xrange(len(changes)):
+            chorus_scores += scores[index:index + num_cycles, index]
+        return chorus_scores
+
+    def fft_global_offset_scores(self, num_cycles):
+        """FFT version of the global offset scores.
+        - FFT scores are only good to float rounding.  Global offsets that
+          could be the best are re-scored exactly, so best_global_offset is
+          the same as for calc_chorus_scores.
+        """
+        changes = self.tune_info.changes
+        measures, templates = unique_measures(changes)
+        measure_scores = np.array([self.chord_likelihood.measure_scores(measure)
+                                   for measure in measures])
+        chorus_scores = fft_chorus_scores(measure_scores, templates, num_cycles)
+        return refine_global_offset_scores(
+            fold_global_offset_scores(chorus_scores, len(changes)),
+            measure_scores, templates, num_cycles)
 
 
     def calc_average_loudness(self):
-        count = len(self.audio_analysis.analysis.bars)
-        total_loudness = 0
-        for bar in self.audio_analysis.analysis.bars:
-            total_loudness += bar.mean_loudness()
-        avg_loudness = total_loudness / float(count)
-        return avg_loudness
+        return float(self.features.bar_loudness.mean())
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# encoding: utf=8
+
+'''File: linear_fit.py
+- Fit weights for scorers.LinearScorer by least squares, from recordings
+  whose global offset is already known.
+
+- Each labeled recording gives one training row per (beat, chart chord), and
+  per (one-chord bar, chart chord): the chord.MATCH_TONE_FEATURES of that
+  beat or bar against that chord.  The label is 1 if the chord is the one the
+  chart puts on that beat or bar at the known offset, else 0.
+
+- Each row also gets a constant 1, for an intercept.  Labels are 0 for
+  every chart chord but one, so without it the weights would have to pull
+  every score toward the mean label.  The intercept is fit, then dropped:
+  LinearScorer has no constant term, and a constant added to every score
+  changes no chord's or offset's ranking.
+
+- Rows are never kept.  Each recording is reduced to its normal equations
+  (X'X, X'y) - (F + 1) x (F + 1) and F + 1 numbers - and those just add up
+  across recordings.  The feature tensors are the ones cached on
+  AnalysisFeatures, so sweeping weights or ridge values over a whole corpus
+  only re-solves a 6 x 6 system.
+
+Usage:
+    python linear_fit.py [-r RIDGE] chord_file offset song_filename [offset song_filename ...]
+
+Example:
+    python linear_fit.py blue_bossa_info 3 BlueBossa.mp3 0 BlueBossa2.mp3
+
+'''
+
+import sys
+from optparse import OptionParser
+
+import numpy as np
+
+from chord import get_chord_info
+from chord import get_chord_template
+from chord import MATCH_TONE_FEATURES
+from chord import MATCH_TONE_WEIGHTS
+from scorers import LinearScorer
+
+
+class LabeledRecording(object):
+    """One recording's features, with the chart placed at a known offset.
+    - features: AnalysisFeatures
+    - tune_info: TuneInfo
+    - offset: the known best_global_offset, in bars.
+    """
+    def __init__(self, features, tune_info, offset):
+        self.features = features
+        self.tune_info = tune_info
+        self.offset = offset
+        self.chords = sorted(set(get_chord_info(chord).chord
+                                 for chord in tune_info.unique_chords))
+        self.beat_labels, self.bar_labels = self.calc_labels()
+
+    def calc_labels(self):
+        """The true chord of every beat and bar, as an index into self.chords.
+        - -1 where unlabeled: outside the full choruses from offset, bars of
+          two-chord measures (only their beats are labeled), and beats past
+          the 4th of a bar.
+        - Beats are split between chords the same way as JamTune.match_bar.
+        """
+        changes = self.tune_info.changes
+        chorus_len = len(changes)
+        chord_indexes = dict((chord, index) for index, chord in enumerate(self.chords))
+        beat_labels = -np.ones(self.features.num_beats, dtype=int)
+        bar_labels = -np.ones(self.features.num_bars, dtype=int)
+        num_bars = self.features.num_bars
+        num_choruses = max(num_bars - self.offset, 0) // chorus_len
+        for bar_index in xrange(self.offset, self.offset + num_choruses * chorus_len):
+            measure = changes[(bar_index - self.offset) % chorus_len]
+            beats = self.features.bar_beats[bar_index][self.features.bar_beat_mask[bar_index]]
+            if len(measure) == 2:
+                beat_labels[beats[:2]] = chord_indexes[measure[0]]
+                beat_labels[beats[2:]] = chord_indexes[measure[1]]
+            else:
+                beat_labels[beats[:4]] = chord_indexes[measure[0]]
+                bar_labels[bar_index] = chord_indexes[measure[0]]
+        return beat_labels, bar_labels
+
+    def chord_features(self, chord):
+        """(beat_features, bar_features) of every beat and bar against chord -
+        num_beats x F and num_bars x F arrays.
+        """
+        chord_info = get_chord_info(chord)
+        beat_features, bar_features = self.features.quality_features(
+            get_chord_template(chord_info.quality))
+        return beat_features[chord_info.root_int], bar_features[chord_info.root_int]
+
+    def normal_equations(self):
+        """Return (X'X, X'y) over every labeled (beat or bar, chord) row.
+        - The last column of X is the intercept, 1 in every row.
+        """
+        num_columns = len(MATCH_TONE_FEATURES) + 1
+        xtx = np.zeros((num_columns, num_columns))
+        xty = np.zeros(num_columns)
+        beat_rows = self.beat_labels >= 0
+        bar_rows = self.bar_labels >= 0
+        for chord_index, chord in enumerate(self.chords):
+            beat_features, bar_features = self.chord_features(chord)
+            for rows, labels, chord_features in (
+                    (beat_rows, self.beat_labels, beat_features),
+                    (bar_rows, self.bar_labels, bar_features)):
+                x = np.hstack([chord_features[rows], np.ones((rows.sum(), 1))])
+                y = (labels[rows] == chord_index).astype(float)
+                xtx += np.dot(x.T, x)
+                xty += np.dot(x.T, y)
+        return xtx, xty
+
+
+def fit_weights(labeled_recordings, ridge=0.0):
+    """Least squares weights for LinearScorer, over all labeled_recordings.
+    - labeled_recordings: LabeledRecording objects, or their normal_equations().
+    - ridge: added to the diagonal of X'X, to keep weights small.  Not to
+      the intercept.
+    - return: tuple of weights, one per chord.MATCH_TONE_FEATURES.  The
+      intercept is left out.
+    """
+    num_features = len(MATCH_TONE_FEATURES)
+    xtx = ridge * np.diag([1.0] * num_features + [0.0])
+    xty = np.zeros(num_features + 1)
+    for labeled_recording in labeled_recordings:
+        if isinstance(labeled_recording, LabeledRecording):
+            labeled_recording = labeled_recording.normal_equations()
+        recording_xtx, recording_xty = labeled_recording
+        xtx += recording_xtx
+        xty += recording_xty
+    weights = np.linalg.lstsq(xtx, xty, rcond=-1)[0]
+    return tuple(weights[:num_features].tolist())
+
+
+def offset_accuracy(jam_tunes, known_offsets, weights):
+    """Fraction of jam_tunes that align to their known offset with weights.
+    - Re-aligns each JamTune with a LinearScorer (see JamTune.set_scorer).
+    """
+    scorer = LinearScorer(weights)
+    num_correct = 0
+    for jam_tune, known_offset in zip(jam_tunes, known_offsets):
+        if jam_tune.set_scorer(scorer) == known_offset:
+            num_correct += 1
+    return num_correct / float(max(len(jam_tunes), 1))
+
+
+def main(chord_filename, offset_filenames, ridge):
+    # Imported here, so fitting from cached features doesn't need echonest.
+    from jam_tune import JamTune
+    from tune_info import TuneInfo
+    tune_info = TuneInfo(__import__(chord_filename).tune_info)
+    jam_tunes = []
+    known_offsets = []
+    for offset, filename in offset_filenames:
+        jam_tunes.append(JamTune(tune_info, filename))
+        known_offsets.append(offset)
+    labeled_recordings = [LabeledRecording(jam_tune.features, tune_info, offset)
+                          for jam_tune, offset in zip(jam_tunes, known_offsets)]
+    weights = fit_weights(labeled_recordings, ridge=ridge)
+    for name, weight in zip(MATCH_TONE_FEATURES, weights):
+        print '%-18s %8.4f' % (name, weight)
+    print 'accuracy with v4 weights:     %.3f' % offset_accuracy(
+        jam_tunes, known_offsets, MATCH_TONE_WEIGHTS)
+    print 'accuracy with fitted weights: %.3f' % offset_accuracy(
+        jam_tunes, known_offsets, weights)
+
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options] chord_file offset song_filename [offset song_filename ...]"
+    parser = OptionParser(usage=usage)
+    parser.add_option("-r", "--ridge", dest="ridge",
+                      type="float", default=0.0,
+                      help="Ridge added to the diagonal of X'X")
+    (options, args) = parser.parse_args()
+    if len(args) < 3 or len(args) % 2 != 1:
+        parser.print_help()
+        sys.exit(-1)
+    offset_filenames = [(int(args[index]), args[index + 1])
+                        for index in xrange(1, len(args), 2)]
+    main(args[0], offset_filenames, options.ridge)
@@ -0,0 +1,132 @@
+"""File: offset_search.py
+- Global offset search by FFT cross-correlation.
+
+- A chorus score at start bar s is the sum over chart measures j of measure
+  j's score at bar s + j.  Grouping the chart by unique measure u, that is
+  the cross-correlation of u's per-bar scores (ChordLikelihood.measure_scores)
+  with a 0/1 template of where u is in the chart - summed over u.  All of
+  those are done at once in the frequency domain, with one inverse FFT.
+
+- FFT sums are only good to float rounding, so the offsets that come out
+  within FFT_TOLERANCE of the best are re-scored exactly (with the same
+  additions, in the same order, as JamTune.calc_chorus_scores).  So the best
+  offset is always the same as the diagonal-sum search.  Only those few
+  offsets are re-scored, from the unique measure scores the FFT was done
+  on.  With the 'fft' align mode, alignment never builds the bar x measure
+  matrix (ChordLikelihood.changes_scores) - the bar map and chunk catalog
+  read the same unique measure rows.
+
+- This is not faster than the diagonal sums.  For a 16 bar chart over 2000
+  bars, the FFT search takes about 1 ms, and the diagonal sums about 0.2 ms
+  (one vector add per chart measure).  Both are small next to the bar map.
+  The diagonal sums grow with chart length and the FFT barely does, so only
+  a much longer chart could favor the FFT.
+
+"""
+
+import numpy as np
+
+# Relative tolerance on FFT global offset scores.  Offsets scoring within
+# this of the best are re-scored exactly.
+FFT_TOLERANCE = 1e-9
+
+
+def fft_size(length):
+    """Smallest power of two >= length."""
+    size = 1
+    while size < length:
+        size *= 2
+    return size
+
+
+def unique_measures(changes):
+    """Return (measures, templates) for the changes.
+    - measures: list of unique measures (tuples of chord symbols), in order
+      of first appearance.
+    - templates: len(measures) x len(changes) array, 1 where a measure is
+      in the changes.
+    """
+    measures = []
+    measure_indexes = {}
+    for measure in changes:
+        measure = tuple(measure)
+        if measure not in measure_indexes:
+            measure_indexes[measure] = len(measures)
+            measures.append(measure)
+    templates = np.zeros((len(measures), len(changes)))
+    for index, measure in enumerate(changes):
+        templates[measure_indexes[tuple(measure)], index] = 1
+    return measures, templates
+
+
+def fft_chorus_scores(measure_scores, templates, num_cycles):
+    """Score of a full chorus at each of the first num_cycles start bars, by
+    FFT cross-correlation.
+    - measure_scores: num_measures x num_bars array - each unique measure
+      scored against every bar.
+    - templates: num_measures x chorus_len array, see unique_measures().
+    - return: array of num_cycles chorus scores.
+    """
+    num_bars = measure_scores.shape[1]
+    size = fft_size(num_bars + templates.shape[1])
+    spectrum = (np.fft.rfft(measure_scores, size) *
+                np.conj(np.fft.rfft(templates, size))).sum(axis=0)
+    return np.fft.irfft(spectrum, size)[:num_cycles]
+
+
+def fold_global_offset_scores(chorus_scores, chorus_len):
+    """Total chorus score for each global offset - start bars equal to it,
+    modulo chorus_len.  Padded with zeros to a whole number of choruses,
+    then one row per chorus added in order.
+    """
+    num_rows = -(-len(chorus_scores) // chorus_len)
+    padded = np.zeros(num_rows * chorus_len)
+    padded[:len(chorus_scores)] = chorus_scores
+    global_offset_scores = np.zeros(chorus_len)
+    for row in padded.reshape(num_rows, chorus_len):
+        global_offset_scores += row
+    return global_offset_scores
+
+
+def exact_global_offset_score(measure_scores, templates, global_offset, num_cycles):
+    """One global offset's score, added up exactly as the diagonal-sum search
+    does it.
+    - measure_scores, templates: as for fft_chorus_scores().
+    """
+    chorus_len = templates.shape[1]
+    # Row of measure_scores for each chart measure.
+    measure_indexes = templates.argmax(axis=0)
+    start_bars = np.arange(global_offset, num_cycles, chorus_len)
+    chorus_scores = np.zeros(len(start_bars))
+    for index in xrange(chorus_len):
+        chorus_scores += measure_scores[measure_indexes[index], start_bars + index]
+    score = np.zeros(1)
+    for chorus_score in chorus_scores:
+        score += chorus_score
+    return score[0]
+
+
+def refine_global_offset_scores(global_offset_scores, measure_scores, templates,
+                                num_cycles, tolerance=FFT_TOLERANCE):
+    """Re-score exactly the offsets that FFT rounding could put first.
+    - measure_scores, templates: as for fft_chorus_scores().
+    - return: copy of global_offset_scores, with those offsets exact.
+    """
+    global_offset_scores = global_offset_scores.copy()
+    if len(global_offset_scores) == 0:
+        return global_offset_scores
+    slack = tolerance * max(1.0, np.abs(global_offset_scores).max())
+    best_score = global_offset_scores.max()
+    for global_offset in np.flatnonzero(global_offset_scores >= best_score - slack):
+        global_offset_scores[global_offset] = exact_global_offset_score(
+            measure_scores, templates, global_offset, num_cycles)
+    return global_offset_scores
+
+
+def rank_global_offsets(global_offset_scores):
+    """Return [(global_offset, score), ...], best first.  Ties go to the
+    lowest offset, like the best_global_offset search.
+    """
+    order = np.argsort(-np.asarray(global_offset_scores), kind='mergesort')
+    return [(int(global_offset), global_offset_scores[global_offset])
+            for global_offset in order]
@@ -0,0 +1,80 @@
+"""File: score_trace.py
+- Structured tracing of match scores, for offline study/debug.
+
+- Tracing is off unless start_trace() is called.  Hot code checks
+  score_trace.TRACE before building a record, so when tracing is off the
+  only cost is that one check:
+
+    if score_trace.TRACE:
+        score_trace.TRACE.record('chorus', start_bar=3, score=12.5)
+
+- Records are written one JSON object per line (JSONL).  If the filename
+  ends with '.gz', the file is gzipped.
+- Each record has a 'kind' field, eg:
+  - 'min_max': one min/max sub-score of one tone vector (chord.py)
+  - 'chorus': per-bar and per-beat scores for one chorus start bar (jam_tune.py)
+  - 'global_offset': total score for one global offset (jam_tune.py)
+
+"""
+
+import gzip
+import json
+
+# The active ScoreTrace, or None when tracing is off.
+TRACE = None
+
+
+class ScoreTrace(object):
+    """Write score records to a JSONL file."""
+    def __init__(self, filename):
+        self.filename = filename
+        if filename.endswith('.gz'):
+            self.out_file = gzip.open(filename, 'wb')
+        else:
+            self.out_file = open(filename, 'w')
+        self.num_records = 0
+
+    def record(self, kind, **fields):
+        fields['kind'] = kind
+        self.out_file.write(json.dumps(fields, separators=(',', ':'),
+                                       default=to_json) + '\n')
+        self.num_records += 1
+
+    def close(self):
+        self.out_file.close()
+
+
+def to_json(value):
+    """json.dumps default - handle numpy values and other sequences."""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return list(value)
+
+
+def start_trace(filename):
+    """Start writing score records to filename."""
+    global TRACE
+    stop_trace()
+    TRACE = ScoreTrace(filename)
+    return TRACE
+
+
+def stop_trace():
+    """Stop tracing, and close the trace file, if any."""
+    global TRACE
+    if TRACE:
+        TRACE.close()
+    TRACE = None
+
+
+def read_trace(filename, kind=None):
+    """Return the records from a trace file - only those of kind, if given."""
+    if filename.endswith('.gz'):
+        in_file = gzip.open(filename, 'rb')
+    else:
+        in_file = open(filename)
+    records = [json.loads(line) for line in in_file]
+    in_file.close()
+    if kind != None:
+        records = [record for record in records if record['kind'] == kind]
+    return records
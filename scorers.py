@@ -0,0 +1,217 @@
+"""File: scorers.py
+- Named registry of chord-matching scorers, so alignment can use any of the
+  scoring generations in chord.py without code edits.
+
+  - 'v1': ChordInfo.match_analysis_tone_vector - bar tone vector vs its average.
+  - 'v2': ChordInfo.match_analysis_bar - is the peak tone of the bar, and of
+          each beat, a chord tone.
+  - 'v3': ChordInfo.match_beats_OLD - 2 if a beat's strongest tone is a chord
+          tone, 1 if its 2nd strongest is.
+  - 'v4': ChordInfo.match_beats / match_bar / match_tone_vector.  The default.
+          A LinearScorer with chord.MATCH_TONE_WEIGHTS.
+
+- Each scorer is a batch kernel: match_tone_matrix() scores an N x 12 tone
+  matrix against K chord masks at once, using ranks shared through
+  AnalysisFeatures.  How beat and bar scores are combined into one measure
+  score is given by beat_weight, bar_weight and divisor:
+    (beat_weight * beat_score + bar_weight * bar_score) / divisor
+  for a one-chord measure.  A two-chord measure is always the sum of its
+  beat scores, first two beats to the first chord, the rest to the second.
+
+- Select one by name with get_scorer(), from TuneInfo ('scorer' in the
+  tune_info dict) or with jam.py --scorer.
+
+- LinearScorer scores with any weights for chord.MATCH_TONE_FEATURES - the
+  v4 sub-scores.  The sub-scores are cached per chord quality on
+  AnalysisFeatures, so re-scoring with new weights is one weighted sum.
+  See linear_fit.py for fitting weights.
+
+"""
+
+import abc
+
+import numpy as np
+
+from chord import match_tone_features
+from chord import weighted_feature_sum
+from chord import MATCH_TONE_FEATURES
+from chord import MATCH_TONE_WEIGHTS
+from chord import rank_tone_vectors
+from chord import CHORD_TONE_CONST
+from chord import OTHER_TONE_CONST
+
+DEFAULT_SCORER = 'v4'
+
+# Scorer name -> scorer object.
+SCORERS = {}
+
+
+class ScorerException(Exception):
+    pass
+
+
+def register_scorer(scorer_class):
+    """Class decorator - add an instance of scorer_class to SCORERS, by its name."""
+    SCORERS[scorer_class.name] = scorer_class()
+    return scorer_class
+
+
+def get_scorer(scorer=None):
+    """Return the scorer with this name (or the default scorer for None).
+    - A scorer object is returned as is.
+    """
+    if scorer == None:
+        scorer = DEFAULT_SCORER
+    if isinstance(scorer, Scorer):
+        return scorer
+    if scorer not in SCORERS:
+        raise ScorerException("Unknown scorer: %s.  Expected one of: %s" %
+                              (scorer, ', '.join(scorer_names())))
+    return SCORERS[scorer]
+
+
+def scorer_names():
+    return sorted(SCORERS.keys())
+
+
+class Scorer(object):
+    """Base scorer.  Subclasses set name, weights, and match_tone_matrix."""
+    __metaclass__ = abc.ABCMeta
+
+    name = None
+    beat_weight = 1
+    bar_weight = 0
+    divisor = 1
+
+    @abc.abstractmethod
+    def match_tone_matrix(self, tone_matrix, chord_masks, anti_count, ranks=None):
+        """Score every row of tone_matrix against K chords.
+        - chord_masks: K x 12 boolean array, the notes of each chord.
+        - anti_count: number of anti-notes, the same for all K chords.
+        - ranks: (max_ranks, min_ranks) from rank_tone_vectors, if already known.
+        - return: K x N array of scores.
+        """
+
+    def score_quality(self, features, template):
+        """Score a chord quality at all 12 roots against every beat and bar.
+        - features: AnalysisFeatures
+        - template: chord.ChordTemplate
+        - return: (beat_scores, bar_scores), 12 rows each, one per root.
+        """
+        return (self.match_tone_matrix(features.beat_tones, template.root_masks,
+                                       template.anti_note_count,
+                                       ranks=features.beat_ranks),
+                self.match_tone_matrix(features.bar_tones, template.root_masks,
+                                       template.anti_note_count,
+                                       ranks=features.bar_ranks))
+
+    @property
+    def key(self):
+        """What chord likelihoods are cached by (see JamTune.chord_likelihoods).
+        Scorers with the same key score the same.
+        """
+        return self.name
+
+    def combine_measure(self, beat_score, bar_score):
+        """Score for a one-chord measure, from its beat and bar scores."""
+        return (self.beat_weight * beat_score + self.bar_weight * bar_score) / float(self.divisor)
+
+
+@register_scorer
+class ToneVectorAverageScorer(Scorer):
+    """v1 - chord tones away from the tone vector average, weighted by how far.
+    - Bar only.
+    """
+    name = 'v1'
+    beat_weight = 0
+    bar_weight = 1
+
+    def match_tone_matrix(self, tone_matrix, chord_masks, anti_count, ranks=None):
+        tone_vector_avgs = tone_matrix.mean(axis=1)[:, np.newaxis]
+        deltas = tone_matrix - tone_vector_avgs
+        chord_masks = chord_masks.astype(float)
+        # Chord tones: + above average, - below average.
+        scores = np.dot(deltas, chord_masks.T) * CHORD_TONE_CONST
+        # Demerits if non-chord-tones are strong.
+        scores -= np.dot(np.maximum(deltas, 0), (1 - chord_masks).T) * OTHER_TONE_CONST
+        # Normalize to number of notes in chord
+        scores /= chord_masks.sum(axis=1)
+        return scores.T
+
+
+@register_scorer
+class PeakToneScorer(Scorer):
+    """v2 - 1 if the strongest tone is a chord tone.
+    - Bar plus every beat.
+    """
+    name = 'v2'
+    beat_weight = 1
+    bar_weight = 1
+
+    def match_tone_matrix(self, tone_matrix, chord_masks, anti_count, ranks=None):
+        if ranks == None:
+            ranks = rank_tone_vectors(tone_matrix)
+        max_ranks, _ = ranks
+        return chord_masks[:, max_ranks[:, 0]].astype(float)
+
+
+@register_scorer
+class TopTwoToneScorer(Scorer):
+    """v3 - 2 if the strongest tone is a chord tone, 1 if the 2nd strongest is.
+    - Beats only.
+    """
+    name = 'v3'
+    beat_weight = 1
+    bar_weight = 0
+
+    def match_tone_matrix(self, tone_matrix, chord_masks, anti_count, ranks=None):
+        if ranks == None:
+            ranks = rank_tone_vectors(tone_matrix)
+        max_ranks, _ = ranks
+        return (2.0 * chord_masks[:, max_ranks[:, 0]] +
+                chord_masks[:, max_ranks[:, 1]])
+
+
+class LinearScorer(Scorer):
+    """Weighted sum of the v4 sub-scores (chord.MATCH_TONE_FEATURES).
+    - weights: one per feature.
+    - Beat/bar weights for measures are the same as v4.
+    - name rounds the weights (for display), so scorers are told apart by
+      their exact weights - see key.
+    """
+    beat_weight = 1
+    bar_weight = 4
+    divisor = 2
+
+    def __init__(self, weights=MATCH_TONE_WEIGHTS, name=None):
+        assert(len(weights) == len(MATCH_TONE_FEATURES))
+        self.weights = tuple(weights)
+        if name == None:
+            name = 'linear(%s)' % ','.join('%g' % weight for weight in self.weights)
+        self.name = name
+
+    @property
+    def key(self):
+        return ('linear', self.weights)
+
+    def match_tone_matrix(self, tone_matrix, chord_masks, anti_count, ranks=None):
+        features = match_tone_features(tone_matrix, chord_masks, anti_count, ranks=ranks)
+        return weighted_feature_sum(features, self.weights)
+
+    def score_quality(self, features, template):
+        """Weighted sum of the sub-scores cached on features."""
+        beat_features, bar_features = features.quality_features(template)
+        return (weighted_feature_sum(beat_features, self.weights),
+                weighted_feature_sum(bar_features, self.weights))
+
+
+@register_scorer
+class MinMaxDeltaScorer(LinearScorer):
+    """v4 - min/max ranked tones plus delta average.  See ChordInfo.match_tone_vector.
+    - Measure is 4 beats, but then scale so overall weight is the same as
+      for when no bar.
+    """
+    name = 'v4'
+
+    def __init__(self):
+        LinearScorer.__init__(self, weights=MATCH_TONE_WEIGHTS, name=self.name)
@@ -9,11 +9,62 @@ __author__ = "James Dean (james@echonest.com)"
 __date__   = "Thu Oct 10 16:00:00 2013"
 
 
+import os
+import pickle
+import random
+import shutil
+import tempfile
+
 import unittest2 as unittest
+import numpy as np
 
 from jam import Jammer
+from jam_tune import JamTune
+from jam_tune import ROLE_SOLO
+from audio_bars import AudioBars
+from audio_bars import render_audio_bars
 from chord import ChordInfo
 from chord import CHORD_TO_CHORD_INFO
+from chord import get_chord_info
+from chord import ChordParseException
+from chord import match_tone_vectors_by_chord
+from chord import rank_tone_vectors
+from chord import match_delta_average
+from chord import get_chord_template
+from chord import get_chord_table
+import score_trace
+from analysis_features import AnalysisFeatures
+from analysis_features import chroma_peakiness
+from analysis_features import drum_bars
+from chord_likelihood import ChordLikelihood
+from scorers import get_scorer
+from scorers import scorer_names
+from scorers import ScorerException
+from scorers import LinearScorer
+from scorers import Scorer
+from tune_info import TuneInfo
+from tune_info import half_time_changes
+from tune_info import HALF_TIME_AUTO
+from linear_fit import LabeledRecording
+from linear_fit import fit_weights
+from linear_fit import offset_accuracy
+from chord_chart import ChordChartParser
+from chord_chart import ChartParseException
+from offset_search import unique_measures
+from offset_search import fft_chorus_scores
+from offset_search import fold_global_offset_scores
+from offset_search import refine_global_offset_scores
+from offset_search import rank_global_offsets
+from bar_map import banded_bar_map
+from bar_map import changes_scores_std
+from bar_map import chorus_bar_map
+from analysis_cache import AnalysisCache
+from chart_library import ChartLibrary
+from chunk_catalog import calc_chunks
+from duration import Bins
+from duration import DurationProfile
+from duration import DurationInfo
+from chunk_catalog import ChunkCatalog
 
 class TestParseChord(unittest.TestCase):
 
@@ -302,6 +353,40 @@ class TestParseChord(unittest.TestCase):
             }
         self.assertEqual(chord_info.chord_info, expected)
 
+    def test_parse_chord_extended(self):
+        # (note_ints, anti_note_ints)
+        expected = {
+            'Co': ((0, 3, 6), (4, )),
+            'Co7': ((0, 3, 6, 9), (4, )),
+            'C6': ((0, 4, 7, 9), (1, 3, 10)),
+            'Cm6': ((0, 3, 7, 9), (1, 4, 10)),
+            'C9': ((0, 4, 7, 10, 2), (11, )),
+            'Csus': ((0, 5, 7), (4, )),
+            'C7sus4': ((0, 5, 7, 10), (11, 4)),
+            'Csus2': ((0, 2, 7), (4, )),
+            'C7#5': ((0, 4, 8, 10), (11, 7)),
+            'Cb5': ((0, 4, 6), (3, )),
+            'F#m7': ((6, 9, 1, 4), (7, 10, 5)),
+            'Bbm7/Ab': ((10, 1, 5, 8), (11, 2, 9)),
+            'A7/E': ((9, 1, 4, 7), (8, )),
+            }
+        for chord, (note_ints, anti_note_ints) in expected.items():
+            chord_info = get_chord_info(chord)
+            self.assertEqual((chord_info.note_ints, chord_info.anti_note_ints),
+                             (note_ints, anti_note_ints), chord)
+
+    def test_parse_chord_spelling(self):
+        self.assertEqual(get_chord_info('C#m7').note_ints, get_chord_info('Dbm7').note_ints)
+        self.assertEqual(get_chord_info('bbm7').root_int, 10)
+        # Slash chord qualities are relative to the root.
+        self.assertEqual(get_chord_info('A7/E').quality, '7/G')
+        self.assertEqual(get_chord_template('7/G').chord(9), 'A7/E')
+
+    def test_parse_chord_fails(self):
+        for chord in ['Hm7', 'Cm7x', 'Cmsus4']:
+            with self.assertRaises(ChordParseException):
+                get_chord_info(chord)
+
 
 
 class TestMatchSupport(unittest.TestCase):
@@ -869,6 +954,1146 @@ class TestMatchChord(unittest.TestCase):
 
 
 
+class TestMatchBatch(unittest.TestCase):
+    """Batch (N x 12 array) matching must give the same scores as one tone_vector at a time.
+    """
+    def setUp(self):
+        self.maxDiff = None
+        rand = random.Random(1234)
+        # Include repeated values, so ties get exercised.
+        self.tone_vectors = [[rand.choice([0.1, 0.5, rand.random()])
+                              for _ in xrange(12)]
+                             for _ in xrange(200)]
+
+    def tearDown(self):
+        pass
+
+    def test_indexes_of_max_min_n_batch(self):
+        chord_info = ChordInfo("CM7")
+        res = chord_info.indexes_of_max_n_batch(
+            np.array([[4, 0, 0, 0, 8, 9, 0, 2, 0, 0, 0, 1]]), count=4)
+        self.assertEqual(res.tolist(), [[5, 4, 0, 7]])
+        res = chord_info.indexes_of_min_n_batch(
+            np.array([[0.2, 0.3, 0.9, 0.9, 0.8, 0.9, 0.1, 0.2, 0.3, 5, 5, 1]]), count=4)
+        self.assertEqual(res.tolist(), [[6, 0, 7, 1]])
+
+    def test_rank_tone_vectors_ties(self):
+        # Equal values keep the lowest index first, for both max and min.
+        max_ranks, min_ranks = rank_tone_vectors(
+            [[0.5, 0.9, 0.5, 0.1, 0.9, 0.1, 0.5, 0.5, 0.1, 0.5, 0.5, 0.5]])
+        self.assertEqual(max_ranks[0, :4].tolist(), [1, 4, 0, 2])
+        self.assertEqual(min_ranks[0, :4].tolist(), [3, 5, 8, 0])
+
+    def test_match_tone_vectors(self):
+        for chord in ['CM7', 'Cm7', 'Dm7b5', 'G7', 'Ebm7', 'Ab7', 'DbM7']:
+            chord_info = get_chord_info(chord)
+            expected = [chord_info.match_tone_vector(tone_vector)
+                        for tone_vector in self.tone_vectors]
+            res = chord_info.match_tone_vectors(np.array(self.tone_vectors))
+            self.assertEqual(res.tolist(), expected)
+
+    def test_match_delta_average(self):
+        chord_infos = [get_chord_info(chord) for chord in ['CM7', 'Cm7', 'G7']]
+        chord_masks = np.array([chord_info.chord_mask for chord_info in chord_infos])
+        scores, raw_scores = match_delta_average(self.tone_vectors, chord_masks)
+        self.assertEqual(raw_scores.shape, (3, 200))
+        for chord_info, chord_scores, chord_raw_scores in zip(chord_infos, scores, raw_scores):
+            expected = [chord_info.match_tone_vector_delta_average(tone_vector)
+                        for tone_vector in self.tone_vectors]
+            self.assertEqual(zip(chord_scores.tolist(), chord_raw_scores.tolist()),
+                             expected)
+
+    def test_match_tone_vectors_by_chord(self):
+        chord_infos = [get_chord_info(['Cm7', 'G7', 'DbM7'][index % 3])
+                       for index in xrange(len(self.tone_vectors))]
+        expected = [chord_info.match_tone_vector(tone_vector)
+                    for chord_info, tone_vector in zip(chord_infos, self.tone_vectors)]
+        res = match_tone_vectors_by_chord(chord_infos, self.tone_vectors)
+        self.assertEqual(res.tolist(), expected)
+
+
+class TestChordTemplate(unittest.TestCase):
+
+    def setUp(self):
+        rand = random.Random(99)
+        self.tone_vectors = [[rand.choice([0.1, 0.5, rand.random()])
+                              for _ in xrange(12)]
+                             for _ in xrange(100)]
+
+    def test_template(self):
+        chord_info = get_chord_info('Dm7b5')
+        self.assertEqual(chord_info.quality, 'm7b5')
+        template = chord_info.template
+        self.assertTrue(template is get_chord_template('m7b5'))
+        # C Eb Gb Bb
+        self.assertEqual(template.note_bits, (1 << 0) | (1 << 3) | (1 << 6) | (1 << 10))
+        self.assertEqual(template.chord(2), 'Dm7b5')
+        self.assertEqual(np.nonzero(template.root_masks[2])[0].tolist(), [0, 2, 5, 8])
+
+    def test_all_roots_match_each_chord(self):
+        for quality in ['m7', '7', 'M7', 'm7b5']:
+            scores = get_chord_template(quality).match_tone_vectors(self.tone_vectors)
+            self.assertEqual(scores.shape, (12, 100))
+            # Root 6 is left out - 'F#' isn't accepted by the chord parser.
+            for root in ['C', 'Db', 'D', 'Eb', 'E', 'F', 'G', 'Ab', 'A', 'Bb', 'B']:
+                chord_info = get_chord_info(root + quality)
+                expected = chord_info.match_tone_vectors(self.tone_vectors)
+                self.assertEqual(scores[chord_info.root_int].tolist(), expected.tolist())
+
+
+class TestChordTable(unittest.TestCase):
+
+    def test_compact_chord_info(self):
+        chord_info = ChordInfo("Cm7")
+        self.assertFalse(hasattr(chord_info, '__dict__'))
+        # C Eb G Bb
+        self.assertEqual(chord_info.note_bits, (1 << 0) | (1 << 3) | (1 << 7) | (1 << 10))
+        self.assertEqual(chord_info.note_indexes.tolist(), [0, 3, 7, 10])
+        self.assertEqual(chord_info.anti_note_indexes.tolist(), [1, 4, 11])
+        self.assertEqual(np.nonzero(chord_info.chord_mask)[0].tolist(), [0, 3, 7, 10])
+        self.assertTrue(chord_info.index_is_in_chord(3))
+        self.assertFalse(chord_info.index_is_in_chord(4))
+        self.assertEqual(chord_info.chord_info['note_ints'], (0, 3, 7, 10))
+
+    def test_chord_table(self):
+        chord_table = get_chord_table()
+        self.assertTrue(chord_table is get_chord_table())
+        self.assertEqual(len(chord_table), 12 * len(chord_table.qualities))
+        index = chord_table.index('F#m7')
+        self.assertEqual(chord_table.chords[index], 'F#m7')
+        self.assertEqual(chord_table.get_chord_info(index).note_ints, (6, 9, 1, 4))
+        self.assertEqual(chord_table.note_bits[chord_table.index('Cm7')],
+                         ChordInfo("Cm7").note_bits)
+        self.assertTrue('Ab7' in chord_table)
+        with self.assertRaises(AttributeError):
+            chord_table.chords = ()
+        with self.assertRaises(ValueError):
+            chord_table.chord_masks[0, 0] = True
+
+
+class FakeQuantum(object):
+    """Just enough of an analysis beat or bar for matching tests."""
+    def __init__(self, pitches, children=None, duration=0.5, start=0.0, loudness=-20.0):
+        self.pitches = pitches
+        self._children = children or []
+        self.duration = duration
+        self.start = start
+        self.loudness = loudness
+
+    def mean_pitches(self):
+        return self.pitches
+
+    def mean_loudness(self):
+        return self.loudness
+
+    def children(self):
+        return self._children
+
+
+def fake_beats_and_bars(num_bars, seed=1234):
+    rand = random.Random(seed)
+    beats = []
+    bars = []
+    for _ in xrange(num_bars):
+        bar_beats = [FakeQuantum([rand.random() for _ in xrange(12)])
+                     for _ in xrange(4)]
+        beats.extend(bar_beats)
+        bars.append(FakeQuantum([rand.random() for _ in xrange(12)],
+                                children=bar_beats, duration=2.0))
+    return beats, bars
+
+
+class TestChordLikelihood(unittest.TestCase):
+
+    def setUp(self):
+        self.beats, self.bars = fake_beats_and_bars(10)
+        self.features = AnalysisFeatures(self.beats, self.bars)
+
+    def test_features(self):
+        self.assertEqual(self.features.beat_tones.shape, (40, 12))
+        self.assertEqual(self.features.bar_tones.shape, (10, 12))
+        self.assertEqual(self.features.bar_beats[2].tolist(), [8, 9, 10, 11])
+
+    def test_loudness_features(self):
+        self.assertEqual(self.features.beat_loudness.shape, (40,))
+        self.assertEqual(self.features.bar_loudness.tolist(), [-20.0] * 10)
+        self.assertEqual(self.features.beat_peakiness.tolist(),
+                         chroma_peakiness(self.features.beat_tones).tolist())
+        self.assertEqual(self.features.bar_peakiness.shape, (10,))
+        tones = [[1.0] * 12, [1.0, 0.0, 0.0, 0.0] * 3, [0.0] * 12]
+        self.assertEqual(chroma_peakiness(tones).tolist(), [0.0, 0.75, 0.0])
+        # Flat and loud is drums.  Flat and quiet is a break.
+        self.assertEqual(drum_bars(np.array([0.1, 0.1, 0.6]), np.array([-20.0, -30.0, -20.0]),
+                                   -21.0).tolist(),
+                         [True, False, False])
+
+    def test_scores(self):
+        chord_likelihood = ChordLikelihood(self.features, ['Cm7', 'G7', 'Cm7 '])
+        self.assertEqual(chord_likelihood.chords, ['Cm7', 'G7'])
+        self.assertEqual(chord_likelihood.beat_scores.shape, (2, 40))
+        self.assertEqual(chord_likelihood.bar_scores.shape, (2, 10))
+        g7 = get_chord_info('G7')
+        self.assertEqual(chord_likelihood.beat_scores[1].tolist(),
+                         [g7.match_tone_vector(beat.mean_pitches()) for beat in self.beats])
+
+    def test_no_anti_notes(self):
+        # Triads and some slash chords have no anti-notes.
+        self.assertEqual(get_chord_info('C').anti_note_ints, ())
+        self.assertEqual(get_chord_info('C/Bb').anti_note_ints, ())
+        chords = ['C', 'F7/C', 'C/Bb']
+        chord_likelihood = ChordLikelihood(self.features, chords)
+        self.assertEqual(chord_likelihood.chords, chords)
+        for index, chord in enumerate(chords):
+            chord_info = get_chord_info(chord)
+            self.assertEqual(chord_likelihood.bar_scores[index].tolist(),
+                             [chord_info.match_tone_vector(bar.mean_pitches())
+                              for bar in self.bars])
+        self.assertEqual(len(chord_likelihood.measure_scores(['C', 'C/Bb'])), 10)
+
+    def test_measure_scores(self):
+        chord_likelihood = ChordLikelihood(self.features, ['Cm7'])
+        cm7 = get_chord_info('Cm7')
+        g7 = get_chord_info('G7')
+        expected = [(cm7.match_beats(bar.children()[:4]) + 4 * cm7.match_bar(bar)) / 2.0
+                    for bar in self.bars]
+        self.assertEqual(chord_likelihood.measure_scores(['Cm7']).tolist(), expected)
+        # Two chords in a measure - G7 gets added on demand.
+        expected = [cm7.match_beats(bar.children()[:2]) + g7.match_beats(bar.children()[2:])
+                    for bar in self.bars]
+        self.assertEqual(chord_likelihood.measure_scores(['Cm7', 'G7']).tolist(), expected)
+        self.assertEqual(chord_likelihood.chords, ['Cm7', 'G7'])
+
+    def test_unique_changes_scores(self):
+        chord_likelihood = ChordLikelihood(self.features, ['Cm7'])
+        changes = [['Cm7'], ['Fm7'], ['Cm7'], ['Dm7b5', 'G7']]
+        measure_scores, measure_indexes = chord_likelihood.unique_changes_scores(changes)
+        self.assertEqual(measure_scores.shape, (3, 10))
+        self.assertEqual(measure_indexes.tolist(), [0, 1, 0, 2])
+        self.assertEqual(measure_scores[measure_indexes].T.tolist(),
+                         chord_likelihood.changes_scores(changes).tolist())
+
+    def test_transposed(self):
+        chord_likelihood = ChordLikelihood(self.features, ['Cm7', 'G7'])
+        transposed = chord_likelihood.transposed(2)
+        self.assertEqual(transposed.chords, ['Cm7', 'G7'])
+        self.assertTrue(transposed.quality_scores is chord_likelihood.quality_scores)
+        expected = ChordLikelihood(self.features, ['Dm7', 'A7'])
+        self.assertEqual(transposed.beat_scores.tolist(), expected.beat_scores.tolist())
+        self.assertEqual(transposed.bar_scores.tolist(), expected.bar_scores.tolist())
+
+    def test_measure_beat_window_scores(self):
+        chord_likelihood = ChordLikelihood(self.features, ['Dm7b5', 'G7'])
+        window_scores = chord_likelihood.measure_beat_window_scores(['G7'])
+        # One score per start beat with 4 beats after it.
+        self.assertEqual(len(window_scores), 37)
+        # Starting on a bar line, the same as the beat part of measure_scores.
+        self.assertEqual(window_scores[::4].tolist(),
+                         chord_likelihood.bar_beat_sums('G7', 0, 4).tolist())
+        window_scores = chord_likelihood.measure_beat_window_scores(['Dm7b5', 'G7'])
+        expected = chord_likelihood.measure_scores(['Dm7b5', 'G7'])
+        for score, expected_score in zip(window_scores[::4], expected):
+            self.assertAlmostEqual(score, expected_score)
+
+
+class TestScorers(unittest.TestCase):
+    """Each registered scorer must match the scoring generation it is named for.
+    """
+    def setUp(self):
+        self.beats, self.bars = fake_beats_and_bars(10)
+        self.features = AnalysisFeatures(self.beats, self.bars)
+
+    def measure_scores(self, scorer, chord):
+        return ChordLikelihood(self.features, [chord], scorer=scorer).measure_scores([chord])
+
+    def test_registry(self):
+        self.assertEqual(scorer_names(), ['v1', 'v2', 'v3', 'v4'])
+        self.assertEqual(get_scorer().name, 'v4')
+        self.assertTrue(get_scorer(get_scorer('v2')) is get_scorer('v2'))
+        with self.assertRaises(ScorerException):
+            get_scorer('v5')
+
+    def test_abstract_base(self):
+        with self.assertRaises(TypeError):
+            Scorer()
+
+    def test_v1(self):
+        chord_info = get_chord_info('Cm7')
+        expected = [chord_info.match_analysis_tone_vector(bar) for bar in self.bars]
+        for score, expected_score in zip(self.measure_scores('v1', 'Cm7'), expected):
+            self.assertAlmostEqual(score, expected_score)
+
+    def test_v2(self):
+        chord_info = get_chord_info('G7')
+        expected = [chord_info.match_analysis_bar(bar) for bar in self.bars]
+        self.assertEqual(self.measure_scores('v2', 'G7').tolist(), expected)
+
+    def test_v3(self):
+        chord_info = get_chord_info('Ebm7')
+        expected = [chord_info.match_beats_OLD(bar.children()) for bar in self.bars]
+        self.assertEqual(self.measure_scores('v3', 'Ebm7').tolist(), expected)
+
+    def test_linear_v4_weights(self):
+        scorer = LinearScorer()
+        self.assertEqual(scorer.name, 'linear(1,1,1,1,2)')
+        self.assertEqual(self.measure_scores(scorer, 'Dm7b5').tolist(),
+                         self.measure_scores('v4', 'Dm7b5').tolist())
+
+    def test_linear_weights(self):
+        # Only the delta average: same as the delta average sub-score.
+        chord_info = get_chord_info('Cm7')
+        scorer = LinearScorer((0, 0, 0, 0, 1))
+        scores = ChordLikelihood(self.features, ['Cm7'], scorer=scorer).beat_scores[0]
+        self.assertEqual(scores.tolist(),
+                         [chord_info.match_tone_vector_delta_average(beat.mean_pitches())[0]
+                          for beat in self.beats])
+
+
+class TestLinearFit(unittest.TestCase):
+
+    def setUp(self):
+        beats, bars = fake_beats_and_bars(10)
+        self.features = AnalysisFeatures(beats, bars)
+        self.tune_info = TuneInfo({'changes': [['Cm7'], ['Fm7'], ['Dm7b5', 'G7']]})
+
+    def test_labels(self):
+        labeled = LabeledRecording(self.features, self.tune_info, 1)
+        self.assertEqual(labeled.chords, ['Cm7', 'Dm7b5', 'Fm7', 'G7'])
+        # 3 full choruses, from bar 1.
+        self.assertEqual(labeled.bar_labels.tolist(),
+                         [-1, 0, 2, -1, 0, 2, -1, 0, 2, -1])
+        self.assertEqual(labeled.beat_labels[12:16].tolist(), [1, 1, 3, 3])
+
+    def test_fit_weights(self):
+        labeled = LabeledRecording(self.features, self.tune_info, 1)
+        weights = fit_weights([labeled], ridge=0.1)
+        self.assertEqual(len(weights), 5)
+        # Same fit from normal equations, added up.
+        xtx, xty = labeled.normal_equations()
+        # The last column is the intercept: one row per labeled beat or bar,
+        # per chord.
+        self.assertEqual(xtx.shape, (6, 6))
+        self.assertEqual(xtx[-1, -1], len(labeled.chords) *
+                         ((labeled.beat_labels >= 0).sum() + (labeled.bar_labels >= 0).sum()))
+        for weight, expected in zip(fit_weights([(xtx / 2, xty / 2)] * 2, ridge=0.1),
+                                    weights):
+            self.assertAlmostEqual(weight, expected)
+
+
+class TestScoreTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.trace_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        score_trace.stop_trace()
+        shutil.rmtree(self.trace_dir)
+
+    def test_trace_off_by_default(self):
+        self.assertEqual(score_trace.TRACE, None)
+
+    def test_trace_min_max(self):
+        trace_filename = os.path.join(self.trace_dir, 'trace.jsonl.gz')
+        score_trace.start_trace(trace_filename)
+        chord_info = ChordInfo("CM7")
+        chord_info.match_tone_vector_min_max_vector_tones_2(
+            tone_vector = [1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 1],
+            indexes = chord_info.note_ints,
+            min_max = 'max',
+            in_is_good = True)
+        score_trace.stop_trace()
+        records = score_trace.read_trace(trace_filename, kind='min_max')
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['chord'], 'CM7')
+        self.assertEqual(records[0]['key_indexes'], [0, 4, 7, 11])
+        self.assertEqual(records[0]['matched_indexes'], [0, 4, 7, 11])
+        self.assertEqual(records[0]['raw_score'], 1.875)
+
+
+CHARTS = """
+# Two charts.
+title: Blue Bossa
+Cm7 | Cm7 | Fm7 | Fm7 |
+Dm7b5 | G7 | Cm7 | Cm7 |
+Ebm7 | Ab7 | DbM7 | % |
+Dm7b5 | G7 | Cm7 | % |
+
+| C#m7 F#7 | BM7 | Bbm7/Ab | Co7
+"""
+
+
+class TestChordChart(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = ChordChartParser()
+
+    def test_parse_charts(self):
+        charts = self.parser.parse_charts(CHARTS)
+        self.assertEqual([chart.title for chart in charts], ['Blue Bossa', None])
+        blue_bossa = __import__('blue_bossa_info').tune_info
+        self.assertEqual(charts[0].changes, blue_bossa['changes'])
+        self.assertEqual(charts[0].measure_starts[:3].tolist(), [0, 1, 2])
+        # Spelled as in the chord table.
+        self.assertEqual(charts[1].changes,
+                         [['Dbm7', 'F#7'], ['BM7'], ['Bbm7/Ab'], ['Co7']])
+        self.assertEqual(TuneInfo(charts[1].tune_info()).chorus_num_bars, 4)
+
+    def test_shared_table(self):
+        charts = self.parser.parse_charts(CHARTS)
+        chord_table = get_chord_table()
+        # Same indexes as the default table, for its qualities.
+        self.assertEqual(charts[0].chord_indexes[0], chord_table.index('Cm7'))
+        self.assertTrue(charts[0].chord_table is charts[1].chord_table)
+        # Interned - C#m7 is parsed once, and is the same chord as Dbm7.
+        self.assertEqual(self.parser.chord_index('C#m7'), self.parser.chord_index('Dbm7'))
+        # New qualities go on the end, so old indexes stay the same.
+        self.assertEqual(self.parser.qualities[-2:], ['m7/Bb', 'o7'])
+        index = self.parser.chord_index('Bbm7/Ab')
+        self.parser.chord_index('C9')
+        self.assertEqual(self.parser.chord_table.chords[index], 'Bbm7/Ab')
+
+    def test_parse_changes(self):
+        changes = __import__('blue_bossa_info').tune_info['changes']
+        self.assertEqual(self.parser.parse_changes(changes).changes, changes)
+
+    def test_repeat_without_measure(self):
+        with self.assertRaises(ChartParseException):
+            self.parser.parse_charts('% | Cm7')
+
+
+class TestOffsetSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.changes = [['Cm7'], ['Fm7'], ['Cm7'], ['Dm7b5', 'G7'], ['Cm7']]
+        rand = random.Random(1234)
+        self.num_bars = 37
+        self.measure_scores = {}
+        for measure in self.changes:
+            self.measure_scores[tuple(measure)] = np.array(
+                [rand.random() for _ in xrange(self.num_bars)])
+        self.changes_scores = np.array([self.measure_scores[tuple(measure)]
+                                        for measure in self.changes]).T
+        self.num_cycles = self.num_bars - len(self.changes)
+
+    def test_unique_measures(self):
+        measures, templates = unique_measures(self.changes)
+        self.assertEqual(measures, [('Cm7', ), ('Fm7', ), ('Dm7b5', 'G7')])
+        self.assertEqual(templates[0].tolist(), [1, 0, 1, 0, 1])
+
+    def test_fft_chorus_scores(self):
+        measures, templates = unique_measures(self.changes)
+        chorus_scores = fft_chorus_scores(
+            np.array([self.measure_scores[measure] for measure in measures]),
+            templates, self.num_cycles)
+        expected = [sum(self.changes_scores[start_bar + index, index]
+                        for index in xrange(len(self.changes)))
+                    for start_bar in xrange(self.num_cycles)]
+        self.assertEqual(len(chorus_scores), self.num_cycles)
+        for score, expected_score in zip(chorus_scores, expected):
+            self.assertAlmostEqual(score, expected_score)
+        # The best offsets are re-scored exactly.
+        global_offset_scores = fold_global_offset_scores(chorus_scores, len(self.changes))
+        refined = refine_global_offset_scores(
+            global_offset_scores, np.array([self.measure_scores[measure] for measure in measures]),
+            templates, self.num_cycles)
+        best_offset = refined.argmax()
+        self.assertEqual(refined[best_offset],
+                         sum(expected[best_offset::len(self.changes)]))
+
+    def test_rank_global_offsets(self):
+        self.assertEqual(rank_global_offsets(np.array([1.0, 3.0, 1.0, 2.0])),
+                         [(1, 3.0), (3, 2.0), (0, 1.0), (2, 1.0)])
+
+
+class TestBarMap(unittest.TestCase):
+
+    def measure_scores(self, bar_measures, num_measures=4):
+        """1 where bar n plays the unique measure in bar_measures[n], else 0."""
+        scores = np.zeros((num_measures, len(bar_measures)))
+        scores[bar_measures, np.arange(len(bar_measures))] = 1
+        return scores
+
+    def bar_map(self, bar_measures, offset, num_positions, **kwargs):
+        # A chart of 4 different measures.
+        return banded_bar_map(self.measure_scores(bar_measures), np.arange(4),
+                              offset, num_positions, **kwargs)
+
+    def test_periodic(self):
+        self.assertEqual(self.bar_map([3] + [0, 1, 2, 3] * 4, 1, 16).tolist(),
+                         range(1, 17))
+
+    def test_extra_bar(self):
+        # Bar 6 is spurious - later bars are one late.
+        self.assertEqual(self.bar_map([0, 1, 2, 3, 0, 1, 3, 2, 3, 0, 1, 2, 3], 0, 12).tolist(),
+                         [0, 1, 2, 3, 4, 5, 7, 8, 9, 10, 11, 12])
+
+    def test_missing_bar(self):
+        # Measure 2 of chorus 2 is missing - later bars are one early.
+        bar_map = self.bar_map([0, 1, 2, 3, 0, 1, 3, 0, 1, 2, 3], 0, 12)
+        self.assertEqual(bar_map.tolist()[7:], [6, 7, 8, 9, 10])
+        self.assertEqual(chorus_bar_map(bar_map, 4).shape, (3, 4))
+
+    def test_drift(self):
+        # Three spurious bars drift the map 3 bars from the grid, past the band.
+        bar_measures = [0, 1, 2, 3, 0, 1, 3, 2, 3, 0, 1, 0, 2, 3, 0, 1, 2, 3, 1, 0, 1, 2, 3]
+        bar_map = self.bar_map(bar_measures, 0, 20, band=1)
+        self.assertEqual(bar_map.tolist(),
+                         [0, 1, 2, 3, 4, 5, 7, 8, 9, 10, 12, 13, 14, 15, 16, 17,
+                          19, 20, 21, 22])
+
+    def test_repeated_measure(self):
+        # A chart of A B A C: chart measures 0 and 2 share a row.
+        measure_indexes = np.array([0, 1, 0, 2])
+        measure_scores = self.measure_scores([0, 1, 0, 2, 0, 1, 0, 2, 0, 1, 0, 2], 3)
+        changes_scores = measure_scores[measure_indexes].T
+        self.assertAlmostEqual(changes_scores_std(measure_scores, measure_indexes),
+                               changes_scores.std())
+        self.assertEqual(banded_bar_map(measure_scores, measure_indexes, 0, 12).tolist(),
+                         range(12))
+
+    def test_missing_bar_rendered_once(self):
+        # Two measures mapped to one long bar play that bar once.
+        bars = [FakeQuantum([0] * 12, start=start, duration=2.0) for start in (0.0, 2.0, 6.0)]
+        bars[1].duration = 4.0
+        audio_bars = AudioBars(None, [bars[0], bars[1], bars[1], bars[2]])
+        self.assertEqual(audio_bars.distinct_bars(), bars)
+
+
+class FakeAnalysis(object):
+    def __init__(self, beats, bars):
+        self.beats = beats
+        self.bars = bars
+        self.segments = []
+        self.tempo = {'value': 120.0, 'confidence': 0.5}
+        self.time_signature = {'value': 4, 'confidence': 1.0}
+
+
+class FakeAudioFile(object):
+    def __init__(self, beats, bars):
+        self.analysis = FakeAnalysis(beats, bars)
+
+
+class FakeAudioData(object):
+    """Samples in a numpy array, sliced by quantum like audio.AudioData."""
+    def __init__(self, data, sampleRate=1000):
+        self.data = data
+        self.sampleRate = sampleRate
+        self.numChannels = data.shape[1]
+        self.num_slices = 0
+
+    def __getitem__(self, quantum):
+        self.num_slices += 1
+        return FakeAudioData(self.data[int(quantum.start * self.sampleRate):
+                                       int((quantum.start + quantum.duration) *
+                                           self.sampleRate)],
+                             self.sampleRate)
+
+
+class TestDurationBins(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(4321)
+        durations = np.concatenate([rng.uniform(0.45, 0.55, 80),
+                                    rng.uniform(0.24, 0.26, 15),
+                                    [1.0, 2.0, 0.01]])
+        rng.shuffle(durations)
+        self.items = [FakeQuantum([0] * 12, duration=duration)
+                      for duration in durations.tolist()]
+
+    def test_greedy(self):
+        bins = Bins(self.items, engine='greedy')
+        durations = bins.primary_bin.durations
+        self.assertEqual(len(durations), 80)
+        self.assertEqual(bins.average_duration, sum(durations) / float(len(durations)))
+
+    def test_histogram(self):
+        # Same primary bin as the greedy engine.
+        bins = Bins(self.items, engine='histogram')
+        greedy_bins = Bins(self.items, engine='greedy')
+        self.assertEqual(sorted(bins.primary_bin.durations),
+                         sorted(greedy_bins.primary_bin.durations))
+        self.assertAlmostEqual(bins.average_duration, greedy_bins.average_duration)
+        self.assertEqual(sum(len(bin.durations) for bin in bins.bins), len(self.items))
+        # Vectorized membership.
+        durations = [item.duration for item in self.items]
+        self.assertEqual(bins.primary_bin.durations_in_bin(durations).tolist(),
+                         [bins.primary_bin.duration_belongs_in_bin(duration)
+                          for duration in durations])
+
+    def test_histogram_tolerance(self):
+        # 0.61 is within the histogram window of 0.5, but not within
+        # tolerance of the bin's mean.
+        rng = np.random.RandomState(1)
+        durations = np.concatenate([rng.uniform(0.495, 0.507, 1000), [0.25] * 50, [0.61] * 30])
+        rng.shuffle(durations)
+        items = [FakeQuantum([0] * 12, duration=duration) for duration in durations.tolist()]
+        bins = Bins(items, engine='histogram')
+        greedy_bins = Bins(items, engine='greedy')
+        self.assertEqual(sorted(bins.primary_bin.durations),
+                         sorted(greedy_bins.primary_bin.durations))
+        self.assertEqual(sorted(len(bin.durations) for bin in bins.bins), [30, 50, 1000])
+        for bin in bins.bins:
+            self.assertTrue(bin.durations_in_bin(bin.durations).all())
+
+    def test_profile(self):
+        # Bars slow from 2.0 to 2.2 seconds, and bar 5 is a spurious short bar.
+        durations = np.linspace(2.0, 2.2, 21)
+        durations[5] = 0.5
+        items = [FakeQuantum([0] * 12, duration=duration) for duration in durations]
+        profile = DurationProfile(durations, Bins(items).primary_bin, window=4)
+        self.assertEqual(profile.out_of_bin.tolist(), [5])
+        self.assertAlmostEqual(profile.mean_duration(0, 3), 2.015)
+        self.assertAlmostEqual(profile.mean_duration(4, 6), 2.05)
+        self.assertAlmostEqual(profile.mean_duration(5, 5), Bins(items).average_duration)
+        self.assertAlmostEqual(profile.rolling_durations[0], 2.015)
+        self.assertAlmostEqual(profile.rolling_durations[10], 2.095)
+        self.assertAlmostEqual(profile.rolling_durations[20], 2.185)
+
+
+class TestChunkCatalog(unittest.TestCase):
+
+    def setUp(self):
+        # 5 choruses of 4 bars, every bar matching its measure equally well.
+        self.chorus_bar_map = np.arange(20).reshape(5, 4)
+        # One row per measure of the chart.
+        self.measure_scores = np.zeros((4, 20))
+        self.measure_scores[np.arange(20) % 4, np.arange(20)] = 1.0
+        self.bar_loudness = np.zeros(20)
+        self.bar_conforms = np.ones(20, dtype=bool)
+        self.bar_drums = np.zeros(20, dtype=bool)
+
+    def calc_chunks(self):
+        return calc_chunks(self.chorus_bar_map, [2, 3], self.measure_scores, np.arange(4),
+                           self.bar_loudness, self.bar_conforms, self.bar_drums, 2)
+
+    def test_all_pass(self):
+        chunks = self.calc_chunks()
+        self.assertEqual(chunks['chorus'].tolist(), [2, 2, 3, 3])
+        self.assertEqual(chunks['position'].tolist(), [0, 2, 0, 2])
+        catalog = ChunkCatalog(chunks, 2)
+        self.assertEqual(catalog.choruses_at(0), [2, 3])
+        self.assertEqual(catalog.choruses_at(2), [2, 3])
+        self.assertEqual(catalog.choruses_at(1), [])
+
+    def test_thresholds(self):
+        # Chorus 2 misses the changes in its first half (a drum break),
+        # chorus 3 is quiet in its second half, and bar 12 is too long.
+        self.measure_scores[:, 8:10] = 0.0
+        self.bar_loudness[14:16] = -10.0
+        self.bar_conforms[12] = False
+        chunks = self.calc_chunks()
+        # Measures 0 and 1 score 1, 1, 0, 1, 1 over the 5 choruses: 2
+        # standard deviations below the mean for chorus 2.
+        self.assertEqual(np.round(chunks['match'], 6).tolist(), [-2.0, 0.0, 0.5, 0.0])
+        catalog = ChunkCatalog(chunks, 2)
+        self.assertEqual(catalog.choruses_at(0), [])
+        self.assertEqual(catalog.choruses_at(2), [2])
+        catalog = ChunkCatalog(self.calc_chunks(), 2, min_match=-10.0,
+                               min_loudness=-20.0, min_conformity=0.5)
+        self.assertEqual(catalog.choruses_at(0), [2, 3])
+        self.assertEqual(catalog.choruses_at(2), [2, 3])
+
+    def test_drums(self):
+        self.bar_drums[12:15] = True
+        chunks = self.calc_chunks()
+        self.assertEqual(chunks['drums'].tolist(), [0.0, 0.0, 1.0, 0.5])
+        catalog = ChunkCatalog(chunks, 2)
+        self.assertEqual(catalog.choruses_at(0), [2])
+        self.assertEqual(catalog.choruses_at(2), [2, 3])
+
+
+class TestAnalysisCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.cache_dir, 'tune.mp3')
+        out_file = open(self.filename, 'w')
+        out_file.write('not really audio')
+        out_file.close()
+        self.cache = AnalysisCache(os.path.join(self.cache_dir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_save_load(self):
+        self.assertEqual(self.cache.load(self.filename), None)
+        beats, bars = fake_beats_and_bars(3)
+        self.cache.save(self.filename, FakeAudioFile(beats, bars))
+        analysis = self.cache.load(self.filename).analysis
+        self.assertEqual(analysis.tempo, {'value': 120.0, 'confidence': 0.5})
+        self.assertEqual(analysis.time_signature['value'], 4)
+        self.assertEqual([bar.mean_pitches() for bar in analysis.bars],
+                         [bar.mean_pitches() for bar in bars])
+        self.assertEqual([beat.mean_pitches() for beat in analysis.bars[1].children()],
+                         [beat.mean_pitches() for beat in bars[1].children()])
+        self.assertTrue(analysis.bars[2].children()[0] is analysis.beats[8])
+        self.assertEqual(analysis.beats[5].mean_loudness(), -20.0)
+        # Keyed by content, not name.
+        copy_filename = os.path.join(self.cache_dir, 'copy.mp3')
+        shutil.copy(self.filename, copy_filename)
+        self.assertNotEqual(self.cache.load(copy_filename), None)
+
+    def test_refresh(self):
+        beats, bars = fake_beats_and_bars(3)
+        self.cache.save(self.filename, FakeAudioFile(beats, bars))
+        cache = AnalysisCache(self.cache.cache_dir, refresh=True)
+        self.assertEqual(cache.load(self.filename), None)
+
+
+def chart_beats_and_bars(bar_chords, seed=1234, late_beats=0):
+    """Beats and bars that sound like a chart.
+    - bar_chords: for each bar, the chord symbol of each of its 4 beats.
+    - late_beats: beats the analyzer's bar lines are late by.  Bars are then
+      4 beats from that beat, and the last part bar is left out.
+    """
+    rand = random.Random(seed)
+    beats = []
+    for chords in bar_chords:
+        for chord in chords:
+            pitches = [rand.random() * 0.3 for _ in xrange(12)]
+            for note_int in get_chord_info(chord).note_ints:
+                pitches[note_int] += 0.7
+            beats.append(FakeQuantum(pitches, start=0.5 * len(beats)))
+    bars = []
+    for first_beat in xrange(late_beats, len(beats) - 3, 4):
+        bar_beats = beats[first_beat:first_beat + 4]
+        bars.append(FakeQuantum(list(np.mean([beat.mean_pitches() for beat in bar_beats],
+                                             axis=0)),
+                                children=bar_beats, duration=2.0, start=bar_beats[0].start))
+    return beats, bars
+
+
+def save_fake_recording(cache_dir, bar_chords, late_beats=0):
+    """Write a recording that sounds like bar_chords (see
+    chart_beats_and_bars), with its analysis in an AnalysisCache in cache_dir.
+    - return: (filename, cache)
+    """
+    filename = os.path.join(cache_dir, '%d.mp3' % len(bar_chords))
+    out_file = open(filename, 'w')
+    out_file.write(filename)
+    out_file.close()
+    cache = AnalysisCache(os.path.join(cache_dir, 'cache'))
+    cache.save(filename, FakeAudioFile(*chart_beats_and_bars(bar_chords,
+                                                             late_beats=late_beats)))
+    return filename, cache
+
+
+def fake_jam_tune(cache_dir, bar_chords, tune_info, late_beats=0, **kwargs):
+    """JamTune of a recording that sounds like bar_chords, see
+    save_fake_recording().
+    - kwargs: passed on to JamTune.
+    """
+    filename, cache = save_fake_recording(cache_dir, bar_chords, late_beats)
+    return JamTune(tune_info, filename, analysis_cache=cache, **kwargs)
+
+
+class TestChartLibrary(unittest.TestCase):
+
+    def setUp(self):
+        self.changes = __import__('blue_bossa_info').tune_info['changes']
+        bar_chords = [measure * 4 for _ in xrange(6) for measure in self.changes]
+        features = AnalysisFeatures(*chart_beats_and_bars(bar_chords[5:]))
+        self.chord_likelihood = ChordLikelihood(features)
+        parser = ChordChartParser()
+        self.charts = [parser.parse_changes([['C'], ['F'], ['G'], ['C/Bb']], 'Triads'),
+                       parser.parse_changes(self.changes, 'Blue Bossa'),
+                       parser.parse_changes(half_time_changes(self.changes), 'Half time')]
+        self.chart_library = ChartLibrary(self.charts)
+
+    def test_chorus_scores(self):
+        # Each row is the diagonal sums of its chart's measure scores.
+        chorus_scores = self.chart_library.chorus_scores(self.chord_likelihood)
+        num_bars = self.chord_likelihood.features.num_bars
+        self.assertEqual(chorus_scores.shape, (3, num_bars))
+        measure_scores = [self.chord_likelihood.measure_scores(measure)
+                          for measure in self.changes]
+        expected = [sum(measure_scores[index][start_bar + index] for index in xrange(16))
+                    for start_bar in xrange(num_bars - 16)]
+        self.assertEqual(chorus_scores[1, :num_bars - 16].tolist(), expected)
+        self.assertEqual(chorus_scores[1, num_bars - 16:].tolist(), [0.0] * 16)
+
+    def test_rank(self):
+        # A chart of triads and slash chords is ranked with the rest.
+        ranked = self.chart_library.rank(self.chord_likelihood)
+        self.assertEqual(len(ranked), 3)
+        chart, offset, score = ranked[0]
+        self.assertEqual(chart.title, 'Blue Bossa')
+        self.assertEqual(offset, 11)
+        self.assertEqual(sorted(chart.title for chart, offset, score in ranked),
+                         ['Blue Bossa', 'Half time', 'Triads'])
+
+
+class TestHalfTime(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.changes = __import__('blue_bossa_info').tune_info['changes']
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def jam_tune(self, bar_chords):
+        """JamTune of the blue bossa changes, with half_time left to detect."""
+        return fake_jam_tune(self.cache_dir, bar_chords, TuneInfo({'changes': self.changes}))
+
+    def test_half_time_changes(self):
+        self.assertEqual(half_time_changes(self.changes),
+                         __import__('blue_bossa_info_half_time').tune_info['changes'])
+        self.assertEqual(half_time_changes([['C7', 'F7'], ['C7'], ['G7']]),
+                         [['C7', 'C7'], ['G7']])
+
+    def test_full_time(self):
+        bar_chords = [measure * 4 for _ in xrange(6) for measure in self.changes]
+        jam_tune = self.jam_tune(bar_chords[3:])
+        self.assertEqual(jam_tune.tune_info.half_time, False)
+        self.assertEqual(jam_tune.tune_info.chorus_num_bars, 16)
+        self.assertEqual(jam_tune.best_global_offset, 13)
+
+    def test_half_time(self):
+        # Two measures per bar.
+        bar_chords = [first * 2 + second * 2
+                      for _ in xrange(6)
+                      for first, second in zip(self.changes[::2], self.changes[1::2])]
+        jam_tune = self.jam_tune(bar_chords[3:])
+        self.assertEqual(jam_tune.tune_info.half_time, True)
+        self.assertEqual(jam_tune.tune_info.chorus_num_bars, 8)
+        self.assertEqual(jam_tune.best_global_offset, 5)
+        self.assertTrue(jam_tune.meter_scores[True][0] > jam_tune.meter_scores[False][0])
+
+    def test_duration_fit(self):
+        bar_chords = [measure * 4 for _ in xrange(6) for measure in self.changes]
+        jam_tune = self.jam_tune(bar_chords[3:])
+        self.assertEqual(jam_tune.meter_scores[False][1:], (1.0, jam_tune.meter_scores[False][0]))
+        # Bars that alternate long and short are only regular in pairs.
+        bars = [FakeQuantum([0] * 12, duration=duration) for duration in [1.5, 2.5] * 20]
+        jam_tune.duration_info = DurationInfo(bars, bars)
+        self.assertEqual(jam_tune.meter_duration_fit(0, 32, 1), 0.5)
+        self.assertEqual(jam_tune.meter_duration_fit(0, 32, 2), 1.0)
+        self.assertEqual(jam_tune.meter_duration_fit(0, 1, 2), 0.0)
+
+
+class TestJamTune(unittest.TestCase):
+    """JamTune of a fake recording: 6 choruses of blue bossa, less the first
+    3 bars, so the first full chorus starts at bar 13.
+    """
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.tune_info = TuneInfo(__import__('blue_bossa_info').tune_info)
+        bar_chords = [measure * 4 for _ in xrange(6) for measure in self.tune_info.changes]
+        self.jam_tune = fake_jam_tune(self.cache_dir, bar_chords[3:], self.tune_info)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_alignment(self):
+        self.assertEqual(self.jam_tune.best_global_offset, 13)
+        self.assertEqual(self.jam_tune.total_num_choruses, 5)
+
+    def test_beat_offsets(self):
+        # The bar lines are the analyzer's: no shift.
+        jam_tune = self.jam_tune
+        chorus_beats = 4 * jam_tune.tune_info.chorus_num_bars
+        self.assertEqual(len(jam_tune.beat_offset_scores), chorus_beats)
+        self.assertEqual(jam_tune.best_beat_offset, 4 * 13)
+        self.assertEqual(jam_tune.beat_shift, 0)
+        self.assertTrue(jam_tune.aligned_bars is jam_tune.bars)
+        self.assertEqual(jam_tune.get_nth_chorus_beats(0), jam_tune.beats[4 * 45:4 * 61])
+        # No whole chorus of beats past the end.
+        with self.assertRaises(IndexError):
+            jam_tune.get_nth_chorus_beats(3)
+
+    def test_late_bar_lines(self):
+        # The analyzer's bar lines are a beat late.  Spliced bars start a
+        # beat earlier, where the beat level alignment puts the chorus.
+        bar_chords = [measure * 4 for _ in xrange(6) for measure in self.tune_info.changes]
+        jam_tune = fake_jam_tune(self.cache_dir, bar_chords[3:], self.tune_info,
+                                 late_beats=1)
+        self.assertEqual(jam_tune.best_global_offset, 13)
+        self.assertEqual(jam_tune.bars[13].start, 26.5)
+        self.assertEqual(jam_tune.best_beat_offset, 4 * 13)
+        self.assertEqual(jam_tune.beat_shift, -1)
+        solo_bars = jam_tune.get_nth_chorus_bars(0)
+        solo_beats = jam_tune.get_nth_chorus_beats(0)
+        self.assertEqual(solo_bars[0].start, 90.0)
+        self.assertEqual(solo_bars[0].start, solo_beats[0].start)
+        self.assertEqual([beat for bar in solo_bars for beat in bar.children()], solo_beats)
+        self.assertEqual([bar.duration for bar in solo_bars], [2.0] * 16)
+        self.assertEqual(jam_tune.head_bars[0].start, 26.0)
+        self.assertEqual(jam_tune.chorus_index['start'][0], 26.0)
+        # Rendered from the moved bar lines.
+        audio_data = FakeAudioData(np.zeros((200000, 2), dtype=np.int16), 1000)
+        self.assertEqual(AudioBars(audio_data, solo_bars[:1]).sample_ranges(),
+                         [(90000, 92000)])
+        # Before the first beat, a bar stays as it is.
+        self.assertTrue(jam_tune.shifted_bars(-2)[0] is jam_tune.bars[0])
+        self.assertEqual(jam_tune.shifted_bars(-1)[0].start, 0.0)
+
+    def test_bar_lists(self):
+        # Built once per alignment.
+        jam_tune = self.jam_tune
+        self.assertTrue(jam_tune.valid_bars is jam_tune.valid_bars)
+        self.assertTrue(jam_tune.solo_bars is jam_tune.chorus_bars_with_role(ROLE_SOLO))
+        self.assertEqual(jam_tune.valid_bars, jam_tune.bars[13:93])
+        self.assertEqual(jam_tune.head_bars, jam_tune.bars[13:29])
+        self.assertEqual(jam_tune.solo_bars, jam_tune.bars[45:77])
+        self.assertEqual(jam_tune.head_out_bars, jam_tune.bars[77:93])
+        valid_bars = jam_tune.valid_bars
+        jam_tune.match_all_changes()
+        self.assertFalse(jam_tune.valid_bars is valid_bars)
+        self.assertEqual(jam_tune.valid_bars, valid_bars)
+
+    def test_short_recording(self):
+        # Too short for a chorus: no bars, as before the chorus index.
+        bar_chords = [measure * 4 for measure in self.tune_info.changes[:10]]
+        jam_tune = fake_jam_tune(self.cache_dir, bar_chords, self.tune_info)
+        self.assertEqual(jam_tune.total_num_choruses, 0)
+        self.assertEqual(jam_tune.valid_bars, [])
+        self.assertEqual(jam_tune.head_bars, [])
+        self.assertEqual(jam_tune.head_out_bars, [])
+        self.assertEqual(jam_tune.solo_bars, [])
+        # Nor a chorus of beats.
+        self.assertEqual(jam_tune.best_beat_offset, None)
+        self.assertEqual(jam_tune.beat_shift, None)
+        with self.assertRaises(IndexError):
+            jam_tune.get_nth_chorus_beats(0)
+
+    def test_chorus_scores(self):
+        # Diagonal sums give exactly the match_chorus scores.
+        jam_tune = self.jam_tune
+        self.assertEqual(jam_tune.chorus_scores.tolist(),
+                         [jam_tune.match_chorus(start_bar)
+                          for start_bar in xrange(len(jam_tune.chorus_scores))])
+        chorus_len = jam_tune.tune_info.chorus_num_bars
+        for global_offset in xrange(chorus_len):
+            self.assertEqual(jam_tune.global_offset_scores[global_offset],
+                             sum(jam_tune.chorus_scores[global_offset::chorus_len]))
+        self.assertEqual(jam_tune.best_global_offset,
+                         jam_tune.global_offset_scores.argmax())
+
+    def test_chorus_bar_map(self):
+        jam_tune = self.jam_tune
+        chorus_len = jam_tune.tune_info.chorus_num_bars
+        self.assertEqual(jam_tune.chorus_bar_map.shape,
+                         (jam_tune.total_num_choruses, chorus_len))
+        # No spurious or missing bars - the global offset grid.
+        self.assertEqual(jam_tune.chorus_bar_map.tolist(),
+                         np.arange(13, 93).reshape(5, 16).tolist())
+        self.assertEqual(len(jam_tune.get_nth_chorus_bars(0)), chorus_len)
+
+    def test_chorus_index(self):
+        jam_tune = self.jam_tune
+        chorus_index = jam_tune.chorus_index
+        chorus_len = jam_tune.tune_info.chorus_num_bars
+        num_choruses = len(chorus_index)
+        self.assertEqual(chorus_index['chorus'].tolist(), range(num_choruses))
+        self.assertEqual(chorus_index['role'].tolist(),
+                         ['head', 'head'] + ['solo'] * (num_choruses - 3) + ['head_out'])
+        self.assertEqual(jam_tune.num_solo_choruses, num_choruses - 3)
+        self.assertTrue((chorus_index['end'] > chorus_index['start']).all())
+        # Bars are 2 seconds long.
+        self.assertEqual(chorus_index[0][['start', 'end']].tolist(), (26.0, 58.0))
+        first_bar = jam_tune.bars[chorus_index['first_bar'][2]]
+        self.assertTrue(jam_tune.get_nth_chorus_bars(0)[0] is first_bar)
+        self.assertTrue(jam_tune.solo_bars[0] is first_bar)
+        self.assertEqual(len(jam_tune.valid_bars), num_choruses * chorus_len)
+        self.assertEqual(len(jam_tune.get_nth_bar_of_random_solo_chorus(4, 8)), 8)
+
+    def test_local_tempo(self):
+        jam_tune = self.jam_tune
+        first_bar, last_bar = jam_tune.chorus_index[0][['first_bar', 'last_bar']]
+        bars = jam_tune.bars[first_bar:last_bar + 1]
+        self.assertAlmostEqual(jam_tune.chorus_index['tempo'][0],
+                               60.0 * 4 * len(bars) / sum(bar.duration for bar in bars))
+        # 4 beats in 2 second bars.
+        self.assertAlmostEqual(jam_tune.local_tempo(13, 28), 120.0)
+
+    def test_compact_state(self):
+        # What a --jobs worker sends back rebuilds the same alignment.
+        jam_tune = self.jam_tune
+        state = pickle.loads(pickle.dumps(jam_tune.compact_state(), 2))
+        jam_two = JamTune(self.tune_info, jam_tune.input_filename, state=state)
+        self.assertEqual(jam_two.best_global_offset, jam_tune.best_global_offset)
+        # Nothing is scored again.
+        chord_likelihood = jam_two.chord_likelihood
+        self.assertEqual(chord_likelihood.bar_scores.tolist(),
+                         jam_tune.chord_likelihood.bar_scores.tolist())
+        self.assertEqual(sorted(chord_likelihood._measure_scores),
+                         sorted(jam_tune.chord_likelihood._measure_scores))
+        self.assertEqual(jam_two.duration_info.bar_profile.in_bin.tolist(),
+                         jam_tune.duration_info.bar_profile.in_bin.tolist())
+        self.assertEqual(jam_two.drum_bars.tolist(), jam_tune.drum_bars.tolist())
+        self.assertEqual(jam_two.chorus_index.tolist(), jam_tune.chorus_index.tolist())
+        self.assertEqual([bar.start for bar in jam_two.solo_bars],
+                         [bar.start for bar in jam_tune.solo_bars])
+        self.assertEqual([bar.start for bar in jam_two.valid_bars],
+                         [bar.start for bar in jam_tune.valid_bars])
+
+    def test_render_audio_bars(self):
+        # Each bar's int(duration * sampleRate) samples, from its first sample.
+        jam_tune = self.jam_tune
+        # int16 samples, as audio.AudioData holds them.
+        audio_data = FakeAudioData((np.arange(200000 * 2) % 30000).astype(np.int16)
+                                   .reshape(200000, 2), 999)
+        # The last chunk repeats a bar, as after a missing bar.
+        solo_bars = jam_tune.get_nth_chorus_bars(0)
+        all_audio_bars = [AudioBars(audio_data, jam_tune.head_bars),
+                          AudioBars(audio_data, solo_bars),
+                          AudioBars(audio_data, solo_bars[4:6] + solo_bars[5:7])]
+        rendered = render_audio_bars(all_audio_bars)
+        bars = jam_tune.head_bars + solo_bars + solo_bars[4:7]
+        pieces = [audio_data.data[int(bar.start * 999):
+                                  int(bar.start * 999) + int(bar.duration * 999)]
+                  for bar in bars]
+        self.assertEqual(rendered.endindex, sum(len(piece) for piece in pieces))
+        self.assertTrue(np.array_equal(rendered.data[:rendered.endindex],
+                                       np.concatenate(pieces)))
+        # Sliced a bar at a time.
+        self.assertEqual(audio_data.num_slices, len(bars))
+
+    def test_linear_scorer_keys(self):
+        # Weights the same to 6 digits have the same name, but each has its
+        # own chord likelihood.
+        jam_tune = self.jam_tune
+        scorer = LinearScorer((1, 1, 1, 1, 2))
+        close_scorer = LinearScorer((1, 1, 1, 1, 2.0000001))
+        self.assertEqual(scorer.name, close_scorer.name)
+        self.assertNotEqual(scorer.key, close_scorer.key)
+        jam_tune.set_scorer(scorer)
+        jam_tune.set_scorer(close_scorer)
+        self.assertTrue(jam_tune.chord_likelihood.scorer is close_scorer)
+        self.assertFalse(jam_tune.get_chord_likelihood(scorer) is jam_tune.chord_likelihood)
+        # The same weights as v4 score the same.
+        self.assertTrue(jam_tune.get_chord_likelihood(scorer) is
+                        jam_tune.get_chord_likelihood('v4'))
+
+    def test_fft_align_mode(self):
+        # The same best offset, scored exactly, from the unique measures only.
+        jam_tune = self.jam_tune
+        global_offset_scores = jam_tune.global_offset_scores
+        jam_tune.align_mode = 'fft'
+        # No bar x measure matrix, for the offsets, the bar map or the chunks.
+        changes_scores = jam_tune.chord_likelihood.changes_scores
+        jam_tune.chord_likelihood.changes_scores = None
+        jam_tune.match_all_changes()
+        jam_tune.chunk_catalog(4)
+        jam_tune.chord_likelihood.changes_scores = changes_scores
+        self.assertEqual(jam_tune.chorus_bar_map[0].tolist(), range(13, 29))
+        self.assertEqual(jam_tune.best_global_offset, 13)
+        self.assertEqual(jam_tune.ranked_global_offsets[0], (13, global_offset_scores[13]))
+        self.assertEqual(jam_tune.chorus_scores, None)
+        for score, expected_score in zip(jam_tune.global_offset_scores,
+                                         global_offset_scores):
+            self.assertAlmostEqual(score, expected_score)
+
+    def test_set_tune_info(self):
+        # Changing the chart re-aligns without re-scoring any chord.
+        jam_tune = self.jam_tune
+        chorus_scores = jam_tune.chorus_scores
+        chord_likelihood = jam_tune.chord_likelihood
+        quality_scores = dict(chord_likelihood.quality_scores)
+        cm7_scores = chord_likelihood.measure_scores(['Cm7'])
+        # The meter is chosen again, for a chart that leaves it open.
+        self.assertEqual(jam_tune.meter_scores, None)
+        tune_info = dict(self.tune_info.tune_info)
+        tune_info['half_time'] = HALF_TIME_AUTO
+        jam_tune.set_tune_info(TuneInfo(tune_info))
+        self.assertEqual(jam_tune.tune_info.half_time, False)
+        self.assertEqual(sorted(jam_tune.meter_scores.keys()), [False, True])
+        self.assertEqual(jam_tune.best_global_offset, 13)
+        self.assertEqual(jam_tune.chorus_scores.tolist(), chorus_scores.tolist())
+        # A chart that sets half_time drops the last chart's meter scores.
+        jam_tune.set_tune_info(TuneInfo(__import__('blue_bossa_info_half_time').tune_info))
+        self.assertEqual(jam_tune.tune_info.chorus_num_bars, 8)
+        self.assertEqual(jam_tune.chorus_bar_map.shape[1], 8)
+        self.assertEqual(jam_tune.meter_scores, None)
+        self.assertTrue(jam_tune.chord_likelihood is chord_likelihood)
+        self.assertEqual(chord_likelihood.quality_scores, quality_scores)
+        self.assertTrue(chord_likelihood.measure_scores(['Cm7']) is cm7_scores)
+        # New chords get rows, scored into the existing matrices.
+        num_chords = chord_likelihood.num_chords
+        beat_scores = chord_likelihood.beat_scores
+        jam_tune.set_tune_info(TuneInfo({'changes': [['Cm7'], ['F7'], ['BbM7'], ['BbM7']],
+                                         'half_time': False}))
+        self.assertEqual(chord_likelihood.num_chords, num_chords + 2)
+        self.assertEqual(chord_likelihood.chords[num_chords:], ['BbM7', 'F7'])
+        self.assertEqual(chord_likelihood.beat_scores[:num_chords].tolist(),
+                         beat_scores.tolist())
+        self.assertTrue(chord_likelihood.measure_scores(['Cm7']) is cm7_scores)
+    def test_fitted_weights(self):
+        # Weights fit at the known offset rank the chart's chord first on
+        # every bar, and find the offset again.  Their opposite doesn't.
+        jam_tune = self.jam_tune
+        labeled = LabeledRecording(jam_tune.features, jam_tune.tune_info, 13)
+        weights = fit_weights([labeled], ridge=0.1)
+        rows = labeled.bar_labels >= 0
+        bar_scores = np.array([np.dot(labeled.chord_features(chord)[1][rows], weights)
+                               for chord in labeled.chords])
+        self.assertEqual(bar_scores.argmax(axis=0).tolist(), labeled.bar_labels[rows].tolist())
+        self.assertEqual(offset_accuracy([jam_tune], [13], weights), 1.0)
+        self.assertEqual(offset_accuracy([jam_tune], [13], [-weight for weight in weights]), 0.0)
+
+
+class TestJammer(unittest.TestCase):
+    """Jammer of two fake recordings of blue bossa, one starting 3 bars into
+    the chart and one 5 bars in.
+    """
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        changes = __import__('blue_bossa_info').tune_info['changes']
+        bar_chords = [measure * 4 for _ in xrange(6) for measure in changes]
+        filenames = []
+        for start in (3, 5):
+            filename, cache = save_fake_recording(self.cache_dir, bar_chords[start:])
+            filenames.append(filename)
+        self.jammer = Jammer('blue_bossa_info', filenames,
+                             os.path.join(self.cache_dir, 'jam.wav'), analysis_cache=cache)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def chunk_choices(self, position, num_bars=4):
+        """(audio file, bars) of every passing chunk at position, of each tune."""
+        return [(jam_tune.audio_analysis,
+                 jam_tune.chorus_bars[number][position:position + num_bars])
+                for jam_tune in self.jammer.jam_tunes
+                for number in jam_tune.chunk_catalog(num_bars).choruses_at(position)]
+
+    def test_generate_solo_chorus(self):
+        # Every chunk comes from the catalogs of passing chunks, of both tunes.
+        random.seed(1)
+        self.assertEqual([jam_tune.best_global_offset for jam_tune in self.jammer.jam_tunes],
+                         [13, 11])
+        chorus = self.jammer.generate_solo_chorus(4)
+        self.assertEqual(len(chorus), 4)
+        for position, audio_bars in zip(xrange(0, 16, 4), chorus):
+            choices = self.chunk_choices(position)
+            self.assertTrue(choices)
+            self.assertTrue((audio_bars.audio_analysis, audio_bars.bars) in choices)
+        # Both tunes can be picked from.
+        choices = self.jammer.get_chunk_choices(4)
+        self.assertEqual(sorted(set(id(jam_tune) for jam_tune, _ in choices[0])),
+                         sorted(id(jam_tune) for jam_tune in self.jammer.jam_tunes))
+
+    def test_same_meter(self):
+        # A tune in half time is left out of a full time jam.
+        jam_one, jam_two = self.jammer.jam_tunes
+        jam_two.set_tune_info(TuneInfo(__import__('blue_bossa_info_half_time').tune_info))
+        self.assertEqual(self.jammer.get_same_meter_jam_tunes(), [jam_one])
+        for audio_bars in self.jammer.generate_solo_chorus(4):
+            self.assertTrue(audio_bars.audio_analysis is jam_one.audio_analysis)
+            self.assertEqual(len(audio_bars.bars), 4)
+
+    def test_no_passing_chunks(self):
+        # Chunks come from any solo chorus, when none pass.
+        self.jammer.chunk_thresholds = {'min_match': 100.0}
+        self.assertEqual(self.jammer.get_chunk_choices(4), {})
+        for position, audio_bars in zip(xrange(0, 16, 4), self.jammer.generate_solo_chorus(4)):
+            choices = [(jam_tune.audio_analysis, bars[position:position + 4])
+                       for jam_tune in self.jammer.jam_tunes
+                       for bars in [jam_tune.get_nth_chorus_bars(index)
+                                    for index in xrange(jam_tune.num_solo_choruses)]]
+            self.assertTrue((audio_bars.audio_analysis, audio_bars.bars) in choices)
+
+
 class TestJammerFullTime(unittest.TestCase):
     """Tests where tempo is correct.
     - eg Bob Mintzer
@@ -890,6 +2115,26 @@ class TestJammerFullTime(unittest.TestCase):
         self.assertEqual(len(jam_one.tune_info.unique_chords), 7)
         self.assertEqual(jam_one.time_signature['value'], 4)
 
+    def test_identify_charts(self):
+        # The right chart, at the same offset and score as the alignment.
+        jam_one = self.jammer.jam_tunes[0]
+        charts = ChordChartParser().parse_charts(CHARTS)
+        half_time = ChordChartParser().parse_changes(
+            __import__('blue_bossa_info_half_time').tune_info['changes'], 'Half time')
+        chart_library = ChartLibrary([charts[1], half_time, charts[0]])
+        chorus_scores = chart_library.chorus_scores(jam_one.chord_likelihood)
+        self.assertEqual(chorus_scores[2, :len(jam_one.chorus_scores)].tolist(),
+                         jam_one.chorus_scores.tolist())
+        ranked = jam_one.identify_charts(chart_library)
+        self.assertEqual(len(ranked), 3)
+        chart, offset, score = ranked[0]
+        self.assertEqual(chart.title, 'Blue Bossa')
+        self.assertEqual(offset, jam_one.best_global_offset)
+        num_choruses = len(xrange(offset, len(jam_one.chorus_scores), 16))
+        self.assertAlmostEqual(score, jam_one.global_offset_scores[offset] /
+                               (num_choruses * 16))
+
+
 
 OUT = """
 class TestJammerHalfTime(unittest.TestCase):
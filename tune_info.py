@@ -15,10 +15,37 @@
      Co    [0, 3, 6, 9]
  - key.  Presumably audio analysis uses same numbers.
    (c, c-sharp, d, e-flat, e, f, f-sharp, g, a-flat, a, b-flat, b) 0 - 11
+ - half_time: True if the analyzer's bars hold two measures of the changes,
+   as in blue_bossa_info_half_time.  HALF_TIME_AUTO (or no 'half_time') lets
+   JamTune pick, per recording, between the changes as written and
+   half_time_changes() of them.
 '''
 
 from chord import ChordInfo
 from chord import get_chord_info
+from scorers import DEFAULT_SCORER
+
+HALF_TIME_AUTO = 'auto'
+
+
+def half_time_changes(changes):
+    """Merge each two measures of changes into one, for half time.
+    - ['Cm7'], ['Cm7'] -> ['Cm7'].  ['Dm7b5'], ['G7'] -> ['Dm7b5', 'G7'].
+    - A measure holds at most two chords, so if a pair has more, each half
+      keeps only its first chord.
+    """
+    merged = []
+    for index in xrange(0, len(changes), 2):
+        pair = changes[index:index + 2]
+        chords = []
+        for chord in [chord for measure in pair for chord in measure]:
+            if chords == [] or chords[-1] != chord:
+                chords.append(chord)
+        if len(chords) > 2:
+            chords = [measure[0] for measure in pair]
+        merged.append(chords)
+    return merged
+
 
 class TuneInfo(object):
     def __init__(self, tune_info):
@@ -32,6 +59,27 @@ class TuneInfo(object):
     def chorus_num_bars(self):
         return(len(self.changes))
 
+    @property
+    def scorer(self):
+        """Name of the scorer to match this tune with - see scorers.py."""
+        return(self.tune_info.get('scorer', DEFAULT_SCORER))
+
+    @property
+    def half_time(self):
+        """True, False or HALF_TIME_AUTO."""
+        return(self.tune_info.get('half_time', HALF_TIME_AUTO))
+
+    def with_half_time(self, half_time):
+        """TuneInfo for this tune with half_time set.  If the changes are
+        written full time (half_time False or HALF_TIME_AUTO), half time
+        merges them with half_time_changes().
+        """
+        tune_info = dict(self.tune_info)
+        if half_time and self.half_time != True:
+            tune_info['changes'] = half_time_changes(self.changes)
+        tune_info['half_time'] = half_time
+        return TuneInfo(tune_info)
+
 
     def parse_measure(self, measure):
         """Parse one measure of chords, and return a dict representation of that measure.
@@ -67,7 +115,7 @@ class TuneInfo(object):
             # Be sure we have clean changes with whitespace removed.
             # chord = chord_info.chord_info['chord']
             # List of chords for this measure
-            chords = [chord_info.chord_info['chord'] 
+            chords = [chord_info.chord 
                       for chord_info in measure_chord_info_list]
             # changes.append(chord)
             changes.append(chords)